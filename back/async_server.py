@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+from collections import deque
+import logging
+import os
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+
+from game import Game, SimulationRunner
+from commands import GameUserError, MAX_MESSAGE_SIZE, decode_message
+from map_generators import SquareMapGenerator
+from messages import encode_message
+from metrics import MetricsServer, SamplingProfiler
+from snapshots import CommandLog, SnapshotWriter, load_latest, read_log, replay, restore
+
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Hands messages over from the simulation thread to the event loop.
+
+    Posting never blocks and the loop is woken up once per burst of messages,
+    not once per message.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.messages = deque()  # (connection, type, encoded message)
+        self.scheduled = False
+
+    def post(self, connection, type, message):
+        self.messages.append((connection, type, message))
+        if not self.scheduled:
+            self.scheduled = True
+            self.loop.call_soon_threadsafe(self.deliver)
+
+    def deliver(self):
+        self.scheduled = False
+        while self.messages:
+            connection, type, message = self.messages.popleft()
+            connection.enqueue(type, message)
+
+
+class AsyncConnectionHandler:
+    """Connection of a single player with a bounded queue of outgoing messages.
+
+    When the client doesn't keep up and the queue fills, then depending on
+    server's `slow_consumer_policy` either queued unit updates are dropped and
+    the player gets full state in the next frame ('coalesce'), or the client
+    is disconnected ('disconnect').
+    """
+
+    def __init__(self, server, websocket):
+        self.server = server
+        self.websocket = websocket
+        self.player_id = None
+        self.queue = deque()  # (type, encoded message)
+        self.ready = asyncio.Event()
+        self.closing = False
+
+    def send(self, type, data):
+        self.send_encoded(type, encode_message(type, data))
+
+    def send_encoded(self, type, message):
+        # may be called from any thread
+        self.server.outbox.post(self, type, message)
+
+    def enqueue(self, type, message):
+        if self.closing:
+            return
+        if len(self.queue) >= self.server.max_queue and self.server.slow_consumer_policy == 'coalesce':
+            self.queue = deque(m for m in self.queue if m[0] != 'units')
+            self.server.game.request_resync(self.player_id)
+            if type == 'units':
+                return  # the resync carries newer state anyway
+        if len(self.queue) >= self.server.max_queue:
+            logger.info('disconnecting slow client %s', self.websocket.remote_address)
+            self.closing = True
+            self.queue.clear()
+            asyncio.ensure_future(self.websocket.close(1008, 'Too slow'))
+            return
+        self.queue.append((type, message))
+        self.ready.set()
+
+    async def write(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                type, message = self.queue.popleft()
+                await self.websocket.send(message)
+
+    async def handle(self):
+        loop = asyncio.get_running_loop()
+        try:
+            logger.debug('new client connected')
+            # returning player connects to ws://host:port/?token=<session token>
+            token = parse_qs(urlsplit(self.websocket.request.path).query).get('token', [None])[0]
+            self.player_id = await loop.run_in_executor(None, self.with_game_lock, self.server.game.join, self, token)
+        except:  # noqa E722
+            logger.exception('error during establishing new user connection')
+            return
+
+        writer = asyncio.ensure_future(self.write())
+        try:
+            async for data in self.websocket:
+                await self.handle_message(data)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            writer.cancel()
+            self.closing = True
+            await loop.run_in_executor(None, self.with_game_lock, self.server.game.disconnect, self.player_id, self)
+            logger.debug('client %s closed', self.websocket.remote_address)
+
+    async def handle_message(self, data):
+        # commands are only validated and queued here, the game applies them in its own thread - validation
+        # may take long (routes are planned then), so it runs in an executor and the loop is left to I/O
+        try:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.submit_commands, data)
+            except GameUserError as e:
+                self.send('error', str(e))
+                return
+
+        except:  # noqa E722
+            logger.exception('error during handling user data')
+            await self.websocket.close(1011, 'Internal server error')
+
+    def submit_commands(self, data):
+        self.server.game.submit_commands(self.player_id, decode_message(data))
+
+    def with_game_lock(self, f, *args):
+        with self.server.game.lock:
+            return f(*args)
+
+
+class AsyncGameServer:
+    def __init__(self, game, host, port, max_queue=64, slow_consumer_policy='coalesce'):
+        assert slow_consumer_policy in ('coalesce', 'disconnect')
+        self.game = game
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue  # messages waiting for a single client
+        self.slow_consumer_policy = slow_consumer_policy
+        self.outbox = None
+
+    async def handle(self, websocket):
+        await AsyncConnectionHandler(self, websocket).handle()
+
+    async def serve_forever(self):
+        self.outbox = Outbox(asyncio.get_running_loop())
+        # larger frames are refused by the protocol, without buffering them
+        async with websockets.serve(self.handle, self.host, self.port, max_size=MAX_MESSAGE_SIZE):
+            await asyncio.get_running_loop().create_future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the game server on asyncio.')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-queue', type=int, default=64, help='outgoing messages queued per client')
+    parser.add_argument('--slow-consumer', choices=('coalesce', 'disconnect'), default='coalesce')
+    parser.add_argument('--rate-updates', action='store_true', help='send rates of change, clients extrapolate')
+    parser.add_argument('--broadcast-dt', type=float, default=0, help='minimal time between broadcasts, in seconds')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics at localhost:PORT/metrics')
+    parser.add_argument('--profile-interval', type=float, help='sample simulation stacks this often (seconds), served at /profile')
+    parser.add_argument('--snapshot-dir', help='write snapshots there and restore the game from them on start')
+    parser.add_argument('--snapshot-interval', type=int, default=300, help='frames between snapshots')
+    parser.add_argument('--command-log', help='log commands there and replay them after the snapshot on start')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    logger.info('starting the server at %s:%d', args.host, args.port)
+    game = Game(
+        nodes=SquareMapGenerator(
+            x=5, y=5, distance=25,
+            production=20, throughput=1,
+        ).generate(),
+        decay_rate=0.1,
+        starting_units=10,
+        offensive_force=1,
+        rate_updates=args.rate_updates,
+    )
+    game.terrain.encoded_info  # encode terrain before clients ask for it
+    snapshot = load_latest(args.snapshot_dir) if args.snapshot_dir else None
+    if snapshot is not None:
+        restore(game, snapshot)
+    if args.command_log:
+        if os.path.exists(args.command_log):
+            with open(args.command_log) as f:
+                replay(game, read_log(f))
+        game.command_log = CommandLog.open(args.command_log)
+    for player_id in list(game.players):
+        game.disconnect(player_id)  # until they come back
+    if game.frame:
+        logger.info('restored the game at frame %d with %d players', game.frame, len(game.players))
+    snapshots = None
+    if args.snapshot_dir:
+        snapshots = SnapshotWriter(args.snapshot_dir, args.snapshot_interval)
+        snapshots.start()
+    runner = SimulationRunner(
+        game, 1 / 5, fixed_timestep=True, max_broadcast_interval=4, broadcast_dt=args.broadcast_dt,
+        snapshots=snapshots, daemon=True,
+    )
+    runner.start()
+    if args.metrics_port is not None:
+        profiler = None
+        if args.profile_interval:
+            profiler = SamplingProfiler(runner, args.profile_interval)
+            profiler.start()
+        MetricsServer(game.metrics, port=args.metrics_port, profiler=profiler).start()
+    server = AsyncGameServer(
+        game, args.host, args.port,
+        max_queue=args.max_queue,
+        slow_consumer_policy=args.slow_consumer,
+    )
+    asyncio.run(server.serve_forever())
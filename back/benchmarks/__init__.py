@@ -0,0 +1,27 @@
+"""Performance benchmarks, run them from the `back` directory - all at once by `python -m benchmarks`."""
+import timeit
+
+
+def measure(f, min_time=0.2, repeat=3):
+    """Return time of a single call of `f` in seconds, the best of `repeat` runs of at least `min_time`."""
+    timer = timeit.Timer(f)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def result(name, params, value, unit='s', **extra):
+    """Record of a benchmark, its `value` in `unit` is compared between runs, lower is better.
+
+    Times are in seconds ('s'), other measures tell their unit, e.g. bytes ('B').
+    """
+    return {'name': name, 'params': params, 'value': value, 'unit': unit, **extra}
+
+
+def format_value(r, value=None):
+    """Measure of a result (or `value` in its unit) for printing - times in ms."""
+    value = r['value'] if value is None else value
+    unit = r.get('unit', 's')
+    if unit == 's':
+        return '{:.4f} ms'.format(value * 1000)
+    return '{:.1f} {}'.format(value, unit)
@@ -0,0 +1,124 @@
+"""Run the benchmark suite, save results as JSON and compare them with a previous run.
+
+Run from the `back` directory:
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --output new.json --compare results.json  # fails on regressions
+
+The end-to-end load benchmark starts a local server and connects simulated
+clients to it, it runs only with `--only load` or `--load`.
+"""
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import platform
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks import format_value, result
+
+
+SUITES = ('simulation', 'validation', 'broadcast', 'maps', 'routing', 'integrators', 'memory')
+
+
+def load_results(quick=False, port=8765):
+    from benchmarks import load
+
+    clients, duration = (50, 5) if quick else (200, 20)
+    server = subprocess.Popen(
+        [sys.executable, 'async_server.py', '--port', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('localhost', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        stats = asyncio.run(load.run('ws://localhost:{}/ws'.format(port), clients, duration, 100))
+    finally:
+        server.terminate()
+        server.wait()
+    # time between updates of the slowest client - the lower the better, like all the others
+    seconds = duration / stats['min_messages_per_client'] if stats['min_messages_per_client'] else float('inf')
+    yield result('load', {'clients': clients}, seconds, **stats)
+
+
+def key(r):
+    return (r['name'], json.dumps(r['params'], sort_keys=True))
+
+
+def format_params(params):
+    return ' '.join('{}={}'.format(k, v) for k, v in params.items())
+
+
+def compare(results, baseline, threshold):
+    """Print ratios of values to the baseline, return number of regressions beyond threshold."""
+    old = {key(r): r for r in baseline['results']}
+    regressions = 0
+    print()
+    print('{:<20} {:<60} {:>14} {:>14} {:>8}'.format('benchmark', 'params', 'old', 'new', 'ratio'))
+    for r in results:
+        o = old.get(key(r))
+        if o is None or o.get('unit', 's') != r['unit']:
+            continue
+        old_value = o['value'] if 'value' in o else o['seconds']  # saved before results had units, times only
+        ratio = r['value'] / old_value if old_value > 0 else float('inf')
+        regressed = ratio > 1 + threshold
+        regressions += regressed
+        print('{:<20} {:<60} {:>14} {:>14} {:>8.2f}{}'.format(
+            r['name'], format_params(r['params']), format_value(r, old_value), format_value(r), ratio,
+            '  REGRESSION' if regressed else '',
+        ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run benchmarks and compare them with a previous run.')
+    parser.add_argument('--only', help='comma separated suites: {}, load'.format(', '.join(SUITES)))
+    parser.add_argument('--load', action='store_true', help='run also the end-to-end load benchmark')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes only')
+    parser.add_argument('--output', help='file to save results to, as JSON')
+    parser.add_argument('--compare', help='results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown considered a regression, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    suites = args.only.split(',') if args.only else list(SUITES) + (['load'] if args.load else [])
+    results = []
+    for suite in suites:
+        if suite == 'load':
+            suite_results = load_results(args.quick)
+        else:
+            suite_results = importlib.import_module('benchmarks.' + suite).results(args.quick)
+        for r in suite_results:
+            print('{:<20} {:<60} {:>14}'.format(r['name'], format_params(r['params']), format_value(r)), flush=True)
+            results.append(r)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'quick': args.quick,
+                'results': results,
+            }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print('{} regressions'.format(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
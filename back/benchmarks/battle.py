@@ -0,0 +1,54 @@
+"""Scaling of `Node.do_frame` with the number of players contesting a node.
+
+Run from the `back` directory:
+
+    python -m benchmarks.battle
+"""
+import random
+import timeit
+
+from game import Game, Node
+
+
+def quadratic_battle(node, game, dt):
+    """The battle step as it used to be - every attacker against every defender."""
+    total_units = sum(node.units.values())
+    new_units = dict(node.units)
+    for attacker_id, attacker_units in node.units.items():
+        other_units = total_units - attacker_units
+        for defender_id, defender_units in node.units.items():
+            if attacker_id != defender_id:
+                new_units[defender_id] -= attacker_units * (defender_units / other_units) * dt * game.offensive_force
+    return new_units
+
+
+def contested_node(players):
+    node = Node(id='node', x=0, y=0, production=3, connections={})
+    rnd = random.Random(players)
+    units = {'player{}'.format(i): rnd.uniform(1, 100) for i in range(players)}
+    game = Game({'node': node}, decay_rate=0.1, starting_units=1, offensive_force=1)
+    return game, node, units
+
+
+def run(player_counts=(1, 2, 5, 10, 20, 30, 50, 100), number=1000):
+    print('{:>8} {:>16} {:>22}'.format('players', 'do_frame [us]', 'quadratic battle [us]'))
+    for players in player_counts:
+        game, node, units = contested_node(players)
+
+        def do_frame():
+            node.units = units
+            node.do_frame(game, 0.2)
+
+        def battle():
+            node.units = units
+            quadratic_battle(node, game, 0.2)
+
+        print('{:>8} {:>16.1f} {:>22.1f}'.format(
+            players,
+            min(timeit.repeat(do_frame, number=number, repeat=3)) / number * 1e6,
+            min(timeit.repeat(battle, number=number, repeat=3)) / number * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,41 @@
+"""Cost of serializing and sending out a frame's updates.
+
+All nodes of a busy game are broadcast to every player, in JSON or binary,
+to everybody or with interest management. Run from the `back` directory:
+
+    python -m benchmarks.broadcast
+"""
+from benchmarks import measure, result
+from benchmarks.simulation import busy_game
+
+
+def broadcast_frame(size, players, protocol, interest_radius):
+    game = busy_game(size, players, interest_radius=interest_radius)
+    for player_id in game.players:
+        game.set_protocol(player_id, protocol)
+    game.resync_requests.clear()
+    nodes = list(game.nodes.values())
+
+    def broadcast():
+        for node in nodes:
+            node.broadcast_units = {}  # so that all of them are sent
+        game.broadcast_changes(nodes)
+    return result('broadcast_frame', {
+        'size': size,
+        'players': players,
+        'protocol': protocol,
+        'interest_radius': interest_radius,
+    }, measure(broadcast))
+
+
+def results(quick=False):
+    for size in (10, 30):
+        for players in (2, 20):
+            for protocol in ('json', 'binary'):
+                for interest_radius in (None, 2):
+                    yield broadcast_frame(size, players, protocol, interest_radius)
+
+
+if __name__ == '__main__':
+    for r in results():
+        print(r)
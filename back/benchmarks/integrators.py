@@ -0,0 +1,85 @@
+"""Accuracy of integrators at long frames, against fine step explicit Euler.
+
+Players start at the edges and route their units to the center, where they
+fight. The same match is simulated by every integrator with frames of
+several lengths and units are compared with the reference every ten seconds
+of the match. Time is CPU per simulated second, the lower the better.
+
+Run from the `back` directory:
+
+    python -m benchmarks.integrators
+"""
+import time
+
+from game import Game
+from headless import HeadlessRunner
+from integrators import INTEGRATORS
+from map_generators import SquareMapGenerator
+from benchmarks import result
+
+
+REFERENCE_DT = 0.01
+SAMPLE_INTERVAL = 10
+
+
+def play(size, duration, dt, integrator):
+    """Units every `SAMPLE_INTERVAL` of the match, node_id -> player name -> units, and CPU time it took."""
+    game = Game(
+        nodes=SquareMapGenerator(x=size, y=size, distance=5, production=20, throughput=1).generate(),
+        decay_rate=0.1,
+        starting_units=10,
+        offensive_force=1,
+        integrator=INTEGRATORS[integrator],
+    )
+    runner = HeadlessRunner(game, dt)
+    center = '({0}, {0})'.format(size // 2)
+    # different distances and targets, so that battles are won and lost on the way
+    starts = (('north', '(0, 0)', 5), ('east', '({}, 0)'.format(size - 1), 1), ('south', '({}, {})'.format(size // 2, size - 1), 10))
+    for name, corner, target in starts:
+        runner.add_player(name, corner)
+        runner.add_command(0, name, {'type': 'route', 'data': {'source': corner, 'destination': center, 'target': target}})
+    samples = []
+    seconds = 0
+    for _ in range(round(duration / SAMPLE_INTERVAL)):
+        start = time.process_time()
+        runner.run(SAMPLE_INTERVAL)
+        seconds += time.process_time() - start
+        samples.append(runner.state['nodes'])
+    return samples, seconds
+
+
+def errors(samples, reference):
+    """Sum of absolute differences of units relative to all units, and the largest difference, over all samples."""
+    differences = [
+        abs(nodes.get(node_id, {}).get(name, 0) - expected.get(node_id, {}).get(name, 0))
+        for nodes, expected in zip(samples, reference)
+        for node_id in nodes.keys() | expected.keys()
+        for name in nodes.get(node_id, {}).keys() | expected.get(node_id, {}).keys()
+    ]
+    total = sum(u for expected in reference for units in expected.values() for u in units.values())
+    return sum(differences) / total, max(differences, default=0)
+
+
+def results(quick=False):
+    size, duration = (5, 60) if quick else (7, 120)
+    reference, _ = play(size, duration, REFERENCE_DT, 'euler')
+    for integrator in INTEGRATORS:
+        for dt in (0.2, 1) if quick else (0.2, 0.5, 1, 2):
+            nodes, seconds = play(size, duration, dt, integrator)
+            relative_error, max_error = errors(nodes, reference)
+            yield result(
+                'integrator', {'integrator': integrator, 'dt': dt, 'size': size}, seconds / duration,
+                relative_error=relative_error, max_error=max_error,
+            )
+
+
+def run():
+    print('{:<14} {:>6} {:>16} {:>16} {:>12}'.format('integrator', 'dt', 'relative error', 'max error', 'cpu [ms/s]'))
+    for r in results():
+        print('{:<14} {:>6} {:>16.6f} {:>16.4f} {:>12.3f}'.format(
+            r['params']['integrator'], r['params']['dt'], r['relative_error'], r['max_error'], r['value'] * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    run()
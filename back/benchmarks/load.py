@@ -0,0 +1,82 @@
+"""Load generator - many simulated clients connected to a running server.
+
+Start a server (e.g. `python async_server.py`) and run from the `back` directory:
+
+    python -m benchmarks.load --clients 1000 --duration 30
+
+Thousands of connections need a raised limit of open files (`ulimit -n`).
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+
+class ClientStats:
+    def __init__(self):
+        self.connected = False
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+
+
+async def client(uri, stats, deadline, connecting):
+    try:
+        async with connecting:
+            websocket = await websockets.connect(uri, max_size=None)
+        async with websocket:
+            stats.connected = True
+            await websocket.send(json.dumps({'type': 'map', 'data': {}}))
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(websocket.recv(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                stats.messages += 1
+                stats.bytes += len(message)
+    except (OSError, websockets.WebSocketException):
+        stats.errors += 1
+
+
+async def run(uri, clients, duration, concurrent_connects):
+    connecting = asyncio.Semaphore(concurrent_connects)
+    stats = [ClientStats() for _ in range(clients)]
+    start = time.monotonic()
+    await asyncio.gather(*(
+        client(uri, s, start + duration, connecting)
+        for s in stats
+    ))
+    elapsed = time.monotonic() - start
+
+    connected = [s for s in stats if s.connected]
+    messages = sum(s.messages for s in connected)
+    received = sum(s.bytes for s in connected)
+    print('clients connected: {} / {} ({} errors)'.format(len(connected), clients, sum(s.errors for s in stats)))
+    print('messages received: {} ({:.1f}/s)'.format(messages, messages / elapsed))
+    print('bytes received: {} ({:.1f} kB/s)'.format(received, received / elapsed / 1000))
+    per_client = sorted(s.messages for s in connected) or [0]
+    print('messages per client: min {} / median {} / max {}'.format(
+        per_client[0], per_client[len(per_client) // 2], per_client[-1],
+    ))
+    return {
+        'connected': len(connected),
+        'errors': sum(s.errors for s in stats),
+        'messages_per_second': messages / elapsed,
+        'bytes_per_second': received / elapsed,
+        'min_messages_per_client': per_client[0],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='ws://localhost:8080/ws')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--concurrent-connects', type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.uri, args.clients, args.duration, args.concurrent_connects))
@@ -0,0 +1,55 @@
+"""Time of building maps of growing size with each of the generators.
+
+Run from the `back` directory:
+
+    python -m benchmarks.maps
+"""
+import math
+import time
+
+from map_generators import SquareMapGenerator, HexMapGenerator, RandomGeometricMapGenerator, ArchipelagoMapGenerator
+from benchmarks import measure, result
+
+
+def generators(nodes):
+    side = round(math.sqrt(nodes))
+    # about 6 neighbours per node in the random ones
+    area = nodes * math.pi * 25 ** 2 / 6
+    yield SquareMapGenerator(x=side, y=side, distance=25, production=20, throughput=1)
+    yield HexMapGenerator(x=side, y=side, distance=25, production=20, throughput=1)
+    yield RandomGeometricMapGenerator(
+        count=nodes, width=math.sqrt(area), height=math.sqrt(area), radius=25,
+        seed=0, production=20, throughput=1,
+    )
+    islands = max(1, nodes // 1000)
+    yield ArchipelagoMapGenerator(
+        islands=islands, island_nodes=nodes // islands, island_radius=math.sqrt(area / islands / math.pi),
+        width=math.sqrt(area) * 3, height=math.sqrt(area) * 3, radius=25,
+        seed=0, production=20, throughput=1,
+    )
+
+
+def results(quick=False):
+    for count in (10 ** 3, 10 ** 4) if quick else (10 ** 3, 10 ** 4, 10 ** 5):
+        for generator in generators(count):
+            yield result('map_generation', {'generator': type(generator).__name__, 'nodes': count}, measure(lambda: generator.generate(pause_gc=True), repeat=1))
+
+
+def run(node_counts=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)):
+    print('{:>30} {:>10} {:>12} {:>10}'.format('generator', 'nodes', 'connections', 'time [s]'))
+    for count in node_counts:
+        for generator in generators(count):
+            start = time.perf_counter()
+            nodes = generator.generate(pause_gc=True)
+            elapsed = time.perf_counter() - start
+            print('{:>30} {:>10} {:>12} {:>10.2f}'.format(
+                type(generator).__name__,
+                len(nodes),
+                sum(len(node.connections) for node in nodes.values()),
+                elapsed,
+            ))
+            del nodes
+
+
+if __name__ == '__main__':
+    run()
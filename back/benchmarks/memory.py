@@ -0,0 +1,73 @@
+"""Memory taken by maps per node, idle and with every node owned and sending.
+
+Maps of every generator are built under `tracemalloc`. Idle is the map as
+generated, played is the same map in a game where every node has units of
+one of a few players and half of them send units to a neighbour, a few
+frames in - so that flows and incoming units are there too.
+
+Run from the `back` directory:
+
+    python -m benchmarks.memory
+"""
+import gc
+import random
+import tracemalloc
+
+from commands import Disposition
+from game import Game
+from benchmarks import result
+from benchmarks.maps import generators
+
+
+FRAMES = 5
+
+
+def play(nodes, players=4, seed=0):
+    rnd = random.Random(seed)
+    game = Game(nodes, decay_rate=0.1, starting_units=10, offensive_force=1)
+    for node in nodes.values():
+        player_id = 'player{}'.format(rnd.randrange(players))
+        node.units[player_id] = rnd.uniform(1, 20)
+        if node.connections and rnd.random() < 0.5:
+            node.set_disposition(player_id, Disposition(5, {rnd.choice(list(node.connections)): 1}))
+    game.needs_do_frame.update(nodes.values())
+    for _ in range(FRAMES):
+        game.simulate_frame(0.2)
+    return game
+
+
+def measure_memory(generator):
+    """Bytes per node of the generated map, and of the same map played for a few frames."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        nodes = generator.generate()
+        idle, _ = tracemalloc.get_traced_memory()
+        game = play(nodes)
+        gc.collect()
+        played, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del game
+    return idle / len(nodes), played / len(nodes), sum(len(node.connections) for node in nodes.values()) / len(nodes)
+
+
+def results(quick=False):
+    for count in (10 ** 3,) if quick else (10 ** 3, 10 ** 4):
+        for generator in generators(count):
+            idle, played, connections = measure_memory(generator)
+            params = {'generator': type(generator).__name__, 'nodes': count}
+            yield result('node_memory', dict(params, state='idle'), idle, unit='B', connections_per_node=connections)
+            yield result('node_memory', dict(params, state='played'), played, unit='B', connections_per_node=connections)
+
+
+def run(node_counts=(10 ** 3, 10 ** 4, 10 ** 5)):
+    print('{:>30} {:>10} {:>12} {:>12} {:>12}'.format('generator', 'nodes', 'connections', 'idle [B]', 'played [B]'))
+    for count in node_counts:
+        for generator in generators(count):
+            idle, played, connections = measure_memory(generator)
+            print('{:>30} {:>10} {:>12.1f} {:>12.0f} {:>12.0f}'.format(type(generator).__name__, count, connections, idle, played))
+
+
+if __name__ == '__main__':
+    run()
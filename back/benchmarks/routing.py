@@ -0,0 +1,67 @@
+"""Moving units across the map - a single route command vs a batch of single hop dispositions.
+
+Run from the `back` directory:
+
+    python -m benchmarks.routing
+"""
+import json
+
+from game import Game
+from map_generators import SquareMapGenerator
+from routing import Router
+from benchmarks import measure, result
+from benchmarks.simulation import NullConnection
+
+
+def make_game(size):
+    return Game(
+        nodes=SquareMapGenerator(x=size, y=size, distance=25, production=20, throughput=1).generate(),
+        decay_rate=0.1,
+        starting_units=10,
+        offensive_force=1,
+    )
+
+
+def commands(game, size):
+    """The same move as a route command and as dispositions, corner to corner."""
+    source, destination = '(0, 0)', '({0}, {0})'.format(size - 1)
+    route = {'type': 'route', 'data': {'source': source, 'destination': destination}}
+    path = game.router.route(source, destination)
+    hops = [
+        {'type': 'disposition', 'data': {'node_id': node_id, 'disposition': {'target': 0, 'ratios': {next_node_id: 1}}}}
+        for node_id, next_node_id in zip(path, path[1:])
+    ]
+    return route, hops
+
+
+def submit_and_apply(game, player_id, data):
+    game.submit_commands(player_id, data)
+    game.apply_commands()
+
+
+def results(quick=False):
+    for size in (10, 30) if quick else (10, 30, 100):
+        game = make_game(size)
+        player_id = game.create_player(NullConnection(), '(0, 0)')
+        route, hops = commands(game, size)
+        params = {'size': size, 'hops': len(hops)}
+        yield result('route_command', params, measure(lambda: submit_and_apply(game, player_id, route)), bytes=len(json.dumps(route)))
+        # a batch is limited in size, clients would have to send several
+        yield result('hop_commands', params, measure(lambda: [submit_and_apply(game, player_id, hops[i:i + 64]) for i in range(0, len(hops), 64)]), bytes=len(json.dumps(hops)))
+        yield result('route_table', {'size': size}, measure(lambda: Router(game.nodes).route('(0, 0)', '(1, 1)'), repeat=1))
+        # as on maps too large for tables, landmarks are picked on the first search
+        router = Router(game.nodes, table_nodes=0)
+        yield result('route_landmarks', {'size': size}, measure(router.pick_landmarks, repeat=1))
+        yield result('route_search', {'size': size}, measure(lambda: router.route('(0, 0)', route['data']['destination'])))
+
+
+def run():
+    print('{:<16} {:<24} {:>10} {:>10}'.format('benchmark', 'params', 'time [ms]', 'bytes'))
+    for r in results():
+        print('{:<16} {:<24} {:>10.3f} {:>10}'.format(
+            r['name'], ' '.join('{}={}'.format(k, v) for k, v in r['params'].items()), r['value'] * 1000, r.get('bytes', ''),
+        ))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,105 @@
+"""Frame times of nodes, connections and whole games.
+
+Run from the `back` directory:
+
+    python -m benchmarks.simulation
+"""
+import random
+
+from game import Game, Node, Connection
+from commands import Disposition
+from map_generators import SquareMapGenerator
+from benchmarks import measure, result
+from benchmarks.battle import contested_node
+
+
+class NullConnection:
+    def send_encoded(self, type, message):
+        pass
+
+
+def node_frame(players):
+    game, node, units = contested_node(players)
+
+    def do_frame():
+        node.units = units
+        node.do_frame(game, 0.2)
+    return result('node_frame', {'players': players}, measure(do_frame))
+
+
+def connection_frame(segments):
+    """Connection with `segments` flow changes on their way."""
+    target = Node('target', x=0, y=0, production=3, connections={})
+    connection = Connection('source', 'target', throughput=1, travel_time=10 ** 6, max_segments=segments)
+    game = Game({'target': target}, decay_rate=0.1, starting_units=1, offensive_force=1)
+    for i in range(segments + 1):
+        connection.set_movements({'player1': i % 2 + 1})
+        connection.do_frame(game, 1)  # apart, so that they aren't merged
+    return result('connection_frame', {'segments': segments}, measure(lambda: connection.do_frame(game, 0.2)))
+
+
+def busy_game(size, players, engine=None, **kwargs):
+    """Game on size x size map with players spread around and sending units to random neighbours."""
+    rnd = random.Random(size * 1000 + players)
+    game = Game(
+        SquareMapGenerator(x=size, y=size, distance=25, production=20, throughput=1).generate(),
+        decay_rate=0.1,
+        starting_units=10,
+        offensive_force=1,
+        engine=engine,
+        **kwargs
+    )
+    player_ids = [game.create_player(NullConnection(), rnd.choice(list(game.nodes))) for _ in range(players)]
+    for node in game.nodes.values():
+        player_id = rnd.choice(player_ids)
+        node.units[player_id] = rnd.uniform(1, 20)
+        node.set_disposition(player_id, Disposition(rnd.uniform(5, 30), {rnd.choice(list(node.connections)): 1}))
+    game.needs_do_frame.update(game.nodes.values())
+    for _ in range(20):
+        game.do_frame(0.2)
+    return game
+
+
+def make_engine(engine_name):
+    if engine_name == 'vectorized':
+        from vectorized import VectorizedEngine
+        return VectorizedEngine()
+    return None
+
+
+def game_frame(size, players, engine_name='object'):
+    game = busy_game(size, players, make_engine(engine_name))
+    return result('game_frame', {'size': size, 'players': players, 'engine': engine_name}, measure(lambda: game.do_frame(0.2)))
+
+
+def node_pass(size, players, engine_name='object'):
+    """Only the node pass of a frame, the part the engines differ in, over all nodes of a busy game."""
+    game = busy_game(size, players, make_engine(engine_name))
+    nodes = list(game.nodes.values())
+    states = [(node.units, node.rates) for node in nodes]
+
+    def do_pass():
+        # same units every pass, so connections get the same movements as in the first one
+        for node, (units, rates) in zip(nodes, states):
+            node.units, node.rates = units, rates
+        game.engine.nodes_frame(game, nodes, 0.2)
+    return result('node_pass', {'size': size, 'players': players, 'engine': engine_name}, measure(do_pass))
+
+
+def results(quick=False):
+    for players in (1, 10, 100):
+        yield node_frame(players)
+    for segments in (1, 8, 32):
+        yield connection_frame(segments)
+    for size in (10, 30) if quick else (10, 30, 100):
+        for players in (2, 10):
+            for engine_name in ('object', 'vectorized'):
+                yield game_frame(size, players, engine_name)
+    for players in (2, 20):
+        for engine_name in ('object', 'vectorized'):
+            yield node_pass(30 if quick else 60, players, engine_name)
+
+
+if __name__ == '__main__':
+    for r in results():
+        print(r)
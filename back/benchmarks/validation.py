@@ -0,0 +1,107 @@
+"""Validations per second of typical commands - compiled validators against the old ones.
+
+The old validators were rebuilt for every message and built a path for every
+validated value. Run from the `back` directory:
+
+    python -m benchmarks.validation
+"""
+import timeit
+
+from commands import Command, Disposition, DispositionCommand, MapRequest, PlayerInfoRequest
+from validators import ValidationError
+from benchmarks import measure, result
+
+
+def legacy_record_validator(constructor, validators_dict):
+    def validate(data, path):
+        if not isinstance(data, dict):
+            raise ValidationError('expected dict', path)
+        if validators_dict.keys() != data.keys():
+            raise ValidationError('expected keys {}'.format(validators_dict.keys()), path)
+        return constructor(**{
+            k: validate(data[k], path + (k,))
+            for k, validate in validators_dict.items()
+        })
+    return validate
+
+
+def legacy_float_validator(data, path):
+    try:
+        return float(data)
+    except (OverflowError, ValueError):
+        raise ValidationError('expected float', path)
+
+
+def legacy_string_validator(data, path):
+    return str(data)
+
+
+def legacy_dict_validator(value_validator):
+    def validate(data, path):
+        if not isinstance(data, dict):
+            raise ValidationError('expected dict', path)
+        return {k: value_validator(v, path + (k,)) for k, v in data.items()}
+    return validate
+
+
+def legacy_array_validator(value_validator):
+    def validate(data, path):
+        if not isinstance(data, list):
+            raise ValidationError('expected list', path)
+        return [value_validator(e, path + (i,)) for i, e in enumerate(data)]
+    return validate
+
+
+def legacy_union_validator(union_options):
+    def validate(data, path):
+        if not isinstance(data, dict):
+            raise ValidationError('expected dict', path)
+        if {'type', 'data'} != data.keys():
+            raise ValidationError("expected keys {'type', 'data'}", path)
+        if data['type'] not in union_options.keys():
+            raise ValidationError('\'type\' must be one of {}'.format(union_options.keys()), path)
+        return union_options[data['type']](data['data'], path + ('data',))
+    return validate
+
+
+def legacy_validator():
+    return legacy_union_validator({
+        'map': legacy_record_validator(MapRequest, {}),
+        'player': legacy_record_validator(PlayerInfoRequest, {
+            'player_ids': legacy_array_validator(legacy_string_validator),
+        }),
+        'disposition': legacy_record_validator(DispositionCommand, {
+            'node_id': legacy_string_validator,
+            'disposition': legacy_record_validator(Disposition, {
+                'target': legacy_float_validator,
+                'ratios': legacy_dict_validator(legacy_float_validator),
+            }),
+        }),
+    })
+
+
+MESSAGES = {
+    'map': {'type': 'map', 'data': {}},
+    'player': {'type': 'player', 'data': {'player_ids': ['player{}'.format(i) for i in range(10)]}},
+    'disposition': {'type': 'disposition', 'data': {
+        'node_id': '(1, 1)',
+        'disposition': {'target': 10, 'ratios': {'(0, 1)': 1, '(1, 0)': 2, '(2, 1)': 1, '(1, 2)': 1}},
+    }},
+}
+
+
+def results(quick=False):
+    for name, message in MESSAGES.items():
+        yield result('validation', {'message': name}, measure(lambda: Command.from_user_data(message)))
+
+
+def run(number=20000):
+    print('{:>12} {:>16} {:>16}'.format('message', 'old [1/s]', 'compiled [1/s]'))
+    for name, message in MESSAGES.items():
+        legacy = min(timeit.repeat(lambda: legacy_validator()(message, ()), number=number, repeat=3))
+        compiled = min(timeit.repeat(lambda: Command.from_user_data(message), number=number, repeat=3))
+        print('{:>12} {:>16.0f} {:>16.0f}'.format(name, number / legacy, number / compiled))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,142 @@
+"""Binary encoding of unit updates, negotiated per connection.
+
+Player and node ids are interned to integers, shared by all connections. New
+ones are sent to a client in a JSON 'dictionary' message ({'first': index of
+the first id, 'ids': [...]}) before the binary message referring to them.
+Other messages than 'units' stay JSON.
+
+'units' message, little endian:
+
+    uint8 message kind (1 - units), uint32 item count, items
+
+item is a node or a connection:
+
+    uint8 kind (0 - node), uint32 node id, units
+    uint8 kind (3 - node with rates), uint32 node id, units, rates (encoded as units)
+    uint8 kind (1 - connection, 2 - connection delta), uint32 source node id, uint32 target node id,
+        uint16 segment count, segments: float32 remaining time, units
+
+and units are:
+
+    uint16 count n, n * uint32 player id, n * float32 units
+"""
+import struct
+
+from messages import JsonCodec
+
+
+UNITS_MESSAGE = 1
+
+NODE = 0
+CONNECTION = 1
+CONNECTION_DELTA = 2
+NODE_WITH_RATES = 3
+
+
+class IdTable:
+    def __init__(self):
+        self.ids = []  # index -> id
+        self.indexes = {}  # id -> index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, id):
+        index = self.indexes.get(id)
+        if index is None:
+            index = self.indexes[id] = len(self.ids)
+            self.ids.append(id)
+        return index
+
+
+class BinaryCodec(JsonCodec):
+    name = 'binary'
+
+    def __init__(self):
+        self.ids = IdTable()
+
+    def encode_message(self, type, data):
+        if type != 'units':
+            return super().encode_message(type, data)
+        return self.encode_batch(type, [self.encode_item(item) for item in data])
+
+    def encode_item(self, data):
+        if data['type'] == 'node':
+            if 'rates' in data:
+                return b''.join((
+                    struct.pack('<BI', NODE_WITH_RATES, self.ids.intern(data['id'])),
+                    self.encode_units(data['units']),
+                    self.encode_units(data['rates']),
+                ))
+            return struct.pack('<BI', NODE, self.ids.intern(data['id'])) + self.encode_units(data['units'])
+        source_node_id, target_node_id = data['id']
+        if 'units' in data:
+            kind, segments = CONNECTION, data['units']
+        else:
+            kind, segments = CONNECTION_DELTA, data['units_delta']
+        parts = [struct.pack('<BIIH', kind, self.ids.intern(source_node_id), self.ids.intern(target_node_id), len(segments))]
+        for segment in segments:
+            parts.append(struct.pack('<f', segment['remaining_time']))
+            parts.append(self.encode_units(segment['movements']))
+        return b''.join(parts)
+
+    def encode_units(self, units):
+        n = len(units)
+        return struct.pack(
+            '<H{n}I{n}f'.format(n=n), n,
+            *(self.ids.intern(player_id) for player_id in units.keys()),
+            *units.values(),
+        )
+
+    def encode_batch(self, type, encoded_items):
+        assert type == 'units'
+        return struct.pack('<BI', UNITS_MESSAGE, len(encoded_items)) + b''.join(encoded_items)
+
+    def prepare(self, player):
+        known = player.known_ids
+        if known < len(self.ids):
+            player.known_ids = len(self.ids)
+            player.send_encoded('dictionary', super().encode_message('dictionary', {
+                'first': known,
+                'ids': self.ids.ids[known:player.known_ids],
+            }))
+
+
+def decode_units(message, ids):
+    """Decode 'units' message back to the JSON form, `ids` is the list of ids from dictionaries."""
+    kind, count = struct.unpack_from('<BI', message)
+    assert kind == UNITS_MESSAGE
+    offset = struct.calcsize('<BI')
+
+    def units():
+        nonlocal offset
+        n, = struct.unpack_from('<H', message, offset)
+        offset += 2
+        values = struct.unpack_from('<{n}I{n}f'.format(n=n), message, offset)
+        offset += 8 * n
+        return {ids[i]: u for i, u in zip(values[:n], values[n:])}
+
+    items = []
+    for _ in range(count):
+        item_kind, = struct.unpack_from('<B', message, offset)
+        offset += 1
+        if item_kind in (NODE, NODE_WITH_RATES):
+            node_id, = struct.unpack_from('<I', message, offset)
+            offset += 4
+            items.append({'type': 'node', 'id': ids[node_id], 'units': units()})
+            if item_kind == NODE_WITH_RATES:
+                items[-1]['rates'] = units()
+            continue
+        source_node_id, target_node_id, segment_count = struct.unpack_from('<IIH', message, offset)
+        offset += 10
+        segments = []
+        for _ in range(segment_count):
+            remaining_time, = struct.unpack_from('<f', message, offset)
+            offset += 4
+            segments.append({'remaining_time': remaining_time, 'movements': units()})
+        items.append({
+            'type': 'connection',
+            'id': [ids[source_node_id], ids[target_node_id]],
+            'units' if item_kind == CONNECTION else 'units_delta': segments,
+        })
+    return items
@@ -1,48 +1,112 @@
+import functools
+import json
+import math
+
 from validators import (
     ValidationError,
-    string_validator, float_validator,
+    string_validator, float_validator, non_negative_float_validator, choice_validator,
     union_validator, dict_validator, record_validator, array_validator,
 )
 
 
+MAX_MESSAGE_SIZE = 64 * 1024  # characters of a single message
+MAX_BATCH_SIZE = 64  # commands in a single message
+MAX_ITEMS = 256  # items of a list or a dict in a command
+
+
 class GameUserError(Exception):
     pass
 
 
+def decode_message(raw):
+    """Parse a message from a client, refusing too large ones before parsing."""
+    if len(raw) > MAX_MESSAGE_SIZE:
+        raise GameUserError('message too large, limit is {}'.format(MAX_MESSAGE_SIZE))
+    try:
+        return json.loads(raw)
+    except (ValueError, RecursionError):
+        raise GameUserError('I only do JSONs, bro.')
+
+
 class Command:
+    immediate = False  # executed as soon as received, not in the next frame
+
     @staticmethod
+    @functools.cache
     def validator():
         return union_validator({
             'map': MapRequest.validator(),
             'player': PlayerInfoRequest.validator(),
             'disposition': DispositionCommand.validator(),
+            'route': RouteCommand.validator(),
+            'protocol': ProtocolRequest.validator(),
         })
 
+    @staticmethod
+    @functools.cache
+    def batch_validator():
+        return array_validator(Command.validator(), MAX_BATCH_SIZE)
+
     @classmethod
     def from_user_data(cls, data):
+        """Validate a command, or a list of commands. Return list of commands."""
         try:
-            return cls.validator()(data, ())
+            if isinstance(data, list):
+                commands = cls.batch_validator()(data)
+            else:
+                commands = [cls.validator()(data)]
+                data = [data]
         except ValidationError as e:
             raise GameUserError(e)
+        for command, command_data in zip(commands, data):
+            command.data = command_data  # as received, for the command log
+        return commands
+
+    def prepare(self, game):
+        """Do work not needing the game lock ahead of `execute`, in the thread submitting the command."""
 
     def execute(self, game, player_id):
         raise NotImplementedError()
 
 
 class MapRequest(Command):
+    """Ask for terrain. It's immutable, so it's sent right away, not in a frame.
+
+    Client always gets 'map_info' with terrain version and tiles. Then the
+    whole map follows, unless the client already has the version or asks for
+    some tiles only.
+    """
+    immediate = True
+
     @classmethod
     def validator(cls):
-        return record_validator(cls, {})
+        return record_validator(cls, {}, {
+            'version': string_validator,
+            'tiles': array_validator(string_validator, MAX_ITEMS),
+        })
+
+    def __init__(self, version=None, tiles=None):
+        self.version = version
+        self.tiles = tiles
 
     def execute(self, game, player_id):
-        game.send(player_id, 'map', game.terrain_data)
+        terrain = game.terrain
+        unknown_tiles = set(self.tiles or ()) - terrain.tiles.keys()
+        if unknown_tiles:
+            raise GameUserError('unknown tiles {}'.format(unknown_tiles))
+        game.send_encoded(player_id, 'map_info', terrain.encoded_info)
+        if self.tiles is not None:
+            for tile in self.tiles:
+                game.send_encoded(player_id, 'map_tile', terrain.encoded_tile(tile))
+        elif self.version != terrain.version:
+            game.send_encoded(player_id, 'map', terrain.encoded_map)
 
 
 class PlayerInfoRequest(Command):
     @classmethod
     def validator(cls):
         return record_validator(cls, {
-            'player_ids': array_validator(string_validator),
+            'player_ids': array_validator(string_validator, MAX_ITEMS),
         })
 
     def __init__(self, player_ids):
@@ -56,6 +120,23 @@ class PlayerInfoRequest(Command):
         })
 
 
+class ProtocolRequest(Command):
+    """Choose format of unit updates - 'json' (default) or 'binary' (see `binary.py`)."""
+    immediate = True
+
+    @classmethod
+    def validator(cls):
+        return record_validator(cls, {
+            'format': choice_validator(('json', 'binary')),
+        })
+
+    def __init__(self, format):
+        self.format = format
+
+    def execute(self, game, player_id):
+        game.set_protocol(player_id, self.format)
+
+
 class DispositionCommand(Command):
     @classmethod
     def validator(cls):
@@ -69,20 +150,84 @@ class DispositionCommand(Command):
         self.disposition = disposition
 
     def execute(self, game, player_id):
-        node = game.nodes[self.node_id]
+        node = game.nodes.get(self.node_id)
+        if node is None:
+            raise GameUserError('unknown node {}'.format(self.node_id))
+        unknown_targets = self.disposition.ratios.keys() - node.connections.keys()
+        if unknown_targets:
+            raise GameUserError('node {} is not connected to {}'.format(self.node_id, unknown_targets))
         changed = node.set_disposition(player_id, self.disposition)
         game.needs_do_frame.update(changed)
 
 
+class RouteCommand(Command):
+    """Send units from the source node to the destination along the shortest route.
+
+    Dispositions are set on every node of the route - the source keeps
+    `target` units, nodes on the way pass everything on.
+    """
+
+    @classmethod
+    def validator(cls):
+        return record_validator(cls, {
+            'source': string_validator,
+            'destination': string_validator,
+        }, {
+            'target': float_validator,
+        })
+
+    def __init__(self, source, destination, target=0):
+        self.source = source
+        self.destination = destination
+        self.target = target
+        self.route = None
+
+    def prepare(self, game):
+        if self.source in game.nodes and self.destination in game.nodes:
+            self.route = game.router.route(self.source, self.destination)
+
+    def execute(self, game, player_id):
+        for node_id in (self.source, self.destination):
+            if node_id not in game.nodes:
+                raise GameUserError('unknown node {}'.format(node_id))
+        if self.route is None:
+            self.prepare(game)  # e.g. replayed from the log
+        if self.route is None:
+            raise GameUserError('no route from {} to {}'.format(self.source, self.destination))
+        changed = set()
+        for node_id, next_node_id in zip(self.route, self.route[1:]):
+            target = self.target if node_id == self.source else 0
+            changed.update(game.nodes[node_id].set_disposition(player_id, Disposition(target, {next_node_id: 1})))
+        game.needs_do_frame.update(changed)
+
+
 class Disposition:
+    __slots__ = ('target', 'ratios')
+
     @classmethod
     def validator(cls):
+        validate_ratios = dict_validator(non_negative_float_validator, MAX_ITEMS)
+
+        def ratios_validator(data):
+            ratios = validate_ratios(data)
+            if ratios and not 0 < sum(ratios.values()) < math.inf:
+                raise ValidationError('expected ratios with a positive sum')
+            return ratios
+
         return record_validator(Disposition, {
             'target': float_validator,
-            'ratios': dict_validator(float_validator),
+            'ratios': ratios_validator,
         })
 
     def __init__(self, target, ratios):
         self.target = target
         ratios_sum = sum(ratios.values())
         self.ratios = {k: v / ratios_sum for k, v in ratios.items()}
+
+    @classmethod
+    def normalized(cls, target, ratios):
+        """Disposition with ratios taken as they are - normalizing them again could change them by rounding."""
+        disposition = cls.__new__(cls)
+        disposition.target = target
+        disposition.ratios = ratios
+        return disposition
@@ -1,96 +1,619 @@
 from uuid import uuid4
+import itertools
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
 import threading
 import time
 import random
+import secrets
 
-from commands import Command
+from commands import Command, GameUserError
+from integrators import EULER, Euler
+from interest import InterestManager
+from terrain import Terrain
+from routing import Router
+from messages import JSON, units_update, units_delta
+from binary import BinaryCodec
+from scheduler import SleepScheduler
+from metrics import GameMetrics, TimedLock
 
 
 logger = logging.getLogger(__name__)
 
 
+class FrameStats:
+    """Rolling statistics of frame durations, for spotting lag and sizing hardware."""
+
+    def __init__(self, window=1000):
+        self.durations = deque(maxlen=window)
+        self.frames = 0
+        self.steps = 0
+        self.overloaded_frames = 0  # frames which couldn't catch up with wall clock
+        self.dropped_time = 0  # simulation time given up on, in seconds
+
+    def add(self, duration, steps=1):
+        self.durations.append(duration)
+        self.frames += 1
+        self.steps += steps
+
+    def summary(self):
+        durations = sorted(self.durations)
+        summary = {
+            'frames': self.frames,
+            'steps': self.steps,
+            'overloaded_frames': self.overloaded_frames,
+            'dropped_time': self.dropped_time,
+        }
+        if durations:
+            summary.update({
+                'mean': sum(durations) / len(durations),
+                'p50': durations[len(durations) // 2],
+                'p95': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                'p99': durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+                'max': durations[-1],
+            })
+        return summary
+
+
 class SimulationRunner(threading.Thread):
-    def __init__(self, game, dt, **kwagrs):
+    """Runs the game paced to wall-clock time.
+
+    By default each frame simulates the time measured since the previous one.
+    With `fixed_timestep` the simulation always advances in steps of `dt`:
+    elapsed time is accumulated and as many steps as fit are done, but at
+    most `max_substeps` per frame. When the server can't keep up,
+    `overload_policy` decides what happens to the rest of the time - 'drop'
+    it (the game runs slower than wall clock, but stays deterministic) or
+    'merge' it into the steps (steps get longer, the game keeps pace). While
+    lagging, broadcasts are also sent less often, down to once per
+    `max_broadcast_interval` frames.
+
+    Broadcasts can be sent less often than the simulation is stepped -
+    at most once per `broadcast_dt` of simulated time - e.g. with rate updates
+    clients extrapolate between them.
+
+    With `snapshots` (a `snapshots.SnapshotWriter`) the game state is captured
+    right after a step, before anything else can touch the game.
+
+    Every `reap_interval` of simulated time players gone for good are removed
+    from the game (see `Game.reap_players`).
+    """
+
+    def __init__(
+        self, game, dt,
+        fixed_timestep=False, max_substeps=4, overload_policy='drop', max_broadcast_interval=1,
+        broadcast_dt=0, stats_interval=60, snapshots=None, reap_interval=10,
+        **kwagrs
+    ):
+        assert overload_policy in ('drop', 'merge')
         self.game = game
         self.dt = dt
+        self.fixed_timestep = fixed_timestep
+        self.max_substeps = max_substeps
+        self.overload_policy = overload_policy
+        self.max_broadcast_interval = max_broadcast_interval
+        self.broadcast_dt = broadcast_dt
+        self.stats_interval = stats_interval  # how often to log frame stats, in seconds
+        self.stats = FrameStats()
+        self.snapshots = snapshots
+        self.reap_interval = reap_interval
+        self.next_reap_time = 0  # simulated
+
+        # fixed timestep state
+        self.accumulator = 0  # wall-clock time not simulated yet
+        self.broadcast_interval = 1
+
+        self.frames_since_broadcast = 0
+        self.time_since_broadcast = 0  # simulated
+        self.changed = set()  # objects changed since the last broadcast
+
         super().__init__(**kwagrs)
 
     def run(self):
         previous_frame_time = time.monotonic()
+        last_stats_time = previous_frame_time
         while True:
-            with self.game.lock:
-                this_frame_start_time = time.monotonic()
-                self.game.do_frame(this_frame_start_time - previous_frame_time)
-                this_frame_end_time = time.monotonic()
+            this_frame_start_time = time.monotonic()
+            if self.fixed_timestep:
+                to_sleep = self.tick(this_frame_start_time - previous_frame_time)
+            else:
+                dt = this_frame_start_time - previous_frame_time
+                with self.game.lock:
+                    self.changed.update(self.game.simulate_frame(dt))
+                    self.take_snapshot()
+                self.time_since_broadcast += dt
+                self.maybe_broadcast()
+                self.add_stats(time.monotonic() - this_frame_start_time)
+                to_sleep = self.dt - (time.monotonic() - this_frame_start_time)
             previous_frame_time = this_frame_start_time
-            to_sleep = self.dt - (this_frame_end_time - this_frame_start_time)
+            self.maybe_reap()
+
+            if this_frame_start_time - last_stats_time >= self.stats_interval:
+                logger.info('frame stats: %s', self.stats.summary())
+                last_stats_time = this_frame_start_time
+
             if to_sleep <= 0:
-                logger.warning('lagging %d', to_sleep)
+                logger.warning('lagging %.3f s, last phases (s): %s', -to_sleep, self.game.metrics.last_phases())
             else:
                 time.sleep(to_sleep)
 
+    def tick(self, elapsed):
+        """Simulate `elapsed` seconds of wall-clock time in fixed steps. Return time until next step is due."""
+        tick_start_time = time.monotonic()
+        self.accumulator += elapsed
+        steps = int(self.accumulator / self.dt + 1e-9)  # don't lose a step to rounding
+        self.accumulator -= steps * self.dt
+        step_dt = self.dt
+
+        if steps > self.max_substeps:
+            self.stats.overloaded_frames += 1
+            self.game.metrics.overloaded_frames.inc()
+            if self.overload_policy == 'merge':
+                step_dt = steps * self.dt / self.max_substeps
+            else:
+                self.stats.dropped_time += (steps - self.max_substeps) * self.dt
+                self.game.metrics.dropped_time.inc((steps - self.max_substeps) * self.dt)
+            steps = self.max_substeps
+
+        # more than one step per frame means we're behind - send less, until we catch up
+        if steps > 1:
+            self.broadcast_interval = min(self.broadcast_interval * 2, self.max_broadcast_interval)
+        else:
+            self.broadcast_interval = max(self.broadcast_interval // 2, 1)
+
+        for _ in range(steps):
+            with self.game.lock:
+                self.changed.update(self.game.simulate_frame(step_dt))
+                self.take_snapshot()
+        self.time_since_broadcast += steps * step_dt
+        self.maybe_broadcast()
+
+        duration = time.monotonic() - tick_start_time
+        self.add_stats(duration, steps)
+        return self.dt - self.accumulator - duration
+
+    def maybe_reap(self):
+        if self.game.time >= self.next_reap_time:
+            with self.game.lock:
+                self.game.reap_players()
+            self.next_reap_time = self.game.time + self.reap_interval
+
+    def take_snapshot(self):
+        if self.snapshots is not None:
+            self.snapshots.maybe_take(self.game)
+
+    def add_stats(self, duration, steps=1):
+        self.stats.add(duration, steps)
+        self.game.metrics.frame.observe(duration)
+        self.game.metrics.steps.inc(steps)
+
+    def maybe_broadcast(self):
+        # broadcasting happens only in this thread, no need to hold the lock
+        self.frames_since_broadcast += 1
+        if self.frames_since_broadcast >= self.broadcast_interval and self.time_since_broadcast >= self.broadcast_dt - 1e-9:
+            self.game.broadcast_frame(self.changed)
+            self.changed = set()
+            self.frames_since_broadcast = 0
+            self.time_since_broadcast = 0
+
+
+class Tolerance:
+    """Decides whether unit counts differ enough to be sent to players again.
+
+    The simulation itself is exact, close flows are only merged (keeping the
+    amount of units) and close units not broadcast. Values are close if they
+    differ by at most `absolute` or by `relative` fraction of the larger one.
+    Default tolerance is exact comparison.
+    """
+
+    def __init__(self, absolute=0, relative=0):
+        self.absolute = absolute
+        self.relative = relative
+
+    @property
+    def exact(self):
+        return self.absolute == 0 and self.relative == 0
+
+    def is_close(self, a, b):
+        return abs(a - b) <= max(self.absolute, self.relative * max(abs(a), abs(b)))
+
+    def units_close(self, units, other_units):
+        """Compare two maps player_id -> units."""
+        if self.exact:
+            return units == other_units
+        if units.keys() != other_units.keys():
+            return False
+        return all(self.is_close(u, other_units[player_id]) for player_id, u in units.items())
+
+
+EXACT = Tolerance()
+
+
+class FrozenEmpty(dict):
+    """Empty mapping which can't be changed in place, writes to it fail."""
+
+    def frozen(self, *args, **kwargs):
+        raise TypeError('shared empty mapping, replace it instead of changing it')
+
+    __setitem__ = __delitem__ = __ior__ = pop = popitem = setdefault = update = clear = frozen
+
+    def __reduce__(self):
+        return 'NOTHING'  # unpickled as the shared one
+
+
+# shared by idle nodes and connections as their flows, rates, etc. - those are replaced, never changed in place
+NOTHING = FrozenEmpty()
+MAX_SEGMENTS = 32
+
+
+class ObjectEngine:
+    """Simulation engine stepping every node and connection object on its own."""
+
+    def nodes_frame(self, game, nodes, dt):
+        changed = set()
+        for node in nodes:
+            changed.update(node.do_frame(game, dt))
+        return changed
+
+    def connections_frame(self, game, connections, dt):
+        changed = set()
+        for connection in connections:
+            changed.update(connection.do_frame(game, dt))
+        return changed
+
 
 class Game:
-    def __init__(self, nodes, decay_rate, starting_units, offensive_force):
-        self.lock = threading.Lock()
+    def __init__(
+        self, nodes, decay_rate, starting_units, offensive_force,
+        engine=None, interest_radius=None, tolerance=EXACT, sleep_nodes=False, tile_size=500,
+        rate_updates=False, metrics=None, command_log=None, reconnect_grace=60, integrator=EULER,
+    ):
+        # durations of frame phases, lock waits, messages sent, for the metrics endpoint
+        self.metrics = metrics or GameMetrics()
+        self.lock = TimedLock(self.metrics.lock_wait, self.metrics.lock_hold)
         self.players = {}  # map player_id -> player
         self.nodes = nodes  # map node_id -> node
         self.decay_rate = decay_rate
         self.starting_units = starting_units
         self.offensive_force = offensive_force
-
+        # scheme stepping units at nodes (see `integrators.py`), others than Euler allow much longer frames
+        self.integrator = integrator
+        self.engine = engine or ObjectEngine()
+        # players get updates only about nodes within interest_radius hops from their units
+        self.interest = None if interest_radius is None else InterestManager(nodes, interest_radius)
+        # smaller changes of units don't wake up nodes nor are broadcast
+        self.tolerance = tolerance
+        # quiet nodes are integrated in closed form instead of frame by frame
+        self.scheduler = SleepScheduler() if sleep_nodes else None
+        # nodes are sent with rates of change of their units, clients extrapolate
+        # and nodes are sent again only when the extrapolation is off beyond tolerance
+        self.rate_updates = rate_updates
+        # encoded once and sent without the game lock
+        self.terrain = Terrain(nodes, tile_size)
+        # shortest routes for route commands, built up as they're asked for
+        self.router = Router(nodes)
+        # formats of unit updates players can choose, ids interned by binary one are shared by all players
+        self.codecs = {'json': JSON, 'binary': BinaryCodec()}
+        # joining players, applied commands and step lengths are logged for restoring and replaying the game
+        self.command_log = command_log
+        # disconnected player can come back with its session token, for this long (in game time), then it's removed
+        self.reconnect_grace = reconnect_grace
+        self.sessions = {}  # session token -> player_id
+
+        self.frame = 0  # number of frames simulated
+        self.time = 0  # simulated time
         self.needs_do_frame = set()
-
-    @property
-    def terrain_data(self):
-        return {k: v.terrain_data for k, v in self.nodes.items()}
-
-    def create_player(self, connection):
-        pid = str(uuid4())
+        self.resync_requests = deque()  # players who need full state, may be appended from any thread
+        self.commands = deque()  # (player_id, command) to apply in the next frame, appended from any thread
+
+    def join(self, connection, token=None):
+        """Connect a player - the one of the session token, if it's still in the game, or a new one. Return its id.
+
+        The player is sent its id and session token, for reconnecting.
+        """
+        player_id = self.sessions.get(token) if token else None
+        if player_id is None:
+            player_id = self.create_player(connection)
+        else:
+            player = self.players[player_id]
+            player.connection = connection
+            player.disconnected_at = None
+            player.codec = JSON
+            player.known_ids = 0
+            self.request_resync(player_id)
+            logger.info('player %s reconnected', player_id)
+        self.send(player_id, 'session', {'player_id': player_id, 'token': self.players[player_id].token})
+        return player_id
+
+    def create_player(self, connection, starting_node_id=None, player_id=None, token=None):
+        pid = player_id or str(uuid4())
         assert pid not in self.players
-        p = Player(connection, 'red')
+        p = Player(connection, 'red', self.metrics, token or secrets.token_urlsafe(16))
         self.players[pid] = p
+        self.sessions[p.token] = pid
         logger.info('created new player with id %s', pid)
 
-        starting_node = random.choice(list(self.nodes.values()))
+        if starting_node_id is None:
+            starting_node = random.choice(list(self.nodes.values()))
+        else:
+            starting_node = self.nodes[starting_node_id]
+        self.wake(starting_node)
         starting_node.units[pid] = self.starting_units
+        if self.command_log is not None:
+            self.command_log.join(self.frame, pid, starting_node.id, p.token)
         self.needs_do_frame.add(starting_node)
 
         return pid
 
-    def handle_command(self, player_id, data):
-        Command.from_user_data(data).execute(self, player_id)
+    def disconnect(self, player_id, connection=None):
+        """Detach player's connection. The player stays in the game for `reconnect_grace`.
+
+        With `connection` (the one closing) the player is detached only if it's
+        still connected by it - the client may have reconnected already.
+        """
+        player = self.players.get(player_id)
+        if player is not None and (connection is None or player.connection is connection):
+            player.connection = None
+            player.disconnected_at = self.time
+            logger.info('player %s disconnected', player_id)
+
+    def reap_players(self):
+        """Remove players gone for longer than `reconnect_grace` and the disconnected ones wiped out.
+
+        Connected players which were wiped out stay, watching, but their
+        dispositions are dropped. Goes through the whole map, so it's meant
+        to be called once in a while.
+        """
+        candidates = [player_id for player_id, player in self.players.items() if not player.wiped_out]
+        present = self.present_players(candidates) if candidates else set()
+        for player_id, player in list(self.players.items()):
+            wiped_out = player.wiped_out or player_id not in present
+            if not player.connected and (wiped_out or (
+                self.reconnect_grace is not None and self.time - player.disconnected_at >= self.reconnect_grace
+            )):
+                self.remove_player(player_id)
+            elif wiped_out and not player.wiped_out:
+                player.wiped_out = True
+                self.purge_player(player_id)
+        self.metrics.players.set(len(self.players))
+        self.metrics.disconnected_players.set(sum(1 for player in self.players.values() if not player.connected))
+
+    def present_players(self, player_ids):
+        """Return those of the players who have any units, in nodes or on the way."""
+        missing = set(player_ids)
+        for node in self.nodes.values():
+            missing.difference_update(node.units)  # sleeping node's units have the right owner
+            if not missing:
+                return set(player_ids)
+        for node in self.nodes.values():
+            for connection in node.connections.values():
+                missing.difference_update(connection.player_ids)
+                if not missing:
+                    return set(player_ids)
+        return set(player_ids) - missing
+
+    def remove_player(self, player_id):
+        """Remove the player and all its state from the game."""
+        player = self.players.pop(player_id)
+        self.sessions.pop(player.token, None)
+        # drop its queued commands in place, keeping the order of the others - they may be appended concurrently
+        for command in [command for command in list(self.commands) if command[0] == player_id]:
+            self.commands.remove(command)
+        self.purge_player(player_id)
+        if self.command_log is not None:
+            self.command_log.leave(self.frame, player_id)
+        logger.info('removed player %s', player_id)
+
+    def purge_player(self, player_id):
+        """Drop player's units, flows and dispositions from the map. Changed objects are stepped in the next frame."""
+        for node in self.nodes.values():
+            if player_id in node.units:
+                self.wake(node)
+            if node.remove_player(player_id):
+                self.needs_do_frame.add(node)
+            for connection in node.connections.values():
+                if connection.remove_player(player_id):
+                    self.needs_do_frame.add(connection)
+
+    def submit_commands(self, player_id, data):
+        """Validate user command (or a list of commands) and queue it for the next frame.
+
+        Doesn't need the game lock. Invalid command rejects the whole list.
+        Commands not touching the simulation (`immediate` ones) are executed
+        right away, in the caller's thread.
+        """
+        for command in Command.from_user_data(data):
+            if command.immediate:
+                command.execute(self, player_id)
+            else:
+                command.prepare(self)
+                self.commands.append((player_id, command))
+
+    def apply_commands(self):
+        # only commands queued so far, so that a flood of them can't prolong the frame
+        for _ in range(len(self.commands)):
+            player_id, command = self.commands.popleft()
+            if self.command_log is not None:
+                self.command_log.command(self.frame, player_id, command.data)
+            try:
+                command.execute(self, player_id)
+            except GameUserError as e:
+                if player_id in self.players:
+                    self.send(player_id, 'error', str(e))
+            except:  # noqa E722
+                logger.exception('error during executing command of player %s', player_id)
 
     def send(self, player_id, type, data):
         self.players[player_id].send(type, data)
 
+    def send_encoded(self, player_id, type, message):
+        self.players[player_id].send_encoded(type, message)
+
+    def broadcast(self, type, data):
+        """Send the same message to all players, serializing it only once per codec."""
+        messages = {}  # codec -> message
+        for player in list(self.players.values()):
+            if not player.connected:
+                continue
+            codec = player.codec
+            if codec not in messages:
+                messages[codec] = codec.encode_message(type, data)
+            player.send_encoded(type, messages[codec])
+
+    def set_protocol(self, player_id, protocol):
+        """Switch format of updates sent to the player, then send it full state in the new one."""
+        player = self.players[player_id]
+        player.codec = self.codecs[protocol]
+        player.known_ids = 0
+        self.request_resync(player_id)
+
     def do_frame(self, dt):
+        self.broadcast_frame(self.simulate_frame(dt))
+
+    def simulate_frame(self, dt):
+        """Apply queued commands and advance the simulation. Return objects to broadcast."""
+        if self.command_log is not None:
+            self.command_log.step(self.frame, dt)
+        phase = self.metrics.phase
+        with phase['commands'].time():
+            self.apply_commands()
+        if self.scheduler is not None:
+            self.needs_do_frame.update(self.scheduler.wake_due(self, dt))
+        self.metrics.active_objects.observe(len(self.needs_do_frame))
+
         # do frame - nodes first, then connections
-        changed = set()
+        nodes = []
         connections = []
         for o in self.needs_do_frame:
             if isinstance(o, Connection):
                 connections.append(o)
             else:
-                changed.update(o.do_frame(self, dt))
-        for o in connections:
-            changed.update(o.do_frame(self, dt))
+                self.wake(o)
+                nodes.append(o)
+        with phase['nodes'].time():
+            changed = self.engine.nodes_frame(self, nodes, dt)
+        with phase['connections'].time():
+            changed.update(self.engine.connections_frame(self, connections, dt))
+        self.frame += 1
+        self.time += dt
+
+        if self.scheduler is not None:
+            # nodes with a single owner and no battle would be stepped until equilibrium - let them sleep
+            for node in nodes:
+                if self.scheduler.try_sleep(self, node, dt):
+                    changed.discard(node)
         self.needs_do_frame = changed
 
-        # send out new state
+        # nodes which were stepped could drift even if their changes were small
+        return changed.union(nodes)
+
+    def wake(self, node):
+        """Bring node's state up to date before touching it from outside of the simulation."""
+        if self.scheduler is not None:
+            self.scheduler.wake(self, node)
+
+    def broadcast_frame(self, changed):
+        with self.metrics.phase['broadcast'].time():
+            self.broadcast_changes(changed)
+            self.send_resyncs()
+
+    def broadcast_changes(self, changed):
+        """Send out new state - all changes of a frame in one batch.
+
+        Nodes are sent only when their units drifted away from the last sent
+        ones (extrapolated by the sent rates, with `rate_updates`) beyond
+        tolerance, so clients are never off by more than that. Nodes which are
+        no longer stepped are sent once more without rates, so that clients
+        stop extrapolating them.
+        Connections are sent only when their flow changed and carry just the
+        new segments - or the whole pipe, when segments clients already have
+        were merged. Objects coming into player's view are sent in full.
+        """
+        if len(self.players) == 0:
+            if self.interest is not None:
+                # nobody to send it to, but the next player to join watches by presence
+                self.interest.update(o for o in changed if isinstance(o, Node))
+            return
+
+        updates = {}  # object -> update of its changed state
         for o in changed:
-            for player_id in self.players.keys():
-                self.send(player_id, 'units', {
-                    'type': o.type_data,
-                    'id': o.id,
-                    'units': o.units_data,
-                })
+            if isinstance(o, Node):
+                if o not in self.needs_do_frame and any(o.broadcast_rates.values()):
+                    # not stepped any more, its units stay - stop clients extrapolating them
+                    o.rates = NOTHING
+                elif not o.units_drifted(self.tolerance, self.time):
+                    continue
+                o.broadcast_units = dict(o.units)
+                o.broadcast_rates = o.rates
+                o.broadcast_time = self.time
+                updates[o] = units_update(o)
+            else:
+                if o.unsent_segments == 0:
+                    continue  # flow just moves along, clients know that
+                updates[o] = units_update(o) if o.unsent_segments is None else units_delta(o)
+                o.unsent_segments = 0
+
+        if self.interest is None:
+            if len(updates) != 0:
+                self.broadcast('units', list(updates.values()))
+            return
+
+        recipients = defaultdict(dict)  # player_id -> object to send -> whether in full
+        for o in updates:
+            for player_id in self.interest.watching(o.node_ids):
+                recipients[player_id][o] = False
+        gained = self.interest.update(o for o in updates if isinstance(o, Node))
+        for player_id, node_ids in gained.items():
+            for node_id in node_ids:
+                node = self.nodes[node_id]
+                recipients[player_id][node] = True
+                for connection in node.connections.values():
+                    recipients[player_id][connection] = True
+
+        encoded = {}  # (object, whether in full, codec) -> encoded update, shared by all recipients
+        for player_id, objects in recipients.items():
+            player = self.players.get(player_id)  # players may be added concurrently, that's fine
+            if player is None or not player.connected:
+                continue
+            codec = player.codec
+            items = []
+            for o, full in objects.items():
+                key = (o, full, codec)
+                if key not in encoded:
+                    encoded[key] = codec.encode_item(units_update(o) if full else updates[o])
+                items.append(encoded[key])
+            player.send_encoded('units', codec.encode_batch('units', items))
+
+    def request_resync(self, player_id):
+        """Ask for sending full state to the player, e.g. after its updates were dropped."""
+        self.resync_requests.append(player_id)
+
+    def send_resyncs(self):
+        resyncing = set()
+        while self.resync_requests:
+            resyncing.add(self.resync_requests.popleft())
+        for player_id in resyncing:
+            player = self.players.get(player_id)
+            if player is None:
+                continue
+            if self.interest is None:
+                nodes = [node for node in self.nodes.values() if node.units]
+            else:
+                nodes = [self.nodes[node_id] for node_id in self.interest.watched_by(player_id)]
+            objects = []
+            for node in nodes:
+                objects.append(node)
+                objects.extend(node.connections.values())
+            player.send('units', [units_update(o) for o in objects])
 
 
 class Node:
     type_data = 'node'
+    # huge maps have millions of nodes and connections - no instance dicts
+    __slots__ = (
+        'id', 'x', 'y', 'production', 'connections',
+        'units', 'incoming', 'dispositions', 'rates', 'broadcast_units', 'broadcast_rates', 'broadcast_time',
+    )
 
     def __init__(self, id, x, y, production, connections):
         self.id = id
@@ -101,8 +624,12 @@ class Node:
 
         # runtime
         self.units = {}  # player_id -> unit count
-        self.incoming = {}  # source_id -> movements
-        self.dispositions = {}  # plyer_id -> disposition
+        self.incoming = NOTHING  # source_id -> movements
+        self.dispositions = NOTHING  # plyer_id -> disposition
+        self.rates = NOTHING  # player_id -> units per second during the last frame, only with rate updates
+        self.broadcast_units = NOTHING  # units last sent to players
+        self.broadcast_rates = NOTHING  # rates last sent to players
+        self.broadcast_time = 0  # game time of the last sending
 
     @property
     def terrain_data(self):
@@ -117,38 +644,65 @@ class Node:
     def units_data(self):
         return self.units
 
+    @property
+    def node_ids(self):
+        return (self.id,)
+
+    def units_drifted(self, tolerance, time=0):
+        """Whether units differ from what players see at `time` beyond tolerance."""
+        return not tolerance.units_close(self.units, self.predicted_units(time))
+
+    def predicted_units(self, time):
+        """Units as players see them - the last sent ones, extrapolated by the last sent rates."""
+        if not self.broadcast_rates:
+            return self.broadcast_units
+        elapsed = time - self.broadcast_time
+        return {
+            player_id: units + self.broadcast_rates.get(player_id, 0) * elapsed
+            for player_id, units in self.broadcast_units.items()
+        }
+
+    def set_disposition(self, player_id, disposition):
+        self.dispositions = {**self.dispositions, player_id: disposition}
+        return {self}
+
+    def remove_player(self, player_id):
+        """Drop player's units, disposition and incoming flows. Return whether units or flows changed."""
+        removed = False
+        if player_id in self.units:
+            del self.units[player_id]
+            removed = True
+        if player_id in self.dispositions:
+            del self.dispositions[player_id]
+        if player_id in self.rates:
+            del self.rates[player_id]
+        for source, movements in self.incoming.items():
+            if player_id in movements:
+                # may be shared with the connection, not changed in place
+                self.incoming[source] = {k: v for k, v in movements.items() if k != player_id}
+                removed = True
+        return removed
+
     def set_incoming(self, source, movements):
         if self.incoming.get(source, {}) == movements:
             return set()
-        self.incoming[source] = movements
+        if source in self.incoming:
+            self.incoming[source] = movements
+        elif not self.incoming:
+            self.incoming = {source: movements}
+        else:
+            # units are summed in the order of sources, keep it the same in every run, so that replays are exact
+            self.incoming = dict(sorted([*self.incoming.items(), (source, movements)], key=lambda item: item[0].source_node_id))
         return {self}
 
     def do_frame(self, game, dt):
         """Do simulation frame. Return objects with states changed during this frame."""
-        total_units = sum(self.units.values())
-        new_units = defaultdict(lambda: 0)
+        if isinstance(game.integrator, Euler):
+            new_units = self.euler_units(game, dt)
+        else:
+            new_units = self.integrated_units(game, dt)
         changed_objects = set()
 
-        for player_id, units in self.units.items():
-            # already there
-            new_units[player_id] += units
-            # production
-            new_units[player_id] += self.production * dt * (units / total_units)
-            # decay
-            new_units[player_id] -= units * dt * game.decay_rate
-
-        # incoming
-        for movement in self.incoming.values():
-            for player_id, throughput in movement.items():
-                new_units[player_id] += throughput * dt
-
-        # battle
-        for attacker_id, attacker_units in self.units.items():
-            other_units = total_units - attacker_units
-            for defender_id, defender_units in self.units.items():
-                if attacker_id != defender_id:
-                    new_units[defender_id] -= attacker_units * (defender_units / other_units) * dt * game.offensive_force
-
         # clean irrelevant units
         for player_id, units in self.units.items():
             if new_units[player_id] <= 0:
@@ -168,21 +722,92 @@ class Node:
                 for target_node_id, ratio in disposition.ratios.items():
                     sending[target_node_id][player_id] = over_target * ratio / dt
         for target_node_id, movements in sending.items():
-            ch = self.connections[target_node_id].set_movements(movements)
+            ch = self.connections[target_node_id].set_movements(movements, game.tolerance)
             changed_objects.update(ch)
             if len(ch) != 0:
                 changed_objects.add(self)
 
+        # stepped as long as its units change at all - small changes add up, tolerance only decides sending them
         if new_units != self.units:
             changed_objects.add(self)
+        if game.rate_updates:
+            self.rates = {player_id: (units - self.units.get(player_id, 0)) / dt for player_id, units in new_units.items()}
         self.units = new_units
         return changed_objects
 
+    def euler_units(self, game, dt):
+        """Units after the frame, before sending, by explicit Euler - the terms are added up one by one."""
+        total_units = sum(self.units.values())
+        new_units = defaultdict(lambda: 0)
+
+        for player_id, units in self.units.items():
+            # already there
+            new_units[player_id] += units
+            # production - none to nobody, when units were all sent away (zero target)
+            if total_units > 0:
+                new_units[player_id] += self.production * dt * (units / total_units)
+            # decay
+            new_units[player_id] -= units * dt * game.decay_rate
+
+        # incoming
+        for movement in self.incoming.values():
+            for player_id, throughput in movement.items():
+                new_units[player_id] += throughput * dt
+
+        # battle - each attacker splits its force between the other players
+        # proportionally to their units, so a defender takes
+        # defender_units * sum(attacker_units / other_units) over other attackers
+        attack = {}
+        for attacker_id, attacker_units in self.units.items():
+            other_units = total_units - attacker_units
+            if other_units > 0:  # not alone (nor are defenders lost in float rounding)
+                attack[attacker_id] = attacker_units / other_units
+        attack_sum = sum(attack.values())
+        for defender_id, defender_units in self.units.items():
+            damage = attack_sum - attack.get(defender_id, 0)
+            new_units[defender_id] -= defender_units * damage * dt * game.offensive_force
+        return new_units
+
+    def integrated_units(self, game, dt):
+        """Units after the frame, before sending, by game's integrator - production, decay and battle as gain and loss rates."""
+        total_units = sum(self.units.values())
+        incoming = defaultdict(lambda: 0)
+        for movement in self.incoming.values():
+            for player_id, throughput in movement.items():
+                incoming[player_id] += throughput
+        attack = {}
+        for attacker_id, attacker_units in self.units.items():
+            other_units = total_units - attacker_units
+            if other_units > 0:
+                attack[attacker_id] = attacker_units / other_units
+        attack_sum = sum(attack.values())
+
+        new_units = defaultdict(lambda: 0)
+        for player_id in itertools.chain(self.units, incoming):
+            if player_id in new_units:
+                continue
+            units = self.units.get(player_id, 0)
+            gain = incoming.get(player_id, 0)
+            if total_units > 0:
+                gain += self.production * (units / total_units)
+            loss = game.decay_rate + (attack_sum - attack.get(player_id, 0)) * game.offensive_force
+            disposition = self.dispositions.get(player_id)
+            if disposition is not None and units >= disposition.target and gain >= loss * units:
+                # held at the target, everything gained beyond it is sent on - linear, exactly
+                new_units[player_id] = units + (gain - loss * units) * dt
+            else:
+                new_units[player_id] = game.integrator.step(units, gain, loss, dt)
+        return new_units
+
 
 class Connection:
     type_data = 'connection'
+    __slots__ = (
+        'source_node_id', 'target_node_id', 'throughput', 'travel_time', 'max_segments',
+        'movements', 'time', '__segments', 'unsent_segments',
+    )
 
-    def __init__(self, source_node_id, target_node_id, throughput, travel_time):
+    def __init__(self, source_node_id, target_node_id, throughput, travel_time, max_segments=None):
         assert throughput > 0
         assert travel_time > 0
 
@@ -190,10 +815,16 @@ class Connection:
         self.target_node_id = target_node_id
         self.throughput = throughput
         self.travel_time = travel_time
+        if max_segments is None:
+            max_segments = MAX_SEGMENTS
+        assert max_segments > 0
+        self.max_segments = max_segments  # older flows kept in the pipe, beyond that they're merged
 
         # runtime
-        self.movements = {}  # player id -> unit throughput
-        self.__changes = []  # collection of dicts {remaining_time, movements}
+        self.movements = NOTHING  # player id -> unit throughput
+        self.time = 0  # time simulated on this connection
+        self.__segments = ()  # deque of [end time, movements] of older flows, newest first, allocated when needed
+        self.unsent_segments = 0  # number of newest segments not broadcast yet, None when older ones changed too
 
     @property
     def terrain_data(self):
@@ -207,28 +838,120 @@ class Connection:
         return [{
             'remaining_time': self.travel_time,
             'movements': self.movements,
-        }] + self.__changes
+        }] + [{
+            'remaining_time': end - self.time,
+            'movements': movements,
+        } for end, movements in self.__segments]
+
+    @property
+    def units_delta(self):
+        """Head of `units_data` - current flow and segments added since the last broadcast."""
+        return self.units_data[:1 + self.unsent_segments]
 
     @property
     def id(self):
         return (self.source_node_id, self.target_node_id)
 
-    def set_movements(self, movements):
+    @property
+    def flow_state(self):
+        """Current flow, clock and older flows in the pipe, as plain data for snapshots."""
+        return self.movements, self.time, [tuple(segment) for segment in self.__segments]
+
+    @property
+    def player_ids(self):
+        """Players with units on the way."""
+        player_ids = set(self.movements)
+        for _, movements in self.__segments:
+            player_ids.update(movements)
+        return player_ids
+
+    def remove_player(self, player_id):
+        """Drop player's flows. Return whether there were any, then the whole pipe is broadcast again."""
+        removed = False
+        if player_id in self.movements:
+            self.movements = {k: v for k, v in self.movements.items() if k != player_id}
+            removed = True
+        for segment in self.__segments:
+            if player_id in segment[1]:
+                segment[1] = {k: v for k, v in segment[1].items() if k != player_id}
+                removed = True
+        if removed:
+            self.unsent_segments = None  # clients have it in segments already sent or in a steady flow
+        return removed
+
+    def restore_flow(self, movements, time, segments):
+        self.movements = movements
+        self.time = time
+        self.__segments = deque(list(segment) for segment in segments) if segments else ()
+        self.unsent_segments = None
+
+    @property
+    def node_ids(self):
+        return self.id
+
+    def set_movements(self, movements, tolerance=EXACT):
+        """Change the flow entering the pipe. Any change counts - units sent must arrive, `tolerance` only merges segments."""
         if self.movements == movements:
             return set()
-        self.__changes.insert(0, {
-            'remaining_time': self.travel_time,
-            'movements': self.movements,
-        })
+        if not self.__segments:
+            self.__segments = deque()
+        self.__segments.appendleft([self.time + self.travel_time, self.movements])
+        if self.unsent_segments is not None:
+            self.unsent_segments += 1
+        self.__merge_similar(0, tolerance)
+        if len(self.__segments) > self.max_segments:
+            # merge the shortest adjacent pair, error is the smallest there
+            durations = self.__segment_durations()
+            i = min(range(len(durations) - 1), key=lambda i: durations[i] + durations[i + 1])
+            self.__merge_segments(i)
+            self.__merge_similar(i, tolerance)
+            if i > 0:
+                self.__merge_similar(i - 1, tolerance)
         self.movements = movements
         return {self}
 
+    def __merge_similar(self, i, tolerance):
+        """Merge i-th segment with the older one, if they're within tolerance or it's empty (set twice in a frame)."""
+        if i + 1 >= len(self.__segments):
+            return
+        newer, older = self.__segments[i], self.__segments[i + 1]
+        if newer[0] <= older[0] or tolerance.units_close(newer[1], older[1]):
+            self.__merge_segments(i)
+
+    def __segment_durations(self):
+        ends = [end for end, _ in self.__segments]
+        return [
+            max(end - (ends[i + 1] if i + 1 < len(ends) else self.time), 0)
+            for i, end in enumerate(ends)
+        ]
+
+    def __merge_segments(self, i):
+        """Merge i-th segment with the older one next to it, keeping the amount of units flowing."""
+        durations = self.__segment_durations()[i:i + 2]
+        newer, older = self.__segments[i], self.__segments[i + 1]
+        total = sum(durations)
+        if total > 0:
+            movements = {
+                player_id: (newer[1].get(player_id, 0) * durations[0] + older[1].get(player_id, 0) * durations[1]) / total
+                for player_id in newer[1].keys() | older[1].keys()
+            }
+            newer[1] = {k: v for k, v in movements.items() if v > 0}
+        del self.__segments[i + 1]
+        if self.unsent_segments is not None:
+            if i + 1 < self.unsent_segments:
+                self.unsent_segments -= 1  # both not broadcast yet, clients get the merged one
+            else:
+                self.unsent_segments = None  # clients have the older one, they need the whole pipe again
+
     def do_frame(self, game, dt):
         target_node = game.nodes[self.target_node_id]
 
-        if len(self.__changes) == 0:
+        if len(self.__segments) == 0:
             # whole connection is filled with single flow
-            return target_node.set_incoming(self, self.movements)
+            changed_objects = target_node.set_incoming(self, self.movements)
+            if self.unsent_segments != 0:
+                changed_objects.add(self)  # changed in place, e.g. a player removed
+            return changed_objects
 
         changed_objects = {self}
 
@@ -240,15 +963,23 @@ class Connection:
             for player_id, u in dunits.items():
                 units[player_id] += u * current_dt
 
-        for ch in reversed(self.__changes):
-            consumed_dt = ch['remaining_time']
-            ch['remaining_time'] -= dt
-            if ch['remaining_time'] <= 0:
-                self.__changes.pop()
-            add_units(consumed_dt, ch['movements'])
+        # only segments arriving in this frame are visited, the oldest first
+        for end, movements in reversed(self.__segments):
+            consumed_dt = end - self.time
+            add_units(consumed_dt, movements)
             previous_consumed_dt = consumed_dt
-
-        add_units(max(self.travel_time, dt), self.movements)
+            if consumed_dt >= dt:
+                break
+        else:
+            add_units(max(self.travel_time, dt), self.movements)
+
+        self.time += dt
+        while self.__segments and self.__segments[-1][0] <= self.time:
+            self.__segments.pop()
+        if not self.__segments:
+            self.__segments = ()  # most connections are idle, don't keep a deque for each
+        if self.unsent_segments is not None:
+            self.unsent_segments = min(self.unsent_segments, len(self.__segments))
 
         changed_objects.update(target_node.set_incoming(self, {
             k: v / dt
@@ -260,13 +991,32 @@ class Connection:
 
 
 class Player:
-    def __init__(self, connection, color):
-        self.connection = connection
+    def __init__(self, connection, color, metrics=None, token=None):
+        self.connection = connection  # None while disconnected
         self.color = color
+        self.metrics = metrics
+        self.token = token  # secret for reconnecting
+        self.disconnected_at = None  # game time
+        self.wiped_out = False
+        self.codec = JSON
+        self.known_ids = 0  # number of interned ids the client got, for binary codec
 
     @property
     def player_data(self):
         return {'color': self.color}
 
     def send(self, type, data):
-        self.connection.send(type, data)
+        self.send_encoded(type, self.codec.encode_message(type, data))
+
+    @property
+    def connected(self):
+        return self.connection is not None
+
+    def send_encoded(self, type, message):
+        if self.connection is None:
+            return
+        if isinstance(message, bytes):
+            self.codec.prepare(self)  # it may refer to ids the client doesn't know yet
+        if self.metrics is not None:
+            self.metrics.message_sent(type, message)
+        self.connection.send_encoded(type, message)
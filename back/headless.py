@@ -0,0 +1,222 @@
+"""Headless game - simulated as fast as possible, without sockets.
+
+Players and their commands come from a script (JSON):
+
+    {
+        "players": {"alice": {"start": "(0, 0)"}, "bob": {}},
+        "commands": [
+            {"time": 0, "player": "alice", "command": {"type": "disposition", "data": {...}}}
+        ]
+    }
+
+Players without "start" get a random starting node. Run from the `back`
+directory, final state and timing are written as JSON:
+
+    python headless.py --map square --size 20 --duration 600 --script script.json
+
+A match logged by the server (see `snapshots.py`) can be replayed instead,
+possibly starting from a snapshot, `--duration` is then simulated after it:
+
+    python headless.py --map square --size 5 --replay commands.log --snapshot snapshots/snapshot-0000000300.bin --duration 0
+
+With `--regions` the map is split and simulated by that many processes (see `partition.py`).
+"""
+import argparse
+import functools
+import heapq
+import itertools
+import json
+import math
+import random
+import sys
+import time
+
+from game import Game, FrameStats, Tolerance
+from integrators import INTEGRATORS
+from map_generators import SquareMapGenerator, HexMapGenerator, RandomGeometricMapGenerator, ArchipelagoMapGenerator
+from snapshots import decode, read_log, replay, restore
+
+
+class HeadlessConnection:
+    """Player's connection which only counts messages sent to it."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def send_encoded(self, type, message):
+        self.messages += 1
+        self.bytes += len(message)
+
+
+class HeadlessRunner:
+    """Steps the game by `dt` as fast as possible, submitting scheduled commands on time.
+
+    Players are known by names here. Commands (user data, as clients would
+    send them) are submitted in the first frame starting at or after their
+    time. Broadcasting (serialization of updates) is skipped unless asked for.
+    """
+
+    def __init__(self, game, dt, broadcast=False):
+        self.game = game
+        self.dt = dt
+        self.broadcast = broadcast
+        self.players = {}  # name -> player id
+        self.connections = {}  # name -> connection
+        self.schedule = []  # heap of (time, sequence number, player name, command data)
+        self.sequence = itertools.count()
+        self.stats = FrameStats()
+
+    def add_player(self, name, starting_node_id=None):
+        connection = HeadlessConnection()
+        self.players[name] = self.game.create_player(connection, starting_node_id)
+        self.connections[name] = connection
+
+    def add_command(self, time, name, data):
+        heapq.heappush(self.schedule, (time, next(self.sequence), name, data))
+
+    def run(self, duration):
+        """Simulate `duration` seconds of game time."""
+        frames = math.ceil(duration / self.dt - 1e-9)
+        for _ in range(frames):
+            start = time.perf_counter()
+            while self.schedule and self.schedule[0][0] <= self.game.time + 1e-9:
+                _, _, name, data = heapq.heappop(self.schedule)
+                self.game.submit_commands(self.players[name], data)
+            if self.broadcast:
+                self.game.do_frame(self.dt)
+            else:
+                self.game.simulate_frame(self.dt)
+            self.stats.add(time.perf_counter() - start)
+
+    @property
+    def state(self):
+        names = {player_id: name for name, player_id in self.players.items()}
+        for node in self.game.nodes.values():
+            self.game.wake(node)
+        nodes = {
+            node_id: {names.get(player_id, player_id): units for player_id, units in node.units.items()}
+            for node_id, node in self.game.nodes.items()
+            if node.units
+        }
+        totals = {name: 0 for name in self.players}
+        for units in nodes.values():
+            for name, u in units.items():
+                totals[name] = totals.get(name, 0) + u
+        return {
+            'time': self.game.time,
+            'frame': self.game.frame,
+            'players': {
+                name: {
+                    'units': totals[name],
+                    'nodes': sum(1 for units in nodes.values() if name in units),
+                }
+                for name in self.players
+            },
+            'nodes': nodes,
+        }
+
+
+def make_map(kind, size, seed, pause_gc=False):
+    """Map of about size x size nodes, `pause_gc` as in MapGenerator.generate."""
+    common = {'production': 20, 'throughput': 1}
+    if kind == 'square':
+        return SquareMapGenerator(x=size, y=size, distance=25, **common).generate(pause_gc)
+    if kind == 'hex':
+        return HexMapGenerator(x=size, y=size, distance=25, **common).generate(pause_gc)
+    # about 6 neighbours per node
+    side = math.sqrt(size ** 2 * math.pi * 25 ** 2 / 6)
+    if kind == 'random':
+        return RandomGeometricMapGenerator(count=size ** 2, width=side, height=side, radius=25, seed=seed, **common).generate(pause_gc)
+    if kind == 'archipelago':
+        islands = max(1, size ** 2 // 100)
+        return ArchipelagoMapGenerator(
+            islands=islands, island_nodes=size ** 2 // islands, island_radius=side / math.sqrt(islands) / 2,
+            width=side * 2, height=side * 2, radius=25, seed=seed, **common,
+        ).generate(pause_gc)
+    raise ValueError('unknown map {}'.format(kind))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate a game without clients, as fast as possible.')
+    parser.add_argument('--map', choices=('square', 'hex', 'random', 'archipelago'), default='square')
+    parser.add_argument('--size', type=int, default=10, help='map has about size x size nodes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--script', help='JSON with players and commands, by default two idle players')
+    parser.add_argument('--duration', type=float, default=60, help='simulated seconds')
+    parser.add_argument('--dt', type=float, default=1 / 5)
+    parser.add_argument('--engine', choices=('object', 'vectorized'), default='object')
+    parser.add_argument('--tolerance', type=float, default=0, help='absolute tolerance of units')
+    parser.add_argument('--sleep-nodes', action='store_true')
+    parser.add_argument('--integrator', choices=INTEGRATORS, default='euler', help='integration of units over a frame')
+    parser.add_argument('--regions', type=int, help='simulate regions of the map in this many processes')
+    parser.add_argument('--broadcast', action='store_true', help='serialize updates as if players were connected')
+    parser.add_argument('--replay', help='command log of a match to replay instead of the script')
+    parser.add_argument('--snapshot', help='snapshot of the match to start the replay from')
+    parser.add_argument('--output', help='file for the final state, standard output by default')
+    args = parser.parse_args(argv)
+    if args.regions and args.replay:
+        parser.error('replays are simulated in a single process')
+
+    random.seed(args.seed)
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    else:
+        script = {'players': {'player1': {}, 'player2': {}}, 'commands': []}
+
+    engine = None
+    if args.engine == 'vectorized':
+        from vectorized import VectorizedEngine
+        engine = VectorizedEngine()
+    settings = {
+        'decay_rate': 0.1,
+        'starting_units': 10,
+        'offensive_force': 1,
+        'engine': engine,
+        'tolerance': Tolerance(absolute=args.tolerance),
+        'sleep_nodes': args.sleep_nodes,
+        'integrator': INTEGRATORS[args.integrator],
+    }
+    if args.regions:
+        from partition import PartitionedGame
+        game = PartitionedGame(functools.partial(make_map, args.map, args.size, args.seed), args.regions, **settings)
+    else:
+        game = Game(nodes=make_map(args.map, args.size, args.seed, pause_gc=True), **settings)  # no other threads yet
+    runner = HeadlessRunner(game, args.dt, broadcast=args.broadcast)
+    start = time.perf_counter()
+    if args.replay:
+        if args.snapshot:
+            with open(args.snapshot, 'rb') as f:
+                restore(game, decode(f.read()))
+        with open(args.replay) as f:
+            replay(game, read_log(f), HeadlessConnection)
+        runner.players = {player_id: player_id for player_id in game.players}
+    else:
+        for name, player in script['players'].items():
+            runner.add_player(name, player.get('start'))
+        for command in script['commands']:
+            runner.add_command(command['time'], command['player'], command['command'])
+    runner.run(args.duration)
+    wall_time = time.perf_counter() - start
+    if args.regions:
+        game.sync()
+        game.close()
+
+    result = runner.state
+    result['timing'] = {
+        'wall_time': wall_time,
+        'speedup': game.time / wall_time if wall_time > 0 else math.inf,
+        'frames': runner.stats.summary(),
+        'phases': game.metrics.summary(),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+from collections import defaultdict, deque
+
+
+class InterestManager:
+    """Tracks which nodes are interesting for which players.
+
+    A node is interesting for a player if it lies within `radius` hops from
+    some node where the player has units. Interest is updated incrementally -
+    only nodes whose set of present players changed are processed - and is
+    reference counted, because a node can be in reach of many of player's
+    nodes.
+    """
+
+    def __init__(self, nodes, radius):
+        self.nodes = nodes  # map node_id -> node
+        self.radius = radius
+
+        self.presence = {}  # node_id -> set of players with units there
+        self.watchers = {}  # node_id -> (player_id -> number of player's nodes in reach)
+        self.reach_cache = {}  # node_id -> node ids within radius
+
+    def reach(self, node_id):
+        """Return ids of nodes within `radius` hops from the node."""
+        reach = self.reach_cache.get(node_id)
+        if reach is None:
+            reach = {node_id}
+            queue = deque([(node_id, 0)])
+            while queue:
+                current_id, distance = queue.popleft()
+                if distance == self.radius:
+                    continue
+                for neighbour_id in self.nodes[current_id].connections.keys():
+                    if neighbour_id not in reach:
+                        reach.add(neighbour_id)
+                        queue.append((neighbour_id, distance + 1))
+            self.reach_cache[node_id] = reach
+        return reach
+
+    def update(self, nodes):
+        """Account for changed presence on given nodes.
+
+        Return map player_id -> ids of nodes that became interesting for the player.
+        """
+        gained = defaultdict(set)
+        for node in nodes:
+            present = set(node.units.keys())
+            previously_present = self.presence.get(node.id, set())
+            if present == previously_present:
+                continue
+            if present:
+                self.presence[node.id] = present
+            else:
+                self.presence.pop(node.id, None)
+
+            for player_id in present - previously_present:
+                for node_id in self.reach(node.id):
+                    watchers = self.watchers.setdefault(node_id, {})
+                    count = watchers.get(player_id, 0)
+                    if count == 0:
+                        gained[player_id].add(node_id)
+                    watchers[player_id] = count + 1
+
+            for player_id in previously_present - present:
+                for node_id in self.reach(node.id):
+                    watchers = self.watchers[node_id]
+                    watchers[player_id] -= 1
+                    if watchers[player_id] == 0:
+                        del watchers[player_id]
+                        gained[player_id].discard(node_id)
+                        if not watchers:
+                            del self.watchers[node_id]
+        return gained
+
+    def watched_by(self, player_id):
+        """Return ids of nodes interesting for the player."""
+        return [
+            node_id
+            for node_id, watchers in self.watchers.items()
+            if player_id in watchers
+        ]
+
+    def watching(self, node_ids):
+        """Return ids of players interested in any of given nodes."""
+        players = set()
+        for node_id in node_ids:
+            players.update(self.watchers.get(node_id, ()))
+        return players
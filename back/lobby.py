@@ -0,0 +1,354 @@
+"""Many games on all cores - a lobby process in front of a pool of worker processes.
+
+Clients connect to the lobby at ws://host:port/<game id>[?token=<session token>].
+A game is started on the first connection to it, on the worker with the most
+tick headroom left, and lives until all its players are gone. The lobby only
+passes messages between websockets and workers (over pipes), each worker
+hosts its games and steps all of them in a single thread:
+
+    python lobby.py --workers 4 --port 8080 --metrics-port 9100
+"""
+import argparse
+import asyncio
+from collections import deque
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+
+from commands import GameUserError, MAX_MESSAGE_SIZE, decode_message
+from game import Game, SimulationRunner
+from headless import make_map
+from messages import encode_message
+from metrics import MetricsServer, Registry
+
+
+logger = logging.getLogger(__name__)
+
+
+GAME_ID = re.compile(r'[A-Za-z0-9_-]{1,32}')
+LOAD_INTERVAL = 1  # seconds between load reports of workers
+
+
+def make_game(settings):
+    return Game(
+        nodes=make_map(settings.get('map', 'square'), settings.get('size', 5), settings.get('seed', 0)),
+        decay_rate=0.1,
+        starting_units=10,
+        offensive_force=1,
+        rate_updates=settings.get('rate_updates', False),
+    )
+
+
+class WorkerConnection:
+    """Player's connection as a game on a worker sees it - messages go to the lobby."""
+
+    def __init__(self, worker, client_id):
+        self.worker = worker
+        self.client_id = client_id
+
+    def send(self, type, data):
+        self.send_encoded(type, encode_message(type, data))
+
+    def send_encoded(self, type, message):
+        self.worker.post(('send', self.client_id, message))
+
+
+class Worker:
+    """Hosts games in a worker process.
+
+    Messages from the lobby are handled in a reader thread, all games are
+    stepped (in fixed steps of `dt`) by the main one and messages to the
+    lobby are sent in batches by a writer thread. Headroom is the portion of
+    wall-clock time the stepping thread was idle - how much more it could
+    take.
+    """
+
+    def __init__(self, pipe, settings, dt=1 / 5):
+        self.pipe = pipe
+        self.settings = settings
+        self.dt = dt
+        self.runners = {}  # game_id -> runner (not started, stepped by this worker)
+        self.clients = {}  # client_id -> (game_id, player_id, connection)
+        self.last_joins = {}  # game_id -> id of the client which joined it last, reported when it ends
+        self.lock = threading.Lock()  # for starting and ending games
+        self.outgoing = deque()  # messages for the lobby
+        self.has_outgoing = threading.Event()
+        self.headroom = 1
+
+    def post(self, message):
+        self.outgoing.append(message)
+        self.has_outgoing.set()
+
+    def flush(self):
+        """Send posted messages to the lobby, in a single batch."""
+        batch = []
+        while self.outgoing:
+            batch.append(self.outgoing.popleft())
+        if batch:
+            self.pipe.send(batch)
+
+    def write(self):
+        while True:
+            self.has_outgoing.wait()
+            self.has_outgoing.clear()
+            self.flush()
+
+    def read(self):
+        while True:
+            try:
+                message = self.pipe.recv()
+            except EOFError:
+                os._exit(0)  # lobby is gone
+            try:
+                self.handle(message)
+            except:  # noqa E722
+                logger.exception('error during handling %s', message[0])
+
+    def handle(self, message):
+        kind, client_id, *args = message
+        if kind == 'join':
+            game_id, token = args
+            with self.lock:
+                runner = self.runners.get(game_id)
+                if runner is None:
+                    runner = SimulationRunner(make_game(self.settings), self.dt, fixed_timestep=True, max_broadcast_interval=4)
+                    self.runners[game_id] = runner
+                    logger.info('started game %s', game_id)
+                self.last_joins[game_id] = client_id
+                connection = WorkerConnection(self, client_id)
+                with runner.game.lock:
+                    player_id = runner.game.join(connection, token)
+            self.clients[client_id] = (game_id, player_id, connection)
+        elif kind == 'message':
+            game_id, player_id, _ = self.clients[client_id]
+            try:
+                self.runners[game_id].game.submit_commands(player_id, decode_message(args[0]))
+            except GameUserError as e:
+                WorkerConnection(self, client_id).send('error', str(e))
+        elif kind == 'leave':
+            game_id, player_id, connection = self.clients.pop(client_id)
+            game = self.runners[game_id].game
+            with game.lock:
+                game.disconnect(player_id, connection)
+
+    def step(self, elapsed):
+        """Step all games by `elapsed` wall-clock seconds. Return time until the next step is due."""
+        to_sleep = self.dt
+        for game_id, runner in list(self.runners.items()):
+            to_sleep = min(to_sleep, runner.tick(elapsed))
+            runner.maybe_reap()
+            with self.lock:
+                if not runner.game.players:
+                    del self.runners[game_id]
+                    self.post(('ended', game_id, self.last_joins.pop(game_id)))
+                    logger.info('game %s ended', game_id)
+        return to_sleep
+
+    def load(self):
+        return {
+            'games': len(self.runners),
+            'players': sum(len(runner.game.players) for runner in list(self.runners.values())),
+            'headroom': self.headroom,
+        }
+
+    def run(self):
+        threading.Thread(target=self.read, daemon=True).start()
+        threading.Thread(target=self.write, daemon=True).start()
+        previous = window_start = time.monotonic()
+        busy = 0
+        while True:
+            start = time.monotonic()
+            to_sleep = self.step(start - previous)
+            previous = start
+            busy += time.monotonic() - start
+            if start - window_start >= LOAD_INTERVAL:
+                self.headroom = max(0, 1 - busy / (start - window_start))
+                self.post(('load', None, self.load()))
+                window_start = start
+                busy = 0
+            if to_sleep > 0:
+                time.sleep(to_sleep)
+
+
+def worker_main(pipe, settings):
+    logging.basicConfig(level=logging.INFO)
+    Worker(pipe, settings).run()
+
+
+class WorkerHandle:
+    """Lobby's side of a worker process.
+
+    Messages for the worker are posted from the event loop and sent by a
+    writer thread - writing to the pipe blocks while the worker is too busy
+    to read it.
+    """
+
+    def __init__(self, index, process, pipe):
+        self.index = index
+        self.process = process
+        self.pipe = pipe
+        self.games = {}  # game_id -> id of the client sent to join it last, games hosted there
+        self.players = 0
+        self.headroom = 1
+        self.outgoing = deque()  # messages for the worker
+        self.has_outgoing = threading.Event()
+
+    def post(self, message):
+        self.outgoing.append(message)
+        self.has_outgoing.set()
+
+    def flush(self):
+        """Send posted messages to the worker, in order."""
+        while self.outgoing:
+            self.pipe.send(self.outgoing.popleft())
+
+    def write(self):
+        while True:
+            self.has_outgoing.wait()
+            self.has_outgoing.clear()
+            try:
+                self.flush()
+            except OSError:
+                logger.error('worker %d is gone', self.index)
+                return
+
+
+class LobbyClient:
+    def __init__(self, lobby, websocket, client_id):
+        self.lobby = lobby
+        self.websocket = websocket
+        self.client_id = client_id
+        self.queue = asyncio.Queue(lobby.max_queue)
+
+    def enqueue(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.info('disconnecting slow client %s', self.websocket.remote_address)
+            asyncio.ensure_future(self.websocket.close(1008, 'Too slow'))
+
+    async def write(self):
+        while True:
+            await self.websocket.send(await self.queue.get())
+
+
+class Lobby:
+    def __init__(self, host, port, workers=None, settings=None, max_queue=256):
+        self.host = host
+        self.port = port
+        self.worker_count = workers or os.cpu_count()
+        self.settings = settings or {}
+        self.max_queue = max_queue  # messages waiting for a single client
+        self.workers = []
+        self.games = {}  # game_id -> worker handle
+        self.clients = {}  # client_id -> lobby client
+        self.client_ids = itertools.count()
+        self.loop = None
+        self.metrics = Registry()
+
+    def start_workers(self):
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.worker_count):
+            pipe, worker_pipe = context.Pipe()
+            process = context.Process(target=worker_main, args=(worker_pipe, self.settings), daemon=True)
+            process.start()
+            worker = WorkerHandle(index, process, pipe)
+            self.workers.append(worker)
+            threading.Thread(target=self.read, args=(worker,), daemon=True).start()
+            threading.Thread(target=worker.write, daemon=True).start()
+
+    def read(self, worker):
+        while True:
+            try:
+                batch = worker.pipe.recv()
+            except EOFError:
+                logger.error('worker %d is gone', worker.index)
+                return
+            self.loop.call_soon_threadsafe(self.handle_batch, worker, batch)
+
+    def handle_batch(self, worker, batch):
+        for kind, key, data in batch:
+            if kind == 'send':
+                client = self.clients.get(key)
+                if client is not None:
+                    client.enqueue(data)
+            elif kind == 'load':
+                worker.players = data['players']
+                worker.headroom = data['headroom']
+                labels = {'worker': str(worker.index)}
+                self.metrics.gauge('worker_headroom', 'Portion of time the worker could spend stepping more games.', **labels).set(data['headroom'])
+                self.metrics.gauge('worker_games', 'Games hosted by the worker.', **labels).set(data['games'])
+                self.metrics.gauge('worker_players', 'Players in games of the worker.', **labels).set(data['players'])
+            elif kind == 'ended':
+                # with a join sent since the game ended, the worker starts it again - it stays there
+                if key in worker.games and worker.games[key] == data:
+                    del worker.games[key]
+                    if self.games.get(key) is worker:
+                        del self.games[key]
+
+    def assign(self, game_id, client_id):
+        """Worker the client joins the game at - for a new game, the one with the most headroom, then the fewest games."""
+        worker = self.games.get(game_id)
+        if worker is None:
+            worker = max(self.workers, key=lambda w: (round(w.headroom, 2), -len(w.games), -w.players))
+            self.games[game_id] = worker
+        worker.games[game_id] = client_id
+        return worker
+
+    async def handle(self, websocket):
+        url = urlsplit(websocket.request.path)
+        game_id = url.path.strip('/') or 'default'
+        if not GAME_ID.fullmatch(game_id):
+            await websocket.close(1008, 'Invalid game id')
+            return
+        token = parse_qs(url.query).get('token', [None])[0]
+
+        client = LobbyClient(self, websocket, next(self.client_ids))
+        self.clients[client.client_id] = client
+        worker = self.assign(game_id, client.client_id)
+        worker.post(('join', client.client_id, game_id, token))
+        writer = asyncio.ensure_future(client.write())
+        try:
+            async for data in websocket:
+                worker.post(('message', client.client_id, data))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            writer.cancel()
+            del self.clients[client.client_id]
+            worker.post(('leave', client.client_id))
+
+    async def serve_forever(self, started=None):
+        self.loop = asyncio.get_running_loop()
+        self.start_workers()
+        async with websockets.serve(self.handle, self.host, self.port, max_size=MAX_MESSAGE_SIZE) as server:
+            if started is not None:
+                started.set_result(server)
+            await asyncio.get_running_loop().create_future()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host many games on a pool of worker processes.')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, help='worker processes, by default one per core')
+    parser.add_argument('--map', choices=('square', 'hex', 'random', 'archipelago'), default='square')
+    parser.add_argument('--size', type=int, default=5, help='maps have about size x size nodes')
+    parser.add_argument('--rate-updates', action='store_true', help='send rates of change, clients extrapolate')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics of workers at localhost:PORT/metrics')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    lobby = Lobby(args.host, args.port, args.workers, {'map': args.map, 'size': args.size, 'rate_updates': args.rate_updates})
+    if args.metrics_port is not None:
+        MetricsServer(lobby.metrics, port=args.metrics_port).start()
+    logger.info('starting the lobby at %s:%d with %d workers', args.host, args.port, lobby.worker_count)
+    asyncio.run(lobby.serve_forever())
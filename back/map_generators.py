@@ -1,4 +1,9 @@
+import functools
+import gc
 import itertools
+import math
+import random
+import sys
 
 from game import Node, Connection
 
@@ -8,27 +13,58 @@ class MapGenerator:
         self.production = production
         self.throughput = throughput
 
-    def generate(self):
-        return {
-            self.stringify_node_id(node_id): Node(
-                id=self.stringify_node_id(node_id),
-                **self.node_position(node_id),
+    def generate(self, pause_gc=False):
+        """Map as a dict of nodes by id.
+
+        Nothing built here is garbage, `pause_gc` keeps the collector from
+        scanning the growing map over and over (about a third faster for big
+        maps). It's switched off for the whole process, so pass it only when
+        no other thread runs, e.g. in command line tools.
+        """
+        if not pause_gc or not gc.isenabled():
+            return {node.id: node for node in self.iter_nodes()}
+        gc.disable()
+        try:
+            return {node.id: node for node in self.iter_nodes()}
+        finally:
+            gc.enable()
+
+    def iter_nodes(self):
+        """Yield nodes one by one, so that they can be streamed elsewhere without building the whole map."""
+        for node_id in self.node_ids:
+            # ids of connections' targets are the same objects as ids of the nodes, not copies
+            id = sys.intern(self.stringify_node_id(node_id))
+            position = self.node_position(node_id)
+            connections = {}
+            for to_id in self.node_connections(node_id):
+                if not self.has_node(to_id):
+                    continue
+                to_position = self.node_position(to_id)
+                target_node_id = sys.intern(self.stringify_node_id(to_id))
+                connections[target_node_id] = Connection(
+                    source_node_id=id,
+                    target_node_id=target_node_id,
+                    throughput=self.connection_throughput(node_id, to_id),
+                    travel_time=math.hypot(position['x'] - to_position['x'], position['y'] - to_position['y']),
+                )
+            yield Node(
+                id=id,
+                **position,
                 production=self.node_production(node_id),
-                connections={
-                    self.stringify_node_id(to_id): Connection(
-                        **self.connection_properties(node_id, to_id),
-                    )
-                    for to_id in self.node_connections(node_id)
-                    if to_id in self.node_ids
-                }
+                connections=connections,
             )
-            for node_id in self.node_ids
-        }
 
     @property
     def node_ids(self):
         raise NotImplementedError()
 
+    @functools.cached_property
+    def node_id_set(self):
+        return set(self.node_ids)
+
+    def has_node(self, node_id):
+        return node_id in self.node_id_set
+
     def stringify_node_id(self, node_id):
         return str(node_id)
 
@@ -41,15 +77,8 @@ class MapGenerator:
     def node_connections(self, node_id):
         raise NotImplementedError()
 
-    def connection_properties(self, from_id, to_id):
-        f = self.node_position(from_id)
-        t = self.node_position(to_id)
-        return {
-            'source_node_id': from_id,
-            'target_node_id': to_id,
-            'throughput': self.throughput,
-            'travel_time': ((f['x'] - t['x']) ** 2 + (f['y'] - t['y']) ** 2) ** 0.5,
-        }
+    def connection_throughput(self, from_id, to_id):
+        return self.throughput
 
 
 class SquareMapGenerator(MapGenerator):
@@ -63,6 +92,12 @@ class SquareMapGenerator(MapGenerator):
     def node_ids(self):
         return itertools.product(range(self.x), range(self.y))
 
+    def has_node(self, node_id):
+        return 0 <= node_id[0] < self.x and 0 <= node_id[1] < self.y
+
+    def stringify_node_id(self, node_id):
+        return '(%d, %d)' % node_id  # same as str() of the tuple, only faster
+
     def node_position(self, node_id):
         return {
             'x': node_id[0] * self.distance,
@@ -78,3 +113,160 @@ class SquareMapGenerator(MapGenerator):
             (x - 1, y),
             (x, y - 1),
         ]
+
+
+class HexMapGenerator(SquareMapGenerator):
+    """Hexagonal grid, rows are shifted by half of the distance every other row."""
+
+    def node_position(self, node_id):
+        return {
+            'x': (node_id[0] + (node_id[1] % 2) / 2) * self.distance,
+            'y': node_id[1] * self.distance * math.sqrt(3) / 2,
+        }
+
+    def node_connections(self, node_id):
+        x = node_id[0]
+        y = node_id[1]
+        shift = y % 2  # odd rows are shifted right
+        return [
+            (x + 1, y),
+            (x - 1, y),
+            (x - 1 + shift, y - 1),
+            (x + shift, y - 1),
+            (x - 1 + shift, y + 1),
+            (x + shift, y + 1),
+        ]
+
+
+class SpatialGrid:
+    """Points bucketed into square cells, for finding points near a position."""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell x, cell y) -> list of point ids
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def add(self, point_id, x, y):
+        self.cells.setdefault(self.cell(x, y), []).append(point_id)
+
+    def near(self, x, y):
+        """Ids of points in the cell of the position and the cells around it - a superset of ones within cell size."""
+        cx, cy = self.cell(x, y)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                yield from self.cells.get((cx + dx, cy + dy), ())
+
+
+class RandomGeometricMapGenerator(MapGenerator):
+    """Nodes scattered randomly on a rectangle, connected when closer than `radius`."""
+
+    def __init__(self, count, width, height, radius, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.count = count
+        self.width = width
+        self.height = height
+        self.radius = radius
+        self.random = random.Random(seed)
+
+    @functools.cached_property
+    def positions(self):
+        return [
+            (self.random.uniform(0, self.width), self.random.uniform(0, self.height))
+            for _ in range(self.count)
+        ]
+
+    @functools.cached_property
+    def grid(self):
+        grid = SpatialGrid(self.radius)
+        for node_id, (x, y) in enumerate(self.positions):
+            grid.add(node_id, x, y)
+        return grid
+
+    @property
+    def node_ids(self):
+        return range(len(self.positions))
+
+    def has_node(self, node_id):
+        return 0 <= node_id < len(self.positions)
+
+    def stringify_node_id(self, node_id):
+        return 'n{}'.format(node_id)
+
+    def node_position(self, node_id):
+        x, y = self.positions[node_id]
+        return {'x': x, 'y': y}
+
+    def node_connections(self, node_id):
+        x, y = self.positions[node_id]
+        radius2 = self.radius ** 2
+        positions = self.positions
+        connections = []
+        for to_id in self.grid.near(x, y):
+            to_x, to_y = positions[to_id]
+            if (to_x - x) ** 2 + (to_y - y) ** 2 <= radius2 and to_id != node_id:
+                connections.append(to_id)
+        return connections
+
+
+class ArchipelagoMapGenerator(RandomGeometricMapGenerator):
+    """Clusters of nodes (islands) joined by single bridges.
+
+    Nodes of an island are scattered around its center and connected like in
+    a random geometric map. Islands are joined along a minimum spanning tree of
+    their centers, so the whole map is connected as long as islands are.
+    """
+
+    def __init__(self, islands, island_nodes, island_radius, width, height, radius, seed=None, **kwargs):
+        super().__init__(count=islands * island_nodes, width=width, height=height, radius=radius, seed=seed, **kwargs)
+        self.islands = islands
+        self.island_nodes = island_nodes
+        self.island_radius = island_radius
+
+    @functools.cached_property
+    def centers(self):
+        return [
+            (self.random.uniform(0, self.width), self.random.uniform(0, self.height))
+            for _ in range(self.islands)
+        ]
+
+    @functools.cached_property
+    def positions(self):
+        positions = []
+        for cx, cy in self.centers:
+            for _ in range(self.island_nodes):
+                angle = self.random.uniform(0, 2 * math.pi)
+                distance = self.island_radius * math.sqrt(self.random.random())  # uniform over the disc
+                positions.append((cx + distance * math.cos(angle), cy + distance * math.sin(angle)))
+        return positions
+
+    @functools.cached_property
+    def bridges(self):
+        """node id -> node ids on other islands it's connected to"""
+        def distance2(a, b):
+            return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2
+
+        def closest_node(island, point):
+            start = island * self.island_nodes
+            return min(range(start, start + self.island_nodes), key=lambda i: distance2(self.positions[i], point))
+
+        # Prim's algorithm, islands are few
+        bridges = {}
+        best = {island: (distance2(self.centers[0], self.centers[island]), 0) for island in range(1, self.islands)}
+        while best:
+            island = min(best, key=lambda i: best[i][0])
+            _, other = best.pop(island)
+            a = closest_node(island, self.centers[other])
+            b = closest_node(other, self.centers[island])
+            bridges.setdefault(a, []).append(b)
+            bridges.setdefault(b, []).append(a)
+            for i, (d, _) in best.items():
+                new_d = distance2(self.centers[island], self.centers[i])
+                if new_d < d:
+                    best[i] = (new_d, island)
+        return bridges
+
+    def node_connections(self, node_id):
+        connections = super().node_connections(node_id)
+        return connections + [to_id for to_id in self.bridges.get(node_id, ()) if to_id not in connections]
@@ -0,0 +1,64 @@
+import json
+
+
+def encode_message(type, data):
+    """Serialize message for clients. Encode once, send the result to as many clients as needed."""
+    return json.dumps({
+        'type': type,
+        'data': data,
+    })
+
+
+def encode_data(data):
+    return json.dumps(data)
+
+
+def encode_batch(type, encoded_items):
+    """Serialize message whose data is a list of already encoded items."""
+    return '{{"type": {}, "data": [{}]}}'.format(json.dumps(type), ', '.join(encoded_items))
+
+
+def units_update(o):
+    """Data describing current state of a node or a connection."""
+    update = {
+        'type': o.type_data,
+        'id': o.id,
+        'units': o.units_data,
+    }
+    if o.type_data == 'node' and o.rates:
+        update['rates'] = o.rates  # units per second, for extrapolation
+    return update
+
+
+def units_delta(connection):
+    """Data describing what changed in a connection since its last update - new flow segments.
+
+    They're the head of the `units` list, older segments are the ones sent before.
+    """
+    return {
+        'type': connection.type_data,
+        'id': connection.id,
+        'units_delta': connection.units_delta,
+    }
+
+
+class JsonCodec:
+    """Encoding of messages for clients, JSON is the default one for all messages."""
+    name = 'json'
+
+    def encode_message(self, type, data):
+        return encode_message(type, data)
+
+    def encode_item(self, data):
+        """Encode an item of a batch message."""
+        return encode_data(data)
+
+    def encode_batch(self, type, encoded_items):
+        return encode_batch(type, encoded_items)
+
+    def prepare(self, player):
+        """Send player whatever it needs before a message of this codec, if anything."""
+        pass
+
+
+JSON = JsonCodec()
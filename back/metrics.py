@@ -0,0 +1,302 @@
+"""Runtime metrics of the game, in Prometheus text format.
+
+Durations and sizes are kept in rolling histograms - quantiles are computed
+over the last `window` observations, so they show the current state of the
+server rather than averages since start. They are exported as Prometheus
+summaries (rolling quantiles plus total sum and count). Metrics are served
+over HTTP by `MetricsServer`, together with stacks collected by the optional
+`SamplingProfiler`:
+
+    curl localhost:9100/metrics
+    curl localhost:9100/profile  # collapsed stacks, for flamegraph.pl
+"""
+from collections import Counter as StackCounter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import math
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Timer:
+    """Context manager observing its duration in a histogram."""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram:
+    def __init__(self, window=1000):
+        self.recent = deque(maxlen=window)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.recent.append(value)
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    @property
+    def last(self):
+        return self.recent[-1] if self.recent else 0
+
+    def quantile(self, q, values=None):
+        values = values if values is not None else sorted(self.recent)
+        if not values:
+            return math.nan
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    def summary(self):
+        values = sorted(self.recent)
+        if not values:
+            return {'count': self.count}
+        return {
+            'count': self.count,
+            'mean': sum(values) / len(values),
+            **{'p{}'.format(round(q * 100)): self.quantile(q, values) for q in QUANTILES},
+            'max': values[-1],
+        }
+
+    def samples(self):
+        values = sorted(self.recent)
+        for q in QUANTILES:
+            yield '', {'quantile': str(q)}, self.quantile(q, values)
+        yield '_sum', {}, self.sum
+        yield '_count', {}, self.count
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield '', {}, self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield '', {}, self.value
+
+
+class Registry:
+    """Named metrics, each possibly split by labels.
+
+    Metrics are created on the first use of their name and labels, and
+    updated without any locking - a scrape may see a frame half-counted.
+    """
+
+    def __init__(self, prefix='rts_', window=1000):
+        self.prefix = prefix
+        self.window = window
+        self.families = {}  # name -> (kind, help, {labels: metric})
+
+    def metric(self, kind, name, help, **labels):
+        family = self.families.setdefault(name, (kind, help, {}))
+        assert family[0] == kind, 'metric {} is a {}'.format(name, family[0])
+        key = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = Histogram(self.window) if kind == 'summary' else {'counter': Counter, 'gauge': Gauge}[kind]()
+        return metric
+
+    def histogram(self, name, help, **labels):
+        return self.metric('summary', name, help, **labels)
+
+    def counter(self, name, help, **labels):
+        return self.metric('counter', name, help, **labels)
+
+    def gauge(self, name, help, **labels):
+        return self.metric('gauge', name, help, **labels)
+
+    def render(self):
+        lines = []
+        for name, (kind, help, metrics) in sorted(self.families.items()):
+            name = self.prefix + name
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, metric in list(metrics.items()):
+                for suffix, extra_labels, value in metric.samples():
+                    lines.append('{}{}{} {}'.format(name, suffix, format_labels({**dict(labels), **extra_labels}), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in sorted(labels.items())
+    ) + '}'
+
+
+def format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class TimedLock:
+    """Lock measuring how long it's waited for and held."""
+
+    def __init__(self, wait, hold):
+        self.lock = threading.Lock()
+        self.wait = wait
+        self.hold = hold
+        self.acquired_at = 0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.acquired_at = time.perf_counter()
+        self.wait.observe(self.acquired_at - start)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.hold.observe(time.perf_counter() - self.acquired_at)
+        self.lock.release()
+
+
+class GameMetrics(Registry):
+    """Metrics of the simulation, updated by the game and its runner."""
+
+    phases = ('commands', 'nodes', 'connections', 'broadcast')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.phase = {
+            phase: self.histogram('frame_phase_seconds', 'Duration of a phase of a frame.', phase=phase)
+            for phase in self.phases
+        }
+        self.frame = self.histogram('frame_seconds', 'Duration of a runner frame, possibly of several steps.')
+        self.steps = self.counter('steps_total', 'Simulation steps done.')
+        self.overloaded_frames = self.counter('overloaded_frames_total', "Frames which couldn't catch up with wall clock.")
+        self.dropped_time = self.counter('dropped_seconds_total', 'Simulated time given up on.')
+        self.active_objects = self.histogram('active_objects', 'Nodes and connections in needs_do_frame at the start of a step.')
+        self.lock_wait = self.histogram('lock_wait_seconds', 'Time spent waiting for the game lock.')
+        self.lock_hold = self.histogram('lock_hold_seconds', 'Time the game lock was held for.')
+        self.players = self.gauge('players', 'Players in the game, as of the last check for gone ones.')
+        self.disconnected_players = self.gauge('disconnected_players', 'Players waiting for reconnection, as of the last check.')
+        self.messages = {}  # message type -> (messages counter, bytes counter)
+
+    def message_sent(self, type, message):
+        counters = self.messages.get(type)
+        if counters is None:
+            counters = self.messages[type] = (
+                self.counter('messages_sent_total', 'Messages sent to players.', type=type),
+                self.counter('message_bytes_sent_total', 'Size of messages sent to players.', type=type),
+            )
+        counters[0].inc()
+        counters[1].inc(len(message))
+
+    def last_phases(self):
+        return {phase: round(histogram.last, 6) for phase, histogram in self.phase.items()}
+
+    def summary(self):
+        return {phase: histogram.summary() for phase, histogram in self.phase.items()}
+
+
+class SamplingProfiler(threading.Thread):
+    """Samples stack of a thread every `interval` seconds, cheap enough to leave running.
+
+    Stacks are counted in collapsed form ("file:function;file:function ...",
+    outermost first), as flamegraph.pl and speedscope read them.
+    """
+
+    def __init__(self, thread, interval=0.01, max_depth=64):
+        super().__init__(daemon=True)
+        self.target = thread
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.target.ident)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append('{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+
+    def collapsed(self):
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in self.stacks.most_common())
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Serves /metrics and, with a profiler, /profile. Runs in its own daemon thread once started."""
+
+    daemon_threads = True
+
+    def __init__(self, metrics, host='localhost', port=9100, profiler=None):
+        self.metrics = metrics
+        self.profiler = profiler
+        super().__init__((host, port), MetricsHandler)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = self.server.metrics.render()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/profile' and self.server.profiler is not None:
+            body = self.server.profiler.collapsed()
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
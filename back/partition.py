@@ -0,0 +1,391 @@
+"""One huge map simulated by several processes, each stepping a region of it.
+
+The node graph is split into regions by `partition`, cutting as little
+throughput as possible. Every region process keeps a whole copy of the map
+but steps only its own nodes and their outgoing connections. Flows of
+connections crossing regions are passed through shared memory, between the
+connections phase of a frame and the end of it - all regions wait for each
+other there (frame barrier), so results are exactly the same as of a single
+process game.
+
+`PartitionedGame` coordinates the regions from the main process. Players and
+commands go to every region (commands are cheap, each region applies them
+to its own nodes), state is brought back on `sync`:
+
+    game = PartitionedGame(functools.partial(make_map, 'square', 300, 0), regions=4, decay_rate=0.1, ...)
+    alice = game.create_player(connection, '(0, 0)')
+    game.submit_commands(alice, [...])
+    for _ in range(1000):
+        game.simulate_frame(0.2)
+    game.sync()  # units and flows of the whole map, in game.nodes
+    game.close()
+"""
+from collections import defaultdict
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+import random
+import time
+import traceback
+
+import numpy as np
+
+from commands import Command
+from game import NOTHING, Game, ObjectEngine
+from snapshots import OfflineConnection, capture, restore_objects
+
+
+def neighbour_weights(nodes):
+    """node_id -> {neighbour_id: throughput of connections between them, both ways}."""
+    weights = {node_id: defaultdict(float) for node_id in nodes}
+    for node_id, node in nodes.items():
+        for target_id, connection in node.connections.items():
+            weights[node_id][target_id] += connection.throughput
+            weights[target_id][node_id] += connection.throughput
+    return weights
+
+
+def cut_weight(nodes, assignment):
+    """Throughput of connections between different regions."""
+    return sum(
+        connection.throughput
+        for node_id, node in nodes.items()
+        for target_id, connection in node.connections.items()
+        if assignment[node_id] != assignment[target_id]
+    )
+
+
+def partition(nodes, regions, passes=8, imbalance=0.05):
+    """Split nodes into `regions` of about the same size. Return node_id -> region.
+
+    Nodes are first split by recursive bisection along the longer side of
+    their bounding box, then boundary nodes are moved to a neighbouring region
+    whenever it lowers the cut throughput, as long as sizes of regions stay
+    within `imbalance` of the average.
+    """
+    assignment = {}
+
+    def bisect(node_ids, first_region, count):
+        if count == 1:
+            for node_id in node_ids:
+                assignment[node_id] = first_region
+            return
+        xs = [nodes[node_id].x for node_id in node_ids]
+        ys = [nodes[node_id].y for node_id in node_ids]
+        axis = 'x' if max(xs) - min(xs) >= max(ys) - min(ys) else 'y'
+        node_ids = sorted(node_ids, key=lambda node_id: (getattr(nodes[node_id], axis), node_id))
+        half = count // 2
+        split = round(len(node_ids) * half / count)
+        bisect(node_ids[:split], first_region, half)
+        bisect(node_ids[split:], first_region + half, count - half)
+
+    node_ids = sorted(nodes)
+    bisect(node_ids, 0, regions)
+
+    weights = neighbour_weights(nodes)
+    sizes = [0] * regions
+    for region in assignment.values():
+        sizes[region] += 1
+    average = len(nodes) / regions
+    max_size = math.ceil(average * (1 + imbalance))
+    min_size = math.floor(average * (1 - imbalance))
+    for _ in range(passes):
+        moved = 0
+        for node_id in node_ids:
+            own = assignment[node_id]
+            if sizes[own] <= min_size:
+                continue
+            links = defaultdict(float)  # region -> throughput between the node and it
+            for neighbour_id, weight in weights[node_id].items():
+                links[assignment[neighbour_id]] += weight
+            best, best_gain = own, 0
+            for region, weight in sorted(links.items()):
+                gain = weight - links[own]
+                if region != own and gain > best_gain and sizes[region] < max_size:
+                    best, best_gain = region, gain
+            if best != own:
+                assignment[node_id] = best
+                sizes[own] -= 1
+                sizes[best] += 1
+                moved += 1
+        if moved == 0:
+            break
+    return assignment
+
+
+class BoundaryExchange:
+    """Flows of connections between regions, in shared memory.
+
+    Every connection crossing regions has a slot, written by the region of
+    its source and read by the region of its target. Movements are stored
+    as player indices and throughputs in the order of the dict, so the target
+    gets exactly the same dict. Slots are double-buffered by frame parity -
+    a region done with a frame can write the next one while others still read.
+    """
+
+    def __init__(self, connection_ids, max_players, name=None):
+        self.connection_ids = connection_ids
+        self.max_players = max_players
+        self.slots = {connection_id: i for i, connection_id in enumerate(connection_ids)}
+        count = len(connection_ids)
+        layout = [
+            ('written', np.bool_, (2, count)),
+            ('lengths', np.int32, (2, count)),
+            ('players', np.int32, (2, count, max_players)),
+            ('values', np.float64, (2, count, max_players)),
+        ]
+        size = sum(np.dtype(dtype).itemsize * math.prod(shape) for _, dtype, shape in layout)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=max(size, 1))
+        offset = 0
+        for attribute, dtype, shape in layout:
+            array = np.ndarray(shape, dtype, buffer=self.memory.buf, offset=offset)
+            setattr(self, attribute, array)
+            offset += array.nbytes
+        if name is None:
+            self.written[:] = False
+
+    def __reduce__(self):
+        return BoundaryExchange, (self.connection_ids, self.max_players, self.memory.name)
+
+    def write(self, frame, connection_id, movements, player_index):
+        buffer, slot = frame % 2, self.slots[connection_id]
+        for i, (player_id, throughput) in enumerate(movements.items()):
+            self.players[buffer, slot, i] = player_index[player_id]
+            self.values[buffer, slot, i] = throughput
+        self.lengths[buffer, slot] = len(movements)
+        self.written[buffer, slot] = True
+
+    def read(self, frame, connection_id, player_ids):
+        """Movements written in the frame, or None. The slot is cleared."""
+        buffer, slot = frame % 2, self.slots[connection_id]
+        if not self.written[buffer, slot]:
+            return None
+        self.written[buffer, slot] = False
+        length = self.lengths[buffer, slot]
+        return {
+            player_ids[j]: v
+            for j, v in zip(self.players[buffer, slot, :length].tolist(), self.values[buffer, slot, :length].tolist())
+        }
+
+    def close(self):
+        for attribute in ('written', 'lengths', 'players', 'values'):
+            delattr(self, attribute)  # views of the buffer must go before it's closed
+        self.memory.close()
+
+
+class RegionEngine:
+    """Steps a region with another engine and exchanges flows of boundary connections.
+
+    After its connections are stepped, the region writes flows of the
+    outgoing boundary ones, waits for all the others to do the same and reads
+    the incoming ones into its nodes.
+    """
+
+    def __init__(self, engine, exchange, barrier, outgoing, incoming):
+        self.engine = engine
+        self.exchange = exchange
+        self.barrier = barrier
+        self.outgoing = outgoing  # boundary connections of this region's nodes
+        self.incoming = incoming  # boundary connections to this region's nodes
+        self.player_ids = []  # index in the exchange -> player_id, the same in all regions
+        self.player_index = {}
+
+    def add_player(self, player_id):
+        if len(self.player_ids) >= self.exchange.max_players:
+            raise ValueError('at most {} players can join a partitioned game'.format(self.exchange.max_players))
+        self.player_index[player_id] = len(self.player_ids)
+        self.player_ids.append(player_id)
+
+    def nodes_frame(self, game, nodes, dt):
+        return self.engine.nodes_frame(game, nodes, dt)
+
+    def connections_frame(self, game, connections, dt):
+        changed = self.engine.connections_frame(game, connections, dt)
+        stepped = self.outgoing.intersection(connections)
+        for connection in stepped:
+            target = game.nodes[connection.target_node_id]
+            self.exchange.write(game.frame, connection.id, target.incoming.get(connection, {}), self.player_index)
+        self.barrier.wait()
+        for connection in self.incoming:
+            movements = self.exchange.read(game.frame, connection.id, self.player_ids)
+            if movements is not None:
+                changed.update(game.nodes[connection.target_node_id].set_incoming(connection, movements))
+        return {o for o in changed if o.node_ids[0] in game.owned}
+
+
+class RegionGame(Game):
+    """Game of a region process - it has the whole map, but steps only `owned` nodes."""
+
+    def __init__(self, owned, **kwargs):
+        super().__init__(**kwargs)
+        self.owned = owned  # ids of nodes of the region
+
+    def apply_commands(self):
+        super().apply_commands()
+        # nodes of other regions are touched by commands and joins too, they step them
+        self.needs_do_frame = {o for o in self.needs_do_frame if o.node_ids[0] in self.owned}
+
+
+def region_main(region, make_nodes, settings, assignment, exchange, barrier, pipe):
+    try:
+        nodes = make_nodes()
+        owned = {node_id for node_id, r in assignment.items() if r == region}
+        boundary = [
+            connection
+            for node in nodes.values()
+            for connection in node.connections.values()
+            if assignment[connection.source_node_id] != assignment[connection.target_node_id]
+        ]
+        engine = RegionEngine(
+            settings.pop('engine', None) or ObjectEngine(), exchange, barrier,
+            outgoing={c for c in boundary if c.source_node_id in owned},
+            incoming=sorted((c for c in boundary if c.target_node_id in owned), key=lambda c: c.id),
+        )
+        game = RegionGame(owned, nodes=nodes, engine=engine, **settings)
+        while True:
+            message = pipe.recv()
+            if message[0] == 'step':
+                _, dt, pending = message
+                start = time.perf_counter()
+                for entry in pending:
+                    if entry[0] == 'join':
+                        _, player_id, node_id, token = entry
+                        engine.add_player(player_id)
+                        game.create_player(OfflineConnection(), node_id, player_id, token)
+                    elif entry[0] == 'leave':
+                        game.remove_player(entry[1])
+                    else:
+                        _, player_id, data = entry
+                        game.commands.extend((player_id, command) for command in Command.from_user_data(data))
+                game.simulate_frame(dt)
+                pipe.send(('done', time.perf_counter() - start))
+            elif message[0] == 'sync':
+                for node_id in owned:
+                    game.wake(nodes[node_id])
+                snapshot = capture(game, owned)
+                pipe.send(('state', snapshot['nodes'], snapshot['connections']))
+            elif message[0] == 'close':
+                break
+    except:  # noqa E722
+        barrier.abort()  # don't leave the other regions waiting
+        pipe.send(('error', traceback.format_exc()))
+    finally:
+        exchange.close()
+
+
+class PartitionedGame(Game):
+    """Game of which regions are simulated by worker processes (see the module docstring).
+
+    This game keeps players, terrain and immediate commands, its nodes get
+    runtime state only on `sync`. `make_nodes` (picklable, e.g. a partial of
+    a map generator) must make the same map every time. Exchanged flows
+    hold at most `max_players` players, joined over the whole game.
+    """
+
+    def __init__(self, make_nodes, regions, max_players=16, engine=None, **kwargs):
+        super().__init__(nodes=make_nodes(), **kwargs)
+        self.assignment = partition(self.nodes, regions)
+        boundary = sorted(
+            connection.id
+            for node in self.nodes.values()
+            for connection in node.connections.values()
+            if self.assignment[connection.source_node_id] != self.assignment[connection.target_node_id]
+        )
+        self.exchange = BoundaryExchange(boundary, max_players)
+        self.joined = 0
+        self.pending = []  # joins, leaves and commands for the regions, sent with the next frame
+        self.region_frame = [
+            self.metrics.histogram('region_frame_seconds', 'Duration of a frame in a region process.', region=str(region))
+            for region in range(regions)
+        ]
+
+        settings = {
+            'decay_rate': self.decay_rate,
+            'starting_units': self.starting_units,
+            'offensive_force': self.offensive_force,
+            'engine': engine,
+            'tolerance': self.tolerance,
+            'sleep_nodes': self.scheduler is not None,
+            'reconnect_grace': self.reconnect_grace,
+            'integrator': self.integrator,
+            'rate_updates': self.rate_updates,
+        }
+        context = multiprocessing.get_context('spawn')
+        self.barrier = context.Barrier(regions)  # kept, or its semaphores are gone before regions start
+        self.pipes = []
+        self.processes = []
+        for region in range(regions):
+            pipe, region_pipe = context.Pipe()
+            process = context.Process(
+                target=region_main, daemon=True,
+                args=(region, make_nodes, dict(settings), self.assignment, self.exchange, self.barrier, region_pipe),
+            )
+            process.start()
+            self.pipes.append(pipe)
+            self.processes.append(process)
+
+    def create_player(self, connection, starting_node_id=None, player_id=None, token=None):
+        if self.joined >= self.exchange.max_players:
+            raise ValueError('at most {} players can join a partitioned game'.format(self.exchange.max_players))
+        if starting_node_id is None:
+            starting_node_id = random.choice(list(self.nodes))  # here, so that all regions agree
+        player_id = super().create_player(connection, starting_node_id, player_id, token)
+        self.joined += 1
+        self.pending.append(('join', player_id, starting_node_id, self.players[player_id].token))
+        return player_id
+
+    def remove_player(self, player_id):
+        super().remove_player(player_id)
+        self.pending.append(('leave', player_id))
+
+    def submit_commands(self, player_id, data):
+        """Validate commands here, execute immediate ones, pass the others to the regions."""
+        commands = Command.from_user_data(data)
+        for command in commands:
+            if command.immediate:
+                command.execute(self, player_id)
+            else:
+                self.pending.append(('command', player_id, command.data))
+
+    def receive(self, pipe, expected):
+        message = pipe.recv()
+        if message[0] == 'error':
+            raise RuntimeError('region failed:\n' + message[1])
+        assert message[0] == expected
+        return message[1:]
+
+    def simulate_frame(self, dt):
+        if self.command_log is not None:
+            self.command_log.step(self.frame, dt)
+        pending, self.pending = self.pending, []
+        for pipe in self.pipes:
+            pipe.send(('step', dt, pending))
+        for pipe, histogram in zip(self.pipes, self.region_frame):
+            duration, = self.receive(pipe, 'done')
+            histogram.observe(duration)
+        self.needs_do_frame = set()
+        self.frame += 1
+        self.time += dt
+        return set()
+
+    def sync(self):
+        """Bring runtime state of the whole map from the regions to this game's nodes."""
+        for node in self.nodes.values():
+            node.units = {}
+            node.incoming = NOTHING
+            node.dispositions = NOTHING
+            for connection in node.connections.values():
+                connection.restore_flow({}, 0, ())
+        for pipe in self.pipes:
+            pipe.send(('sync',))
+        for pipe in self.pipes:
+            nodes, connections = self.receive(pipe, 'state')
+            restore_objects(self, nodes, connections)
+
+    def close(self):
+        for pipe, process in zip(self.pipes, self.processes):
+            if process.is_alive():
+                pipe.send(('close',))
+            process.join()
+        self.exchange.close()
+        self.exchange.memory.unlink()
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+import heapq
+import itertools
+import math
+import threading
+
+
+class Router:
+    """Shortest routes over the terrain, by travel time of connections.
+
+    Next-hop table towards a destination (for every node the neighbour to go
+    to) is built by Dijkstra from the destination over reversed connections,
+    on the first route there. Terrain never changes, so tables stay valid -
+    the all-pairs table is built up incrementally, one destination at a time.
+    At most `cache_size` tables are kept, the least recently used are dropped.
+
+    Maps with more than `table_nodes` nodes don't build tables, a route is
+    searched by A* instead, bounded by distances to `landmarks` nodes spread
+    over the map (ALT), computed on the first route.
+
+    Routes may be asked for from any thread.
+    """
+
+    def __init__(self, nodes, cache_size=64, table_nodes=20000, landmarks=4):
+        self.nodes = nodes
+        self.cache_size = cache_size
+        self.table_nodes = table_nodes
+        self.landmark_count = landmarks
+        self.tables = OrderedDict()  # destination -> (node_id -> next node_id), the most recently used last
+        self.landmarks = None  # [(distances from landmark, distances to landmark)]
+        self.reversed = None  # node_id -> [(source_id, travel_time)]
+        self.lock = threading.Lock()
+
+    def route(self, source_id, destination_id):
+        """Return ids of nodes on the shortest route, both ends included, or None if there's none."""
+        with self.lock:
+            if len(self.nodes) <= self.table_nodes:
+                next_hops = self.next_hops(destination_id)
+                if source_id != destination_id and source_id not in next_hops:
+                    return None
+                route = [source_id]
+                while route[-1] != destination_id:
+                    route.append(next_hops[route[-1]])
+                return route
+            return self.search(source_id, destination_id)
+
+    def next_hops(self, destination_id):
+        """Table node_id -> next node on the shortest route to the destination, for nodes which can reach it."""
+        table = self.tables.get(destination_id)
+        if table is not None:
+            self.tables.move_to_end(destination_id)
+            return table
+        table = {}
+        self.dijkstra(destination_id, self.reversed_connections(), table)
+        self.tables[destination_id] = table
+        if len(self.tables) > self.cache_size:
+            self.tables.popitem(last=False)
+        return table
+
+    def reversed_connections(self):
+        if self.reversed is None:
+            self.reversed = {node_id: [] for node_id in self.nodes}
+            for node_id, node in self.nodes.items():
+                for target_id, connection in node.connections.items():
+                    self.reversed[target_id].append((node_id, connection.travel_time))
+        return self.reversed
+
+    def forward_connections(self, node_id):
+        return ((target_id, connection.travel_time) for target_id, connection in self.nodes[node_id].connections.items())
+
+    def dijkstra(self, start_id, edges, previous=None):
+        """Distances from the start along `edges` (node_id -> [(node_id, travel_time)], or a function giving them).
+
+        `previous` is filled with the node each one was reached from.
+        """
+        neighbours = edges if callable(edges) else edges.__getitem__
+        distances = {start_id: 0}
+        sequence = itertools.count()  # ties are broken by order of discovery, so routes are the same in every run
+        queue = [(0, next(sequence), start_id)]
+        while queue:
+            distance, _, node_id = heapq.heappop(queue)
+            if distance > distances[node_id]:
+                continue
+            for neighbour_id, travel_time in neighbours(node_id):
+                d = distance + travel_time
+                if d < distances.get(neighbour_id, math.inf):
+                    distances[neighbour_id] = d
+                    if previous is not None:
+                        previous[neighbour_id] = node_id
+                    heapq.heappush(queue, (d, next(sequence), neighbour_id))
+        return distances
+
+    def pick_landmarks(self):
+        """Spread landmarks over the map - each is the node farthest from the ones picked before."""
+        self.landmarks = []
+        reversed_connections = self.reversed_connections()
+        closest = {}  # node_id -> distance to the nearest landmark
+        landmark_id = next(iter(self.nodes))
+        for _ in range(min(self.landmark_count, len(self.nodes))):
+            from_landmark = self.dijkstra(landmark_id, self.forward_connections)
+            to_landmark = self.dijkstra(landmark_id, reversed_connections)
+            self.landmarks.append((from_landmark, to_landmark))
+            for node_id, d in from_landmark.items():
+                if d < closest.get(node_id, math.inf):
+                    closest[node_id] = d
+            landmark_id = max(closest, key=closest.get)
+            if closest[landmark_id] == 0:
+                break  # everything reachable is a landmark already
+
+    def lower_bound(self, destination_id):
+        """Function bounding distance of a node to the destination, by triangle inequality with landmarks."""
+        bounds = [
+            (from_landmark, from_landmark.get(destination_id), to_landmark, to_landmark.get(destination_id))
+            for from_landmark, to_landmark in self.landmarks
+        ]
+
+        def bound(node_id):
+            best = 0
+            for from_landmark, from_destination, to_landmark, to_destination in bounds:
+                d = from_landmark.get(node_id)
+                if d is not None and from_destination is not None and from_destination - d > best:
+                    best = from_destination - d
+                d = to_landmark.get(node_id)
+                if d is not None and to_destination is not None and d - to_destination > best:
+                    best = d - to_destination
+            return best
+        return bound
+
+    def search(self, source_id, destination_id):
+        """A* search of a single route, guided by landmarks."""
+        if self.landmarks is None:
+            self.pick_landmarks()
+        bound = self.lower_bound(destination_id)
+        distances = {source_id: 0}
+        previous = {}
+        sequence = itertools.count()
+        # of equally promising nodes the farther ones first, there are many equally long routes on regular maps
+        queue = [(bound(source_id), 0, next(sequence), source_id)]
+        done = set()
+        while queue:
+            _, _, _, node_id = heapq.heappop(queue)
+            if node_id in done:
+                continue
+            done.add(node_id)
+            if node_id == destination_id:
+                route = [node_id]
+                while route[-1] != source_id:
+                    route.append(previous[route[-1]])
+                return route[::-1]
+            distance = distances[node_id]
+            for neighbour_id, travel_time in self.forward_connections(node_id):
+                d = distance + travel_time
+                if d < distances.get(neighbour_id, math.inf):
+                    distances[neighbour_id] = d
+                    previous[neighbour_id] = node_id
+                    heapq.heappush(queue, (d + bound(neighbour_id), -d, next(sequence), neighbour_id))
+        return None
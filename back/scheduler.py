@@ -0,0 +1,166 @@
+import heapq
+import itertools
+import math
+
+
+class Sleep:
+    """Closed form of a sleeping node's units.
+
+    A node with a single owner, not sending anything, follows
+    u' = production + incoming - decay_rate * u. Every integrator steps it by
+    frames of `dt` as u -> r * u + gain, so its units after k frames are
+    u_eq + (u0 - u_eq) * r^k, where u_eq is the equilibrium (with Euler
+    r = 1 - decay_rate * dt). Frames are counted as game time elapsed over the
+    `dt` the node fell asleep with, so that frames of varying length are
+    accounted for too.
+    """
+
+    __slots__ = ('node', 'player_id', 'units', 'gain', 'ratio', 'dt', 'time')
+
+    def __init__(self, node, player_id, units, gain, ratio, dt, time):
+        self.node = node
+        self.player_id = player_id
+        self.units = units  # at the start of the sleep
+        self.gain = gain  # units added per frame (production and incoming)
+        self.ratio = ratio  # portion of units left after a frame of decay
+        self.dt = dt  # length of a frame
+        self.time = time  # game time the sleep started at
+
+    @property
+    def equilibrium(self):
+        if self.ratio == 1:
+            return math.copysign(math.inf, self.gain) if self.gain != 0 else self.units
+        return self.gain / (1 - self.ratio)
+
+    def frames_at(self, time):
+        """Frames (possibly fractional) elapsed at game `time`."""
+        frames = (time - self.time) / self.dt
+        if abs(frames - round(frames)) < 1e-9:
+            return round(frames)  # whole frames of constant dt, stepping would give exactly the same
+        return frames
+
+    def units_after(self, frames):
+        if self.ratio == 1:
+            return self.units + self.gain * frames
+        equilibrium = self.equilibrium
+        return equilibrium + (self.units - equilibrium) * self.ratio ** frames
+
+    def frames_until(self, threshold):
+        """Return number of frames (possibly fractional) after which units pass threshold."""
+        equilibrium = self.equilibrium
+        if self.units == equilibrium:
+            return math.inf  # not moving at all
+        if self.units == threshold:
+            return 0
+        if (threshold - self.units) * (equilibrium - self.units) <= 0:
+            return math.inf  # moving away from it
+        if abs(threshold - self.units) >= abs(equilibrium - self.units):
+            return math.inf  # beyond equilibrium
+        if self.ratio == 1:
+            return (threshold - self.units) / self.gain
+        return math.log((threshold - equilibrium) / (self.units - equilibrium)) / math.log(self.ratio)
+
+
+class SleepScheduler:
+    """Puts quiet nodes to sleep and wakes them up only when they can change.
+
+    Node sleeps when it has a single owner, receives units only from that
+    owner and isn't going to send anything. It's woken up when its units are
+    about to cross disposition target or to drift from the broadcast ones
+    beyond game's tolerance (so with exact tolerance nodes never sleep), or
+    when anything wakes it explicitly - it's put to `needs_do_frame` (new
+    incoming flow, disposition) or `Game.wake` is called.
+
+    Sleeping node's units are not updated. They are computed in closed form
+    when it wakes up from game time elapsed, exactly as frame by frame
+    stepping would with constant `dt` and close to it with varying one. With
+    rate updates sleeping node is sent with zero rates.
+    """
+
+    def __init__(self):
+        self.sleeping = {}  # node -> sleep
+        self.wakeups = []  # heap of (game time, sequence number, sleep)
+        self.sequence = itertools.count()
+
+    def try_sleep(self, game, node, dt):
+        """Put node to sleep after it was stepped in this frame, if it's quiet. Return whether it sleeps.
+
+        Sleeping node is scheduled for its wake up, so it's no longer needed in `needs_do_frame`.
+        """
+        if len(node.units) != 1:
+            return False
+        (player_id, units), = node.units.items()
+
+        incoming = 0
+        for movement in node.incoming.values():
+            for incoming_player_id, throughput in movement.items():
+                if incoming_player_id != player_id:
+                    return False  # a battle is coming
+                incoming += throughput
+        ratio, gain = game.integrator.affine(node.production + incoming, game.decay_rate, dt)
+        if ratio <= 0:
+            return False  # oscillating, too long frames for the integrator
+        sleep = Sleep(node, player_id, units, gain, ratio, dt, game.time)
+
+        frames = math.inf
+        disposition = node.dispositions.get(player_id)
+        if disposition is not None:
+            if units >= disposition.target:
+                return False  # sending
+            frames = min(frames, sleep.frames_until(disposition.target))
+
+        tolerance = game.tolerance
+        broadcast_units = node.broadcast_units.get(player_id)
+        if node.broadcast_rates:
+            broadcast_units = None  # players extrapolate it, it's going to be sent again as constant
+        if broadcast_units is None or not tolerance.is_close(units, broadcast_units):
+            broadcast_units = units  # going to be broadcast at the end of this frame
+        margin = max(tolerance.absolute, tolerance.relative * abs(broadcast_units))
+        frames = min(
+            frames,
+            sleep.frames_until(broadcast_units + margin),
+            sleep.frames_until(broadcast_units - margin),
+        )
+
+        # wake up a frame early, so that the crossing itself is stepped normally,
+        # if it's the very next frame the node is simply stepped again
+        self.sleeping[node] = sleep
+        if game.rate_updates:
+            node.rates = {}
+            if node.broadcast_rates:
+                node.broadcast_units = {}  # so that it's sent
+        if frames != math.inf:
+            heapq.heappush(self.wakeups, (game.time + max(1, math.floor(frames)) * dt, next(self.sequence), sleep))
+        return True
+
+    def wake(self, game, node):
+        """Bring node's units up to date, if it's sleeping."""
+        sleep = self.sleeping.pop(node, None)
+        if sleep is not None:
+            node.units = {sleep.player_id: sleep.units_after(sleep.frames_at(game.time))}
+
+    def wake_due(self, game, dt):
+        """Wake up nodes that have to be stepped in the next frame, of `dt`, and return them."""
+        woken = set()
+        while self.wakeups and self.wakeups[0][0] <= game.time + dt + 1e-9:
+            _, _, sleep = heapq.heappop(self.wakeups)
+            if self.sleeping.get(sleep.node) is sleep:
+                self.wake(game, sleep.node)
+                woken.add(sleep.node)
+        return woken
+
+    def snapshot(self):
+        """Sleeping nodes with their wake up times, as plain data."""
+        wakeups = {sleep: time for time, _, sleep in self.wakeups}
+        return [
+            (node.id, sleep.player_id, sleep.units, sleep.gain, sleep.ratio, sleep.dt, sleep.time, wakeups.get(sleep))
+            for node, sleep in self.sleeping.items()
+        ]
+
+    def restore(self, nodes, snapshot):
+        for node_id, player_id, units, gain, ratio, dt, time, wakeup in snapshot:
+            node = nodes[node_id]
+            sleep = Sleep(node, player_id, units, gain, ratio, dt, time)
+            self.sleeping[node] = sleep
+            if wakeup is not None:
+                heapq.heappush(self.wakeups, (wakeup, next(self.sequence), sleep))
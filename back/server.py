@@ -1,9 +1,10 @@
 from SimpleWebSocketServer import SimpleWebSocketServer, WebSocket
 import logging
-import json
+from urllib.parse import parse_qs, urlsplit
 
 from game import Game, SimulationRunner
-from commands import GameUserError
+from commands import GameUserError, decode_message
+from messages import encode_message
 from map_generators import SquareMapGenerator
 
 
@@ -14,25 +15,23 @@ class GameConnectionHandler(WebSocket):
     def handleConnected(self):
         try:
             logger.debug('new client connected')
+            # returning player connects to ws://host:port/?token=<session token>
+            token = parse_qs(urlsplit(self.request.path).query).get('token', [None])[0]
             with self.server.game.lock:
-                self.player_id = self.server.game.create_player(self)
+                self.player_id = self.server.game.join(self, token)
 
         except:  # noqa E722
             logger.exception('error during establishing new user connection')
 
     def handleClose(self):
-        print(self.address, 'closed')
+        logger.debug('client %s closed', self.address)
+        with self.server.game.lock:
+            self.server.game.disconnect(self.player_id, self)
 
     def handleMessage(self):
         try:
             try:
-                data = json.loads(self.data)
-            except json.JSONDecodeError:
-                self.send('error', 'I only do JSONs, bro.')
-                return
-            try:
-                with self.server.game.lock:
-                    self.server.game.handle_command(self.player_id, data)
+                self.server.game.submit_commands(self.player_id, decode_message(self.data))
             except GameUserError as e:
                 self.send('error', str(e))
                 return
@@ -42,10 +41,10 @@ class GameConnectionHandler(WebSocket):
             self.close(status=1011, reason='Internal server error')
 
     def send(self, type, data):
-        self.sendMessage(json.dumps({
-            'type': type,
-            'data': data,
-        }))
+        self.send_encoded(type, encode_message(type, data))
+
+    def send_encoded(self, type, message):
+        self.sendMessage(message)
 
 
 class GameServer(SimpleWebSocketServer):
@@ -72,7 +71,8 @@ if __name__ == "__main__":
         starting_units=10,
         offensive_force=1,
     )
-    SimulationRunner(game, 1 / 5).start()
+    game.terrain.encoded_info  # encode terrain before clients ask for it
+    SimulationRunner(game, 1 / 5, fixed_timestep=True, max_broadcast_interval=4).start()
     server = GameServer(
         **addr,
         game=game,
@@ -0,0 +1,250 @@
+"""Snapshots of the game state and the log of commands, for restoring and replaying a game.
+
+Snapshot holds just the runtime state (units, dispositions, flows, sleeping
+nodes, players) of nodes and connections that have any - terrain is
+regenerated by the map generator, so restoring takes time proportional to
+what's going on in the game, not to its length nor size of the map.
+Snapshots are captured between frames, under the game lock, but encoded and
+written by `SnapshotWriter` in its own thread.
+
+The command log has a JSON line for every joining player, applied command
+and change of step length, with frame numbers. Replaying it after a snapshot
+(or from the start, on a new game) steps the game exactly as it went:
+
+    game = Game(...)  # the same map and settings, without the log
+    restore(game, load_latest('snapshots'))
+    with open('commands.log') as f:
+        replay(game, read_log(f))
+    game.command_log = CommandLog.open('commands.log')  # carry on logging
+"""
+import json
+import logging
+import os
+import pickle
+import queue
+import threading
+import zlib
+
+from commands import Command, Disposition
+from game import Player
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 3
+
+
+class OfflineConnection:
+    """Connection of a player replayed from a log. Messages are dropped."""
+
+    def send_encoded(self, type, message):
+        pass
+
+
+class CommandLog:
+    """Append-only log of everything changing the game from outside of the simulation."""
+
+    def __init__(self, file):
+        self.file = file
+        self.dt = None  # length of steps, logged only when it changes
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, 'a', buffering=1))  # line by line, so that a crash loses at most a line
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def join(self, frame, player_id, node_id, token):
+        self.write({'frame': frame, 'join': player_id, 'node': node_id, 'token': token})
+
+    def leave(self, frame, player_id):
+        self.write({'frame': frame, 'leave': player_id})
+
+    def command(self, frame, player_id, data):
+        self.write({'frame': frame, 'player': player_id, 'command': data})
+
+    def step(self, frame, dt):
+        if dt != self.dt:
+            self.dt = dt
+            self.write({'frame': frame, 'dt': dt})
+
+    def close(self):
+        self.file.close()
+
+
+def read_log(file):
+    for line in file:
+        if line.endswith('\n'):  # the last line may be cut off by a crash
+            yield json.loads(line)
+
+
+def capture(game, node_ids=None):
+    """Copy runtime state of the game as plain data. Needs the game lock.
+
+    With `node_ids` only state of those nodes and their outgoing connections is captured.
+    """
+    nodes = []
+    connections = []
+    for node in game.nodes.values() if node_ids is None else (game.nodes[node_id] for node_id in node_ids):
+        if node.units or node.incoming or node.dispositions:
+            nodes.append((
+                node.id,
+                dict(node.units),
+                [(source.source_node_id, movements) for source, movements in node.incoming.items()],
+                {player_id: (d.target, d.ratios) for player_id, d in node.dispositions.items()},
+            ))
+        for connection in node.connections.values():
+            movements, time, segments = connection.flow_state
+            if movements or time or segments:
+                connections.append((connection.source_node_id, connection.target_node_id, movements, time, segments))
+    return {
+        'version': FORMAT_VERSION,
+        'terrain': game.terrain.version,
+        'frame': game.frame,
+        'time': game.time,
+        'players': {player_id: (player.color, player.token) for player_id, player in game.players.items()},
+        'nodes': nodes,
+        'connections': connections,
+        'needs_do_frame': [o.id for o in game.needs_do_frame],
+        'sleeping': game.scheduler.snapshot() if game.scheduler is not None else [],
+    }
+
+
+def encode(snapshot):
+    return zlib.compress(pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def decode(data):
+    snapshot = pickle.loads(zlib.decompress(data))
+    if snapshot['version'] != FORMAT_VERSION:
+        raise ValueError('unsupported snapshot version {}'.format(snapshot['version']))
+    return snapshot
+
+
+def restore(game, snapshot):
+    """Bring a new game (on the same map, with the same settings) to the state of the snapshot.
+
+    Players are disconnected, they can reconnect with their session tokens.
+    """
+    if snapshot['terrain'] != game.terrain.version:
+        raise ValueError('snapshot is of another map')
+    if game.frame != 0 or game.players:
+        raise ValueError('only a new game can be restored')
+    nodes = game.nodes
+    game.frame = snapshot['frame']
+    game.time = snapshot['time']
+    for player_id, (color, token) in snapshot['players'].items():
+        player = game.players[player_id] = Player(None, color, game.metrics, token)
+        player.disconnected_at = game.time
+        game.sessions[token] = player_id
+    restore_objects(game, snapshot['nodes'], snapshot['connections'])
+    game.needs_do_frame = {
+        nodes[o_id[0]].connections[o_id[1]] if isinstance(o_id, tuple) else nodes[o_id]
+        for o_id in snapshot['needs_do_frame']
+    }
+    if snapshot['sleeping']:
+        if game.scheduler is None:
+            raise ValueError('snapshot has sleeping nodes, game must sleep nodes too')
+        game.scheduler.restore(nodes, snapshot['sleeping'])
+    if game.interest is not None:
+        game.interest.update(nodes[node_id] for node_id, *_ in snapshot['nodes'])
+
+
+def restore_objects(game, nodes, connections):
+    """Set runtime state of nodes and connections, as captured."""
+    for node_id, units, incoming, dispositions in nodes:
+        node = game.nodes[node_id]
+        node.units = units
+        node.incoming = {game.nodes[source_id].connections[node_id]: movements for source_id, movements in incoming}
+        node.dispositions = {player_id: Disposition.normalized(target, ratios) for player_id, (target, ratios) in dispositions.items()}
+    for source_id, target_id, movements, time, segments in connections:
+        game.nodes[source_id].connections[target_id].restore_flow(movements, time, segments)
+
+
+def replay(game, entries, make_connection=OfflineConnection):
+    """Step the game through logged entries, up to the frame of the last one.
+
+    Entries from before the game's frame (covered by a restored snapshot) are
+    skipped. Commands of the last frame are left queued.
+    """
+    dt = None
+    for entry in entries:
+        frame = entry['frame']
+        while game.frame < frame:
+            game.simulate_frame(dt)
+        if 'dt' in entry:
+            dt = entry['dt']  # also from before the snapshot, it still holds
+        elif frame < game.frame:
+            continue
+        elif 'join' in entry:
+            game.create_player(make_connection(), entry['node'], entry['join'], entry['token'])
+        elif 'leave' in entry:
+            game.remove_player(entry['leave'])
+        elif 'command' in entry:
+            game.commands.extend((entry['player'], command) for command in Command.from_user_data(entry['command']))
+
+
+class SnapshotWriter(threading.Thread):
+    """Takes a snapshot of the game every `interval` frames and writes it to `directory`.
+
+    Only copying the state happens in the simulation thread, encoding and
+    writing are done by this thread. If it doesn't keep up, snapshots are
+    skipped. The newest `keep` snapshots are kept.
+    """
+
+    def __init__(self, directory, interval, keep=3):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.queue = queue.Queue(maxsize=1)
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def maybe_take(self, game):
+        """Called after every frame, with the game lock held."""
+        if game.frame % self.interval != 0:
+            return
+        try:
+            self.queue.put_nowait(capture(game))
+        except queue.Full:
+            logger.warning('skipping snapshot of frame %d, previous one is still being written', game.frame)
+
+    def run(self):
+        while True:
+            snapshot = self.queue.get()
+            try:
+                self.write(snapshot)
+            except:  # noqa E722
+                logger.exception('error during writing snapshot')
+
+    def write(self, snapshot):
+        path = os.path.join(self.directory, 'snapshot-{:010d}.bin'.format(snapshot['frame']))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(encode(snapshot))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)  # a snapshot is either complete or missing
+        self.written += 1
+        for old in snapshot_paths(self.directory)[:-self.keep]:
+            os.remove(old)
+
+
+def snapshot_paths(directory):
+    """Paths of snapshots in the directory, the oldest first."""
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith('snapshot-') and name.endswith('.bin')
+    )
+
+
+def load_latest(directory):
+    """Return the newest snapshot in the directory, or None."""
+    paths = snapshot_paths(directory) if os.path.isdir(directory) else []
+    if not paths:
+        return None
+    with open(paths[-1], 'rb') as f:
+        return decode(f.read())
@@ -0,0 +1,57 @@
+import functools
+import hashlib
+import math
+
+from messages import encode_message
+
+
+class Terrain:
+    """Serialized terrain of a game, built once as terrain never changes.
+
+    The whole map and its tiles (squares of `tile_size` by node positions) are
+    encoded on the first request and then shared by all clients. Version is a
+    hash of the whole map, so clients having it cached can skip the download.
+    """
+
+    def __init__(self, nodes, tile_size):
+        self.nodes = nodes
+        self.tile_size = tile_size
+        self.encoded_tiles = {}  # tile -> encoded message
+
+    @functools.cached_property
+    def encoded_map(self):
+        return encode_message('map', {node_id: node.terrain_data for node_id, node in self.nodes.items()})
+
+    @functools.cached_property
+    def version(self):
+        return hashlib.sha256(self.encoded_map.encode()).hexdigest()[:16]
+
+    def tile(self, node):
+        return '{},{}'.format(math.floor(node.x / self.tile_size), math.floor(node.y / self.tile_size))
+
+    @functools.cached_property
+    def tiles(self):
+        """tile -> ids of nodes in it"""
+        tiles = {}
+        for node_id, node in self.nodes.items():
+            tiles.setdefault(self.tile(node), []).append(node_id)
+        return tiles
+
+    @functools.cached_property
+    def encoded_info(self):
+        return encode_message('map_info', {
+            'version': self.version,
+            'tile_size': self.tile_size,
+            'tiles': {tile: len(node_ids) for tile, node_ids in self.tiles.items()},
+        })
+
+    def encoded_tile(self, tile):
+        # concurrent requests may encode a tile twice, that's harmless
+        encoded = self.encoded_tiles.get(tile)
+        if encoded is None:
+            encoded = self.encoded_tiles[tile] = encode_message('map_tile', {
+                'version': self.version,
+                'tile': tile,
+                'nodes': {node_id: self.nodes[node_id].terrain_data for node_id in self.tiles[tile]},
+            })
+        return encoded
@@ -0,0 +1,59 @@
+from unittest import IsolatedAsyncioTestCase
+import asyncio
+import threading
+
+from async_server import AsyncConnectionHandler, AsyncGameServer
+from game import Game, Node
+
+
+class FakeWebSocket:
+    remote_address = ('127.0.0.1', 1234)
+
+    def __init__(self):
+        self.closed_with = None
+
+    async def close(self, code, reason):
+        self.closed_with = code
+
+
+class AsyncConnectionHandlerTestCase(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.game = Game(
+            nodes={'node0': Node('node0', x=0, y=0, production=3, connections={})},
+            decay_rate=0.1,
+            starting_units=1,
+            offensive_force=1,
+        )
+
+    def make_handler(self, slow_consumer_policy):
+        server = AsyncGameServer(self.game, 'localhost', 0, max_queue=2, slow_consumer_policy=slow_consumer_policy)
+        handler = AsyncConnectionHandler(server, FakeWebSocket())
+        handler.player_id = 'player1'
+        return handler
+
+    async def test_coalesce(self):
+        handler = self.make_handler('coalesce')
+        handler.enqueue('units', 'u1')
+        handler.enqueue('error', 'e1')
+        handler.enqueue('units', 'u2')
+        self.assertEqual(list(handler.queue), [('error', 'e1')])
+        self.assertEqual(list(self.game.resync_requests), ['player1'])
+
+    async def test_disconnect(self):
+        handler = self.make_handler('disconnect')
+        handler.enqueue('units', 'u1')
+        handler.enqueue('units', 'u2')
+        handler.enqueue('units', 'u3')
+        self.assertEqual(list(handler.queue), [])
+        self.assertTrue(handler.closing)
+        await asyncio.sleep(0)  # let the scheduled close run
+        self.assertEqual(handler.websocket.closed_with, 1008)
+
+    async def test_commands_submitted_outside_loop(self):
+        handler = self.make_handler('coalesce')
+        submitted = []
+        self.game.submit_commands = lambda player_id, data: submitted.append((player_id, data, threading.get_ident()))
+        await handler.handle_message('{"type": "map", "data": {}}')
+        (player_id, data, thread), = submitted
+        self.assertEqual((player_id, data), ('player1', {'type': 'map', 'data': {}}))
+        self.assertNotEqual(thread, threading.get_ident())  # e.g. route planning doesn't stall other clients
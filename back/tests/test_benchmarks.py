@@ -0,0 +1,38 @@
+from unittest import TestCase
+import contextlib
+import io
+
+from benchmarks import result
+from benchmarks.__main__ import compare
+
+
+class CompareTestCase(TestCase):
+    def test_regressions(self):
+        baseline = {'results': [
+            result('game_frame', {'size': 10, 'players': 2}, 0.010),
+            result('game_frame', {'size': 30, 'players': 2}, 0.100),
+            result('removed', {}, 1),
+        ]}
+        results = [
+            result('game_frame', {'players': 2, 'size': 10}, 0.011),
+            result('game_frame', {'size': 30, 'players': 2}, 0.150),
+            result('added', {}, 1),
+        ]
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(compare(results, baseline, threshold=0.2), 1)
+        self.assertEqual(output.getvalue().count('REGRESSION'), 1)
+
+    def test_units(self):
+        baseline = {'results': [result('memory', {}, 1000, unit='B'), result('frame', {}, 0.002)]}
+        results = [result('memory', {}, 997, unit='B'), result('frame', {}, 0.001)]
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            compare(results, baseline, threshold=0.2)
+        self.assertIn('997.0 B', output.getvalue())
+        self.assertIn('1.0000 ms', output.getvalue())
+
+    def test_units_not_mixed(self):
+        self.assertEqual(result('memory', {}, 1000, unit='B')['value'], 1000)
+        baseline = {'results': [result('memory', {}, 0.001)]}
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(compare([result('memory', {}, 1000, unit='B')], baseline, threshold=0.2), 0)
+        self.assertNotIn('memory', output.getvalue())
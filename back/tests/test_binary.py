@@ -0,0 +1,78 @@
+from unittest import TestCase
+import json
+
+from binary import BinaryCodec, decode_units
+from game import Game, Node, Connection
+from tests.test_game import RecordingConnection
+
+
+class BinaryCodecTestCase(TestCase):
+    def test_round_trip(self):
+        codec = BinaryCodec()
+        updates = [
+            {'type': 'node', 'id': 'node0', 'units': {'player1': 1.5, 'player2': 3}},
+            {'type': 'node', 'id': 'node1', 'units': {'player1': 1.5}, 'rates': {'player1': -0.25}},
+            {'type': 'connection', 'id': ('node0', 'node1'), 'units': [
+                {'remaining_time': 10, 'movements': {'player1': 0.5}},
+                {'remaining_time': 2.5, 'movements': {}},
+            ]},
+            {'type': 'connection', 'id': ('node1', 'node0'), 'units_delta': [
+                {'remaining_time': 10, 'movements': {'player2': 2}},
+            ]},
+        ]
+        message = codec.encode_message('units', updates)
+        self.assertIsInstance(message, bytes)
+        decoded = decode_units(message, codec.ids.ids)
+        self.assertEqual(decoded[:2], updates[:2])
+        self.assertEqual(decoded[2], {**updates[2], 'id': ['node0', 'node1']})
+        self.assertEqual(decoded[3], {**updates[3], 'id': ['node1', 'node0']})
+
+    def test_other_messages_stay_json(self):
+        self.assertEqual(json.loads(BinaryCodec().encode_message('error', 'oops')), {'type': 'error', 'data': 'oops'})
+
+
+class BinaryProtocolTestCase(TestCase):
+    def setUp(self):
+        self.game = Game(
+            nodes={
+                'node0': Node('node0', x=0, y=0, production=3, connections={
+                    'node1': Connection('node0', 'node1', throughput=1, travel_time=1),
+                }),
+                'node1': Node('node1', x=1, y=0, production=3, connections={}),
+            },
+            decay_rate=0.1,
+            starting_units=1,
+            offensive_force=1,
+        )
+
+    def test_negotiated_per_connection(self):
+        binary_connection = RecordingConnection()
+        json_connection = RecordingConnection()
+        player_id = self.game.create_player(binary_connection)
+        self.game.create_player(json_connection)
+        self.game.submit_commands(player_id, {'type': 'protocol', 'data': {'format': 'binary'}})
+        self.game.do_frame(0.2)
+
+        ids = []
+        messages = []
+        for message in binary_connection.messages:
+            if isinstance(message, bytes):
+                messages.append(decode_units(message, ids))
+            else:
+                dictionary = json.loads(message)
+                self.assertEqual(dictionary['type'], 'dictionary')
+                self.assertEqual(dictionary['data']['first'], len(ids))
+                ids.extend(dictionary['data']['ids'])
+        decoded = messages[0]
+        expected = json.loads(json_connection.messages[0])['data']
+        self.assertEqual([(u['id'], u['units'].keys()) for u in decoded], [(u['id'], u['units'].keys()) for u in expected])
+        for u, expected_u in zip(decoded, expected):
+            for player_id, units in u['units'].items():
+                self.assertAlmostEqual(units, expected_u['units'][player_id], places=5)  # float32
+        self.assertLess(len(binary_connection.messages[1]), len(json_connection.messages[0]))
+
+        # ids are sent only once
+        binary_connection.messages = []
+        self.game.needs_do_frame = set(self.game.nodes.values())
+        self.game.do_frame(0.2)
+        self.assertTrue(all(isinstance(m, bytes) for m in binary_connection.messages))
@@ -0,0 +1,44 @@
+from unittest import TestCase
+import json
+
+from commands import Command, DispositionCommand, GameUserError, MAX_BATCH_SIZE, MAX_MESSAGE_SIZE, decode_message
+
+
+class CommandTestCase(TestCase):
+    def disposition_command(self):
+        return {'type': 'disposition', 'data': {
+            'node_id': 'node0',
+            'disposition': {'target': 5, 'ratios': {'node1': 1}},
+        }}
+
+    def test_from_user_data(self):
+        command, = Command.from_user_data(self.disposition_command())
+        self.assertIsInstance(command, DispositionCommand)
+        self.assertEqual(command.disposition.ratios, {'node1': 1})
+
+    def test_invalid_dispositions(self):
+        for disposition in (
+            {'target': float('nan'), 'ratios': {'node1': 1}},
+            {'target': 5, 'ratios': {'node1': float('inf')}},
+            {'target': 5, 'ratios': {'node1': -1, 'node2': 2}},
+            {'target': 5, 'ratios': {'node1': 0}},
+            {'target': 5, 'ratios': {'node1': 1e308, 'node2': 1e308}},
+        ):
+            with self.subTest(disposition=disposition), self.assertRaises(GameUserError):
+                Command.from_user_data(json.loads(json.dumps({'type': 'disposition', 'data': {'node_id': 'node0', 'disposition': disposition}})))
+        command, = Command.from_user_data({'type': 'disposition', 'data': {'node_id': 'node0', 'disposition': {'target': 5, 'ratios': {}}}})
+        self.assertEqual(command.disposition.ratios, {})  # keeps the units
+
+    def test_batch_limit(self):
+        self.assertEqual(len(Command.from_user_data([self.disposition_command()] * MAX_BATCH_SIZE)), MAX_BATCH_SIZE)
+        with self.assertRaises(GameUserError):
+            Command.from_user_data([self.disposition_command()] * (MAX_BATCH_SIZE + 1))
+
+    def test_decode_message(self):
+        self.assertEqual(decode_message(json.dumps(self.disposition_command())), self.disposition_command())
+        with self.assertRaises(GameUserError):
+            decode_message('{"type": ')
+        with self.assertRaises(GameUserError):
+            decode_message('[' * MAX_MESSAGE_SIZE)
+        with self.assertRaises(GameUserError):
+            decode_message(' ' * (MAX_MESSAGE_SIZE + 1))
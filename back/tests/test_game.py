@@ -1,10 +1,17 @@
 from unittest import TestCase
+from collections import deque
+import json
+import random
+import threading
 
-from game import Game, Node, Connection
-from commands import Disposition
+from game import Game, Node, Connection, ObjectEngine, Tolerance, SimulationRunner, FrameStats
+from commands import Disposition, GameUserError
+from metrics import GameMetrics
 
 
 class NodeTestCase(TestCase):
+    engine_class = ObjectEngine
+
     def setUp(self):
         self.node = Node(id='node1', x=0, y=0, production=3, connections={
             'node2': Connection('node1', 'node2', throughput=1, travel_time=10),
@@ -16,8 +23,12 @@ class NodeTestCase(TestCase):
             decay_rate=0.1,
             starting_units=1,
             offensive_force=1,
+            engine=self.engine_class(),
         )
 
+    def do_frame(self, dt):
+        return self.game.engine.nodes_frame(self.game, [self.node], dt)
+
     def test_set_incoming_change(self):
         changed = self.node.set_incoming('some_id', {'player1': 5})
         self.assertEqual(changed, {self.node})
@@ -26,20 +37,49 @@ class NodeTestCase(TestCase):
         changed = self.node.set_incoming('some_id', {})
         self.assertEqual(changed, set())
 
+    def test_idle_state_not_shared(self):
+        other = Node(id='node5', x=0, y=0, production=3, connections={})
+        self.node.set_incoming(self.node.connections['node2'], {'player1': 5})
+        self.node.set_disposition('player1', Disposition(1, {'node2': 1}))
+        self.assertEqual(other.incoming, {})
+        self.assertEqual(other.dispositions, {})
+        with self.assertRaises(TypeError):
+            other.dispositions['player1'] = Disposition(1, {'node2': 1})
+        self.assertFalse(other.remove_player('player1'))
+        self.assertEqual(other.dispositions, {})
+
     def test_do_frame_nobodys_land(self):
-        changed = self.node.do_frame(self.game, 1)
+        changed = self.do_frame(1)
         self.assertEqual(changed, set())
 
     def test_do_frame_single_owner(self):
         self.node.units = {'player1': 6}
-        changed = self.node.do_frame(self.game, 0.5)
+        changed = self.do_frame(0.5)
         self.assertEqual(changed, {self.node})
         self.assertEqual(self.node.units, {'player1': 6 + 3 * 0.5 - 6 * 0.5 * 0.1})
 
+    def test_do_frame_battle(self):
+        units = {'player1': 6, 'player2': 3, 'player3': 1}
+        self.node.units = dict(units)
+        self.do_frame(0.1)
+        for defender_id, defender_units in units.items():
+            expected = defender_units + 3 * 0.1 * (defender_units / 10) - defender_units * 0.1 * 0.1
+            for attacker_id, attacker_units in units.items():
+                if attacker_id != defender_id:
+                    expected -= attacker_units * (defender_units / (10 - attacker_units)) * 0.1
+            self.assertAlmostEqual(self.node.units[defender_id], expected)
+
+    def test_do_frame_within_tolerance(self):
+        self.game.tolerance = Tolerance(absolute=0.5)
+        self.node.units = {'player1': 6}
+        changed = self.do_frame(0.1)
+        self.assertEqual(changed, {self.node})  # stepped on, small changes add up
+        self.assertAlmostEqual(self.node.units['player1'], 6 + 3 * 0.1 - 6 * 0.1 * 0.1)
+
     def test_do_frame_sending_split(self):
         self.node.units = {'player1': 6}
         self.node.dispositions = {'player1': Disposition(6.1, {'node2': 0.2, 'node3': 0.8})}
-        self.node.do_frame(self.game, 1)
+        self.do_frame(1)
         self.assertEqual(self.node.units, {'player1': 6.1})
         to_distribute = (6 + 3 - 6 * 0.1) - 6.1
         self.assertTrue(to_distribute > 0)
@@ -49,7 +89,7 @@ class NodeTestCase(TestCase):
     def test_do_frame_sending_changed_throughput(self):
         self.node.units = {'player1': 6}
         self.node.dispositions = {'player1': Disposition(6, {'node2': 1})}
-        changed = self.node.do_frame(self.game, 1)
+        changed = self.do_frame(1)
         self.assertEqual(changed, {self.node, self.node.connections['node2']})
         self.assertEqual(self.node.units, {'player1': 6})
 
@@ -57,12 +97,53 @@ class NodeTestCase(TestCase):
         self.node.units = {'player1': 6}
         self.node.dispositions = {'player1': Disposition(6, {'node2': 1})}
         self.node.connections['node2'].set_movements({'player1': 6 + 3 - 6 * 0.1 - 6})
-        changed = self.node.do_frame(self.game, 1)
+        changed = self.do_frame(1)
         self.assertEqual(changed, set())
         self.assertEqual(self.node.units, {'player1': 6})
 
+    def test_do_frame_zero_target(self):
+        self.node.units = {'player1': 6}
+        self.node.dispositions = {'player1': Disposition(0, {'node2': 1})}
+        self.do_frame(1)
+        self.assertEqual(self.node.units, {'player1': 0})
+        self.do_frame(1)  # nothing left to produce for
+        self.assertEqual(self.node.units, {})
+
+    def test_do_frame_rates(self):
+        self.game.rate_updates = True
+        self.node.units = {'player1': 6}
+        self.node.dispositions = {'player1': Disposition(8, {'node2': 1})}
+        self.do_frame(0.5)
+        self.assertAlmostEqual(self.node.rates['player1'], 3 - 6 * 0.1)
+        self.do_frame(0.5)  # sending above the target
+        self.assertAlmostEqual(self.node.rates['player1'], (8 - 7.2) / 0.5)
+
+
+class ToleranceTestCase(TestCase):
+    def test_exact(self):
+        tolerance = Tolerance()
+        self.assertTrue(tolerance.is_close(1, 1))
+        self.assertFalse(tolerance.is_close(1, 1 + 1e-12))
+
+    def test_absolute(self):
+        tolerance = Tolerance(absolute=0.1)
+        self.assertTrue(tolerance.is_close(1, 1.05))
+        self.assertFalse(tolerance.is_close(1, 1.2))
+
+    def test_relative(self):
+        tolerance = Tolerance(relative=0.1)
+        self.assertTrue(tolerance.is_close(100, 109))
+        self.assertFalse(tolerance.is_close(1, 1.2))
+
+    def test_units_close(self):
+        tolerance = Tolerance(absolute=0.1)
+        self.assertTrue(tolerance.units_close({'player1': 1}, {'player1': 1.05}))
+        self.assertFalse(tolerance.units_close({'player1': 1}, {'player1': 1, 'player2': 0.01}))
+
 
 class ConnectionTestCase(TestCase):
+    engine_class = ObjectEngine
+
     def setUp(self):
         self.connection = Connection('node1', 'node0', throughput=1, travel_time=10)
         self.game = Game(
@@ -72,8 +153,12 @@ class ConnectionTestCase(TestCase):
             decay_rate=0.1,
             starting_units=1,
             offensive_force=1,
+            engine=self.engine_class(),
         )
 
+    def do_frame(self, dt):
+        return self.game.engine.connections_frame(self.game, [self.connection], dt)
+
     def test_set_movements_no_change(self):
         changed = self.connection.set_movements({})
         self.assertEqual(changed, set())
@@ -83,23 +168,561 @@ class ConnectionTestCase(TestCase):
         self.assertEqual(changed, {self.connection})
 
     def test_do_frame_empty(self):
-        changed = self.connection.do_frame(self.game, 1)
+        changed = self.do_frame(1)
         self.assertEqual(changed, set())
 
     def test_do_frame_movement(self):
         self.connection.set_movements({'player1': 5})
-        changed = self.connection.do_frame(self.game, 1)
+        changed = self.do_frame(1)
         self.assertEqual(changed, {self.connection})
 
     def test_do_frame_movement_reached(self):
         self.connection.set_movements({'player1': 5})
-        changed = self.connection.do_frame(self.game, 11)
+        changed = self.do_frame(11)
         self.assertEqual(changed, {self.connection, self.game.nodes['node0']})
         self.assertEqual(self.game.nodes['node0'].incoming[self.connection], {'player1': 5 / 11})
 
     def test_do_frame_movement_no_change(self):
         self.connection.set_movements({'player1': 5})
-        self.connection.do_frame(self.game, 11)
-        changed = self.connection.do_frame(self.game, 11)
+        self.do_frame(11)
+        changed = self.do_frame(11)
         self.assertEqual(changed, {self.game.nodes['node0']})
         self.assertEqual(self.game.nodes['node0'].incoming[self.connection], {'player1': 5})
+
+    def test_set_movements_twice_in_frame(self):
+        self.connection.set_movements({'player1': 5})
+        self.connection.set_movements({'player1': 3})
+        self.assertEqual(self.connection.units_data, [
+            {'remaining_time': 10, 'movements': {'player1': 3}},
+            {'remaining_time': 10, 'movements': {}},
+        ])
+
+    def test_segments_capped(self):
+        self.connection = Connection('node1', 'node0', throughput=1, travel_time=10, max_segments=3)
+        sent = 0
+        for i in range(20):
+            self.connection.set_movements({'player1': i % 3})
+            self.do_frame(0.5)
+            sent += (i % 3) * 0.5
+            self.assertLessEqual(len(self.connection.units_data), 4)
+        self.connection.set_movements({})
+        arrived = 0
+        for _ in range(30):
+            self.do_frame(0.5)
+            arrived += self.game.nodes['node0'].incoming.get(self.connection, {}).get('player1', 0) * 0.5
+        self.assertAlmostEqual(arrived, sent)
+        self.assertEqual(self.connection.units_data, [{'remaining_time': 10, 'movements': {}}])
+
+    def test_units_delta(self):
+        self.connection.set_movements({'player1': 5})
+        self.do_frame(1)
+        self.connection.unsent_segments = 0  # broadcast
+        self.connection.set_movements({'player1': 3})
+        self.assertEqual(self.connection.units_delta, [
+            {'remaining_time': 10, 'movements': {'player1': 3}},
+            {'remaining_time': 10, 'movements': {'player1': 5}},
+        ])
+        self.assertEqual(len(self.connection.units_data), 3)
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, type, data):
+        self.send_encoded(type, json.dumps({'type': type, 'data': data}))
+
+    def send_encoded(self, type, message):
+        self.messages.append(message)
+
+
+class ConcurrentAppends(deque):
+    """Command queue to which another thread appends `late` as soon as it's changed."""
+    late = None
+
+    def append_late(self):
+        if self.late is not None:
+            self.append(self.late)
+            self.late = None
+
+    def popleft(self):
+        self.append_late()
+        return super().popleft()
+
+    def remove(self, value):
+        self.append_late()
+        super().remove(value)
+
+
+class GameTestCase(TestCase):
+    def setUp(self):
+        self.game = Game(
+            nodes={
+                'node0': Node('node0', x=0, y=0, production=3, connections={}),
+                'node1': Node('node1', x=1, y=0, production=3, connections={}),
+            },
+            decay_rate=0.1,
+            starting_units=1,
+            offensive_force=1,
+        )
+
+    def test_do_frame_broadcasts_single_batch(self):
+        connections = [RecordingConnection(), RecordingConnection()]
+        for connection in connections:
+            self.game.create_player(connection)
+        self.game.do_frame(1)
+        for connection in connections:
+            self.assertEqual(len(connection.messages), 1)
+            self.assertIs(connection.messages[0], connections[0].messages[0])
+        message = json.loads(connections[0].messages[0])
+        self.assertEqual(message['type'], 'units')
+        self.assertEqual(
+            {u['id'] for u in message['data']},
+            {node.id for node in self.game.nodes.values() if node.units},
+        )
+
+    def test_do_frame_nothing_changed(self):
+        connection = RecordingConnection()
+        self.game.create_player(connection)
+        self.game.needs_do_frame = set()
+        self.game.do_frame(1)
+        self.assertEqual(connection.messages, [])
+
+    def test_do_frame_interest(self):
+        self.game = Game(self.game.nodes, decay_rate=0.1, starting_units=1, offensive_force=1, interest_radius=0)
+        connections = [RecordingConnection(), RecordingConnection()]
+        player_ids = [self.game.create_player(connection) for connection in connections]
+        for node, player_id in zip(self.game.nodes.values(), player_ids):
+            node.units = {player_id: 1}
+        self.game.needs_do_frame = set(self.game.nodes.values())
+        self.game.do_frame(1)
+        for node, connection in zip(self.game.nodes.values(), connections):
+            self.assertEqual(len(connection.messages), 1)
+            message = json.loads(connection.messages[0])
+            self.assertEqual([u['id'] for u in message['data']], [node.id])
+
+    def test_do_frame_broadcast_drift(self):
+        self.game.tolerance = Tolerance(absolute=0.5)
+        connection = RecordingConnection()
+        player_id = self.game.create_player(connection)
+        node = self.game.nodes['node0']
+        for n in self.game.nodes.values():
+            n.units = {}
+        node.units = {player_id: 6}
+        node.broadcast_units = dict(node.units)
+        history = []
+        self.game.needs_do_frame = {node}
+        for _ in range(4):  # each frame adds about 0.24 units
+            self.game.do_frame(0.1)
+            history.append(node.units[player_id])
+        self.assertEqual(len(connection.messages), 1)
+        message = json.loads(connection.messages[0])
+        self.assertEqual(message['data'][0]['units'][player_id], history[2])
+
+    def test_changes_within_tolerance_add_up(self):
+        for tolerance in (Tolerance(absolute=0.5), Tolerance(relative=0.05)):
+            with self.subTest(absolute=tolerance.absolute, relative=tolerance.relative):
+                game = Game(
+                    {'node0': Node('node0', x=0, y=0, production=3, connections={})},
+                    decay_rate=0.1, starting_units=6, offensive_force=1, tolerance=tolerance,
+                )
+                exact_game = Game(
+                    {'node0': Node('node0', x=0, y=0, production=3, connections={})},
+                    decay_rate=0.1, starting_units=6, offensive_force=1,
+                )
+                for g in (game, exact_game):
+                    g.create_player(RecordingConnection(), 'node0', 'player1')
+                    for _ in range(100):
+                        g.simulate_frame(0.1)
+                self.assertEqual(game.nodes['node0'].units, exact_game.nodes['node0'].units)
+                self.assertGreater(game.nodes['node0'].units['player1'], 21)
+
+    def test_units_conserved_within_tolerance(self):
+        c = Connection('node0', 'node1', throughput=1, travel_time=2)
+        nodes = {
+            'node0': Node('node0', x=0, y=0, production=20, connections={'node1': c}),
+            'node1': Node('node1', x=1, y=0, production=0, connections={}),
+        }
+        game = Game(nodes, decay_rate=0, starting_units=10, offensive_force=1, tolerance=Tolerance(absolute=1))
+        player_id = game.create_player(RecordingConnection(), 'node0')
+        nodes['node0'].set_disposition(player_id, Disposition(10, {'node1': 1}))
+
+        def total():
+            """Units in nodes, on the way and arriving in this frame."""
+            units = c.units_data
+            ends = [segment['remaining_time'] for segment in units[1:]] + [0]
+            on_the_way = sum(sum(segment['movements'].values()) * (segment['remaining_time'] - end) for segment, end in zip(units, ends))
+            arriving = sum(sum(movements.values()) for movements in nodes['node1'].incoming.values()) * 0.1
+            return sum(sum(node.units.values()) for node in nodes.values()) + on_the_way + arriving
+
+        game.do_frame(0.1)
+        expected = total()
+        for frame in range(80):
+            if frame == 20:
+                nodes['node0'].production = 19.5  # outflow changes within tolerance
+                game.needs_do_frame.add(nodes['node0'])
+            game.do_frame(0.1)
+            expected += nodes['node0'].production * 0.1
+            self.assertAlmostEqual(total(), expected)
+
+    def test_rates_stopped_when_not_stepped(self):
+        game = Game(
+            {
+                'node0': Node('node0', x=0, y=0, production=3, connections={
+                    'node1': Connection('node0', 'node1', throughput=1, travel_time=100),
+                }),
+                'node1': Node('node1', x=1, y=0, production=3, connections={}),
+            },
+            decay_rate=0.1, starting_units=6, offensive_force=1, tolerance=Tolerance(absolute=0.5), rate_updates=True,
+        )
+        player_id = game.create_player(RecordingConnection(), 'node0')
+        node = game.nodes['node0']
+        node.set_disposition(player_id, Disposition(5.95, {'node1': 1}))  # units fall a bit, then stay
+        for _ in range(20):
+            game.do_frame(0.1)
+        self.assertNotIn(node, game.needs_do_frame)
+        self.assertEqual(node.predicted_units(game.time + 100), node.units)
+
+    def test_do_frame_connection_delta(self):
+        connection = RecordingConnection()
+        self.game.create_player(connection)
+        c = Connection('node0', 'node1', throughput=1, travel_time=10)
+        self.game.nodes['node0'].connections['node1'] = c
+        c.set_movements({'player1': 1})
+        self.game.needs_do_frame = {c}
+        self.game.do_frame(1)
+        message = json.loads(connection.messages[-1])
+        self.assertEqual(message['data'], [{'type': 'connection', 'id': ['node0', 'node1'], 'units_delta': [
+            {'remaining_time': 10, 'movements': {'player1': 1}},
+            {'remaining_time': 9, 'movements': {}},
+        ]}])
+        connection.messages = []
+        self.game.needs_do_frame = {c}
+        self.game.do_frame(1)  # flow only moved along
+        self.assertEqual(connection.messages, [])
+
+    def test_connection_deltas_keep_clients_in_sync(self):
+        def pipe(units, time):
+            """Segments as (end time, movements), expired ones dropped - clients move them along themselves."""
+            head, *segments = [(round(time + segment['remaining_time'], 6), segment['movements']) for segment in units]
+            return [(None, head[1])] + [segment for segment in segments if segment[0] > time]
+
+        for tolerance in (Tolerance(), Tolerance(absolute=0.5)):
+            with self.subTest(tolerance=tolerance):
+                rnd = random.Random(1)
+                c = Connection('node0', 'node1', throughput=1, travel_time=10, max_segments=3)
+                nodes = {
+                    'node0': Node('node0', x=0, y=0, production=3, connections={'node1': c}),
+                    'node1': Node('node1', x=1, y=0, production=3, connections={}),
+                }
+                game = Game(nodes, decay_rate=0.1, starting_units=10, offensive_force=1, tolerance=tolerance)
+                connection = RecordingConnection()
+                player_id = game.create_player(connection, 'node0')
+                client = []
+                for _ in range(60):
+                    # outflow changes on consecutive frames, sometimes only a bit
+                    nodes['node0'].set_disposition(player_id, Disposition(rnd.choice([2, 2.2, 5, 9]), {'node1': 1}))
+                    game.needs_do_frame.add(nodes['node0'])
+                    game.do_frame(0.5)
+                    for message in connection.messages:
+                        for item in json.loads(message)['data']:
+                            if item['type'] == 'connection':
+                                if 'units' in item:
+                                    client = pipe(item['units'], game.time)
+                                else:
+                                    client = pipe(item['units_delta'], game.time) + client[1:]
+                    connection.messages = []
+                    client = client[:1] + [segment for segment in client[1:] if segment[0] > game.time]
+                    self.assertEqual(client, pipe(c.units_data, game.time))
+
+    def test_do_frame_rate_updates(self):
+        def messages_sent(rate_updates):
+            game = Game(self.game.nodes, decay_rate=0.1, starting_units=1, offensive_force=1, tolerance=Tolerance(absolute=0.1), rate_updates=rate_updates)
+            connection = RecordingConnection()
+            player_id = game.create_player(connection)
+            for node in game.nodes.values():
+                node.units = {}
+                node.broadcast_units = {}
+                node.broadcast_rates = {}
+            game.nodes['node0'].units = {player_id: 1}
+            for _ in range(50):
+                game.needs_do_frame = {game.nodes['node0']}
+                game.do_frame(0.1)
+            return [json.loads(m)['data'] for m in connection.messages]
+
+        plain = messages_sent(rate_updates=False)
+        with_rates = messages_sent(rate_updates=True)
+        self.assertLess(len(with_rates) * 3, len(plain))
+        update, = with_rates[0]
+        self.assertEqual(update['units'].keys(), update['rates'].keys())
+
+    def disposition_command(self, node_id, target):
+        return {'type': 'disposition', 'data': {
+            'node_id': node_id,
+            'disposition': {'target': target, 'ratios': {}},
+        }}
+
+    def test_submit_commands_applied_in_frame(self):
+        player_id = self.game.create_player(RecordingConnection())
+        self.game.submit_commands(player_id, self.disposition_command('node0', 5))
+        self.assertEqual(self.game.nodes['node0'].dispositions, {})
+        self.game.do_frame(1)
+        self.assertEqual(self.game.nodes['node0'].dispositions[player_id].target, 5)
+
+    def test_submit_commands_batch(self):
+        player_id = self.game.create_player(RecordingConnection())
+        self.game.submit_commands(player_id, [
+            self.disposition_command('node0', 5),
+            self.disposition_command('node1', 6),
+        ])
+        self.game.do_frame(1)
+        self.assertEqual(self.game.nodes['node0'].dispositions[player_id].target, 5)
+        self.assertEqual(self.game.nodes['node1'].dispositions[player_id].target, 6)
+
+    def test_submit_commands_invalid_batch(self):
+        player_id = self.game.create_player(RecordingConnection())
+        with self.assertRaises(GameUserError):
+            self.game.submit_commands(player_id, [
+                self.disposition_command('node0', 5),
+                {'type': 'disposition', 'data': {}},
+            ])
+        self.assertEqual(len(self.game.commands), 0)
+
+    def test_map_request_immediate(self):
+        connection = RecordingConnection()
+        player_id = self.game.create_player(connection)
+        self.game.submit_commands(player_id, {'type': 'map', 'data': {}})
+        self.assertEqual([json.loads(m)['type'] for m in connection.messages], ['map_info', 'map'])
+        self.assertEqual(len(self.game.commands), 0)
+
+    def test_map_request_cached_version(self):
+        connection = RecordingConnection()
+        player_id = self.game.create_player(connection)
+        self.game.submit_commands(player_id, {'type': 'map', 'data': {'version': self.game.terrain.version}})
+        self.assertEqual([json.loads(m)['type'] for m in connection.messages], ['map_info'])
+
+    def test_map_request_tiles(self):
+        connection = RecordingConnection()
+        player_id = self.game.create_player(connection)
+        self.game.submit_commands(player_id, {'type': 'map', 'data': {'tiles': ['0,0']}})
+        self.assertEqual([json.loads(m)['type'] for m in connection.messages], ['map_info', 'map_tile'])
+        with self.assertRaises(GameUserError):
+            self.game.submit_commands(player_id, {'type': 'map', 'data': {'tiles': ['7,7']}})
+        with self.assertRaises(GameUserError):
+            self.game.submit_commands(player_id, {'type': 'map', 'data': {'tile': '0,0'}})
+
+    def test_apply_commands_error(self):
+        connection = RecordingConnection()
+        player_id = self.game.create_player(connection)
+        self.game.submit_commands(player_id, self.disposition_command('node9', 5))
+        self.game.apply_commands()
+        self.assertEqual(json.loads(connection.messages[0])['type'], 'error')
+
+
+class PlayerLifecycleTestCase(TestCase):
+    def setUp(self):
+        self.game = Game(
+            nodes={
+                'node0': Node('node0', x=0, y=0, production=3, connections={
+                    'node1': Connection('node0', 'node1', throughput=1, travel_time=1),
+                }),
+                'node1': Node('node1', x=1, y=0, production=3, connections={
+                    'node0': Connection('node1', 'node0', throughput=1, travel_time=1),
+                }),
+            },
+            decay_rate=0.1,
+            starting_units=10,
+            offensive_force=1,
+            reconnect_grace=5,
+        )
+        self.connection = RecordingConnection()
+        self.player_id = self.game.join(self.connection)
+        self.game.players[self.player_id].color = 'blue'
+        self.token = json.loads(self.connection.messages[0])['data']['token']
+
+    def start_flow(self):
+        node = self.game.nodes['node0']
+        node.units = {self.player_id: 10}
+        node.dispositions = {self.player_id: Disposition(5, {'node1': 1})}
+        self.game.needs_do_frame.add(node)
+        for _ in range(3):
+            self.game.do_frame(0.2)
+
+    def test_session_sent(self):
+        message = json.loads(self.connection.messages[0])
+        self.assertEqual(message['type'], 'session')
+        self.assertEqual(message['data']['player_id'], self.player_id)
+
+    def test_reconnect(self):
+        self.game.disconnect(self.player_id)
+        self.game.do_frame(0.2)
+        connection = RecordingConnection()
+        self.assertEqual(self.game.join(connection, self.token), self.player_id)
+        self.assertEqual(self.game.players[self.player_id].color, 'blue')
+        self.assertEqual(json.loads(connection.messages[0])['data']['token'], self.token)
+        self.assertIn(self.player_id, self.game.resync_requests)
+
+    def test_late_close_after_reconnect(self):
+        connection = RecordingConnection()
+        self.game.join(connection, self.token)  # before the old socket's close is noticed
+        self.game.disconnect(self.player_id, self.connection)
+        self.assertIs(self.game.players[self.player_id].connection, connection)
+        self.game.time += 10
+        self.game.reap_players()
+        self.assertIn(self.player_id, self.game.players)
+
+    def test_unknown_token_creates_player(self):
+        self.assertNotEqual(self.game.join(RecordingConnection(), 'forged'), self.player_id)
+        self.assertEqual(len(self.game.players), 2)
+
+    def test_disconnected_not_sent_updates(self):
+        self.game.disconnect(self.player_id)
+        sent = len(self.connection.messages)
+        self.game.do_frame(0.2)
+        self.assertEqual(len(self.connection.messages), sent)
+
+    def test_removed_after_grace(self):
+        self.start_flow()
+        self.game.disconnect(self.player_id)
+        self.game.time += 4
+        self.game.reap_players()
+        self.assertIn(self.player_id, self.game.players)
+        self.game.time += 1
+        self.game.reap_players()
+        self.assertNotIn(self.player_id, self.game.players)
+        self.assertNotIn(self.token, self.game.sessions)
+        for node in self.game.nodes.values():
+            self.assertNotIn(self.player_id, node.units)
+            self.assertEqual(node.dispositions, {})
+            for movements in node.incoming.values():
+                self.assertNotIn(self.player_id, movements)
+            for connection in node.connections.values():
+                self.assertEqual(connection.player_ids, set())
+        self.assertIn(self.game.nodes['node0'], self.game.needs_do_frame)
+        self.assertIn(self.game.nodes['node0'].connections['node1'], self.game.needs_do_frame)
+        self.assertNotEqual(self.game.join(RecordingConnection(), self.token), self.player_id)
+
+    def test_removed_player_flow_broadcast(self):
+        self.start_flow()
+        connection = self.game.nodes['node0'].connections['node1']
+        for _ in range(10):  # older flows arrive, the pipe is steady
+            self.game.do_frame(0.2)
+        self.assertEqual(len(connection.units_data), 1)
+        watcher = RecordingConnection()
+        self.game.create_player(watcher, 'node1')
+        watcher.messages = []
+        self.game.disconnect(self.player_id)
+        self.game.remove_player(self.player_id)
+        self.game.do_frame(0.2)
+        items = [item for message in watcher.messages for item in json.loads(message)['data'] if item['type'] == 'connection']
+        self.assertEqual(items, [{'type': 'connection', 'id': ['node0', 'node1'], 'units': [{'remaining_time': 1, 'movements': {}}]}])
+
+    def test_removed_player_commands_dropped(self):
+        other_id = self.game.create_player(RecordingConnection(), 'node1')
+        self.game.submit_commands(self.player_id, {'type': 'player', 'data': {'player_ids': []}})
+        self.game.submit_commands(other_id, {'type': 'player', 'data': {'player_ids': []}})
+        self.game.disconnect(self.player_id)
+        self.game.remove_player(self.player_id)
+        self.assertEqual([player_id for player_id, _ in self.game.commands], [other_id])
+
+    def test_removed_player_commands_order_kept(self):
+        other_id = self.game.create_player(RecordingConnection(), 'node1')
+        third_id = self.game.create_player(RecordingConnection(), 'node0')
+        self.game.commands = ConcurrentAppends()
+        for player_id in [self.player_id, other_id, third_id] * 2:
+            self.game.submit_commands(player_id, {'type': 'player', 'data': {'player_ids': []}})
+        late = self.game.commands[1]
+        self.game.commands.late = late
+        expected = [command for command in self.game.commands if command[0] != self.player_id] + [late]
+        self.game.disconnect(self.player_id)
+        self.game.remove_player(self.player_id)
+        self.assertEqual(list(self.game.commands), expected)
+
+    def test_wiped_out_connected_player_stays(self):
+        self.start_flow()
+        for node in self.game.nodes.values():
+            node.units = {}
+            node.incoming = {}
+            for connection in node.connections.values():
+                connection.remove_player(self.player_id)
+        self.game.reap_players()
+        self.assertTrue(self.game.players[self.player_id].wiped_out)
+        self.assertEqual(self.game.nodes['node0'].dispositions, {})
+        self.game.disconnect(self.player_id)
+        self.game.reap_players()  # no need to wait for it
+        self.assertNotIn(self.player_id, self.game.players)
+
+    def test_units_on_the_way_keep_player(self):
+        self.start_flow()
+        for node in self.game.nodes.values():
+            node.units = {}
+        self.game.reap_players()
+        self.assertFalse(self.game.players[self.player_id].wiped_out)
+
+
+class SteppingGame:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = GameMetrics()
+        self.steps = []
+        self.broadcasts = []
+
+    def simulate_frame(self, dt):
+        self.steps.append(dt)
+        return {len(self.steps)}
+
+    def broadcast_frame(self, changed):
+        self.broadcasts.append(changed)
+
+
+class SimulationRunnerTestCase(TestCase):
+    def setUp(self):
+        self.game = SteppingGame()
+
+    def test_tick_fixed_steps(self):
+        runner = SimulationRunner(self.game, 0.1, fixed_timestep=True)
+        runner.tick(0.25)
+        self.assertEqual(self.game.steps, [0.1, 0.1])
+        self.assertAlmostEqual(runner.accumulator, 0.05)
+        runner.tick(0.05)
+        self.assertEqual(len(self.game.steps), 3)
+
+    def test_tick_overload_drop(self):
+        runner = SimulationRunner(self.game, 0.1, fixed_timestep=True, max_substeps=2)
+        runner.tick(0.5)
+        self.assertEqual(self.game.steps, [0.1, 0.1])
+        self.assertAlmostEqual(runner.stats.dropped_time, 0.3)
+        self.assertEqual(runner.stats.overloaded_frames, 1)
+
+    def test_tick_overload_merge(self):
+        runner = SimulationRunner(self.game, 0.1, fixed_timestep=True, max_substeps=2, overload_policy='merge')
+        runner.tick(0.5)
+        self.assertEqual(len(self.game.steps), 2)
+        self.assertAlmostEqual(sum(self.game.steps), 0.5)
+
+    def test_tick_lower_broadcast_rate(self):
+        runner = SimulationRunner(self.game, 0.1, fixed_timestep=True, max_broadcast_interval=4)
+        runner.tick(0.3)
+        self.assertEqual(self.game.broadcasts, [])
+        runner.tick(0.1)
+        self.assertEqual(self.game.broadcasts, [{1, 2, 3, 4}])
+
+    def test_tick_broadcast_dt(self):
+        runner = SimulationRunner(self.game, 0.1, fixed_timestep=True, broadcast_dt=0.5)
+        for _ in range(4):
+            runner.tick(0.1)
+        self.assertEqual(self.game.broadcasts, [])
+        runner.tick(0.1)
+        self.assertEqual(self.game.broadcasts, [{1, 2, 3, 4, 5}])
+
+
+class FrameStatsTestCase(TestCase):
+    def test_summary(self):
+        stats = FrameStats()
+        for duration in range(1, 101):
+            stats.add(duration / 1000)
+        summary = stats.summary()
+        self.assertEqual(summary['frames'], 100)
+        self.assertAlmostEqual(summary['mean'], 0.0505)
+        self.assertEqual(summary['p95'], 0.096)
+        self.assertEqual(summary['max'], 0.1)
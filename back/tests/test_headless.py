@@ -0,0 +1,103 @@
+from unittest import TestCase
+import json
+import os
+import tempfile
+
+from game import Game
+from headless import HeadlessRunner, main
+from map_generators import SquareMapGenerator
+from snapshots import CommandLog
+
+
+class HeadlessRunnerTestCase(TestCase):
+    def setUp(self):
+        self.game = Game(
+            nodes=SquareMapGenerator(x=3, y=3, distance=25, production=20, throughput=1).generate(),
+            decay_rate=0.1,
+            starting_units=10,
+            offensive_force=1,
+        )
+        self.runner = HeadlessRunner(self.game, 0.2)
+        self.runner.add_player('alice', '(0, 0)')
+        self.runner.add_player('bob', '(2, 2)')
+
+    def test_commands_on_time(self):
+        self.runner.add_command(1, 'alice', {'type': 'disposition', 'data': {
+            'node_id': '(0, 0)',
+            'disposition': {'target': 5, 'ratios': {'(1, 0)': 1}},
+        }})
+        self.runner.run(1)
+        self.assertEqual(self.game.frame, 5)
+        self.assertEqual(self.game.nodes['(0, 0)'].dispositions, {})
+        self.runner.run(1)
+        self.assertEqual(self.game.nodes['(0, 0)'].dispositions[self.runner.players['alice']].target, 5)
+
+    def test_state(self):
+        self.runner.run(2)
+        state = self.runner.state
+        self.assertAlmostEqual(state['time'], 2)
+        self.assertEqual(state['frame'], 10)
+        self.assertEqual(state['nodes'].keys(), {'(0, 0)', '(2, 2)'})
+        self.assertEqual(state['players']['alice']['nodes'], 1)
+        self.assertAlmostEqual(state['players']['alice']['units'], state['nodes']['(0, 0)']['alice'])
+
+
+class MainTestCase(TestCase):
+    def test_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'state.json')
+            main(['--size', '4', '--duration', '10', '--output', output])
+            with open(output) as f:
+                state = json.load(f)
+        self.assertEqual(state['frame'], 50)
+        self.assertEqual(state['players'].keys(), {'player1', 'player2'})
+        self.assertEqual(state['timing']['frames']['steps'], 50)
+
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log = os.path.join(directory, 'commands.log')
+            game = Game(
+                nodes=SquareMapGenerator(x=4, y=4, distance=25, production=20, throughput=1).generate(),
+                decay_rate=0.1,
+                starting_units=10,
+                offensive_force=1,
+                command_log=CommandLog.open(log),
+            )
+            runner = HeadlessRunner(game, 0.2)
+            runner.add_player('alice', '(0, 0)')
+            runner.add_command(1, 'alice', {'type': 'disposition', 'data': {
+                'node_id': '(0, 0)',
+                'disposition': {'target': 5, 'ratios': {'(1, 0)': 1}},
+            }})
+            runner.run(4)
+            game.command_log.close()
+
+            output = os.path.join(directory, 'state.json')
+            main(['--size', '4', '--replay', log, '--duration', '3', '--output', output])  # the log ends at frame 5
+            with open(output) as f:
+                state = json.load(f)
+        self.assertEqual(state['frame'], game.frame)
+        self.assertEqual(state['nodes'], {
+            node_id: {runner.players['alice']: units['alice']} for node_id, units in runner.state['nodes'].items()
+        })
+
+    def test_regions(self):
+        script = {
+            'players': {'alice': {'start': '(0, 0)'}, 'bob': {'start': '(3, 3)'}},
+            'commands': [
+                {'time': 0, 'player': 'alice', 'command': {'type': 'route', 'data': {'source': '(0, 0)', 'destination': '(3, 0)', 'target': 5}}},
+                {'time': 0, 'player': 'bob', 'command': {'type': 'route', 'data': {'source': '(3, 3)', 'destination': '(0, 3)', 'target': 5}}},
+            ],
+        }
+        states = []
+        with tempfile.TemporaryDirectory() as directory:
+            script_path = os.path.join(directory, 'script.json')
+            with open(script_path, 'w') as f:
+                json.dump(script, f)
+            for regions in ([], ['--regions', '2']):
+                output = os.path.join(directory, 'state.json')
+                main(['--size', '4', '--duration', '60', '--script', script_path, '--output', output] + regions)
+                with open(output) as f:
+                    states.append(json.load(f))
+        self.assertGreater(len(states[0]['nodes']), 4)
+        self.assertEqual(states[1]['nodes'], states[0]['nodes'])
@@ -0,0 +1,76 @@
+from unittest import TestCase
+import math
+
+import numpy as np
+
+from game import Game, Node, Connection, ObjectEngine
+from commands import Disposition
+from integrators import INTEGRATORS, Exponential, SemiImplicit
+from vectorized import VectorizedEngine
+
+
+class IntegratorsTestCase(TestCase):
+    def test_affine_same_as_step(self):
+        for integrator in INTEGRATORS.values():
+            for gain, loss in ((3, 0.1), (0, 2), (1.5, 0)):
+                with self.subTest(integrator=integrator.name, gain=gain, loss=loss):
+                    ratio, offset = integrator.affine(gain, loss, 0.5)
+                    self.assertAlmostEqual(ratio * 7 + offset, integrator.step(7, gain, loss, 0.5))
+
+    def test_array_same_as_step(self):
+        units, gain, loss = np.array([7, 0, 2]), np.array([3, 1, 0.5]), np.array([0.1, 0, 4])
+        for integrator in INTEGRATORS.values():
+            with self.subTest(integrator=integrator.name):
+                np.testing.assert_allclose(
+                    integrator.step_array(units, gain, loss, 0.5),
+                    [integrator.step(*args, 0.5) for args in zip(units, gain, loss)],
+                )
+
+
+class NodeIntegrationTestCase(TestCase):
+    def make_game(self, integrator, engine_class=ObjectEngine):
+        self.node = Node(id='node1', x=0, y=0, production=3, connections={
+            'node2': Connection('node1', 'node2', throughput=1, travel_time=10),
+        })
+        return Game(
+            {'node1': self.node},
+            decay_rate=0.1,
+            starting_units=1,
+            offensive_force=1,
+            engine=engine_class(),
+            integrator=integrator,
+        )
+
+    def test_single_owner_exact(self):
+        for engine_class in (ObjectEngine, VectorizedEngine):
+            with self.subTest(engine=engine_class.__name__):
+                game = self.make_game(Exponential(), engine_class)
+                self.node.units = {'player1': 6}
+                for _ in range(4):
+                    game.engine.nodes_frame(game, [self.node], 2.5)
+                # u' = 3 - 0.1 u
+                self.assertAlmostEqual(self.node.units['player1'], 30 + (6 - 30) * math.exp(-0.1 * 10))
+
+    def test_battle_not_negative(self):
+        for integrator in (SemiImplicit(), Exponential()):
+            with self.subTest(integrator=integrator.name):
+                game = self.make_game(integrator)
+                self.node.units = {'player1': 20, 'player2': 1}
+                game.engine.nodes_frame(game, [self.node], 1)
+                self.assertGreater(self.node.units['player2'], 0)
+                self.assertLess(self.node.units['player2'], 1)
+        game = self.make_game(INTEGRATORS['euler'])
+        self.node.units = {'player1': 20, 'player2': 1}
+        game.engine.nodes_frame(game, [self.node], 1)
+        self.assertNotIn('player2', self.node.units)  # overshot below zero, wiped out in a single frame
+
+    def test_held_at_target(self):
+        # held units don't decay within the frame, everything beyond the target is sent
+        for integrator in INTEGRATORS.values():
+            with self.subTest(integrator=integrator.name):
+                game = self.make_game(integrator)
+                self.node.units = {'player1': 5}
+                self.node.dispositions = {'player1': Disposition(5, {'node2': 1})}
+                game.engine.nodes_frame(game, [self.node], 2)
+                self.assertEqual(self.node.units, {'player1': 5})
+                self.assertAlmostEqual(self.node.connections['node2'].movements['player1'], 3 - 0.1 * 5)
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from game import Game
+from interest import InterestManager
+from map_generators import SquareMapGenerator
+from snapshots import OfflineConnection
+
+
+class InterestManagerTestCase(TestCase):
+    def setUp(self):
+        self.nodes = SquareMapGenerator(
+            x=5, y=1, distance=1,
+            production=1, throughput=1,
+        ).generate()
+        self.interest = InterestManager(self.nodes, radius=1)
+
+    def test_reach(self):
+        self.assertEqual(self.interest.reach('(0, 0)'), {'(0, 0)', '(1, 0)'})
+        self.assertEqual(self.interest.reach('(2, 0)'), {'(1, 0)', '(2, 0)', '(3, 0)'})
+
+    def test_update_gained(self):
+        node = self.nodes['(1, 0)']
+        node.units = {'player1': 1}
+        gained = self.interest.update([node])
+        self.assertEqual(gained, {'player1': {'(0, 0)', '(1, 0)', '(2, 0)'}})
+        self.assertEqual(self.interest.watching(['(2, 0)']), {'player1'})
+        self.assertEqual(self.interest.watching(['(3, 0)']), set())
+
+    def test_update_no_change(self):
+        node = self.nodes['(1, 0)']
+        node.units = {'player1': 1}
+        self.interest.update([node])
+        node.units = {'player1': 2}
+        self.assertEqual(self.interest.update([node]), {})
+
+    def test_update_overlapping_reach(self):
+        self.nodes['(1, 0)'].units = {'player1': 1}
+        self.interest.update([self.nodes['(1, 0)']])
+        self.nodes['(2, 0)'].units = {'player1': 1}
+        gained = self.interest.update([self.nodes['(2, 0)']])
+        self.assertEqual(gained, {'player1': {'(3, 0)'}})
+
+        self.nodes['(1, 0)'].units = {}
+        self.interest.update([self.nodes['(1, 0)']])
+        self.assertEqual(self.interest.watching(['(1, 0)']), {'player1'})
+        self.assertEqual(self.interest.watching(['(0, 0)']), set())
+
+
+class GameInterestTestCase(TestCase):
+    def test_presence_updated_without_players(self):
+        nodes = SquareMapGenerator(x=5, y=1, distance=1, production=1, throughput=1).generate()
+        game = Game(nodes, decay_rate=0.1, starting_units=10, offensive_force=1, interest_radius=1)
+        player_id = game.create_player(OfflineConnection(), '(0, 0)')
+        game.do_frame(0.2)
+        self.assertEqual(game.interest.watching(['(1, 0)']), {player_id})
+        game.disconnect(player_id)
+        game.remove_player(player_id)
+        game.do_frame(0.2)  # nobody to send it to, the presence changed still
+        self.assertEqual(game.interest.watching(['(1, 0)']), set())
+        self.assertEqual(game.interest.presence, {})
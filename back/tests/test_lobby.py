@@ -0,0 +1,150 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+import asyncio
+import json
+
+import websockets
+
+from lobby import Lobby, Worker, WorkerHandle
+
+
+class FakePipe:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def disposition(node_id, target):
+    return json.dumps([{'type': 'disposition', 'data': {'node_id': node_id, 'disposition': {'target': target, 'ratios': {}}}}])
+
+
+class WorkerTestCase(TestCase):
+    def setUp(self):
+        self.worker = Worker(FakePipe(), {'size': 3})
+
+    def sent(self, client_id=None):
+        self.worker.flush()
+        messages = [m for batch in self.worker.pipe.sent for m in batch]
+        self.worker.pipe.sent = []
+        if client_id is None:
+            return messages
+        return [json.loads(data) for kind, key, data in messages if kind == 'send' and key == client_id]
+
+    def test_games_started_on_join(self):
+        self.worker.handle(('join', 1, 'a', None))
+        self.worker.handle(('join', 2, 'a', None))
+        self.worker.handle(('join', 3, 'b', None))
+        self.assertEqual(self.worker.runners.keys(), {'a', 'b'})
+        self.assertEqual(len(self.worker.runners['a'].game.players), 2)
+        self.assertEqual(self.worker.load()['players'], 3)
+        session, = [m for m in self.sent(1) if m['type'] == 'session']
+        self.assertEqual(self.worker.clients[1][:2], ('a', session['data']['player_id']))
+
+    def test_messages_and_errors(self):
+        self.worker.handle(('join', 1, 'a', None))
+        game_id, player_id, _ = self.worker.clients[1]
+        game = self.worker.runners['a'].game
+        node_id = next(node_id for node_id, node in game.nodes.items() if player_id in node.units)
+        self.worker.handle(('message', 1, disposition(node_id, 3)))
+        self.assertEqual(len(game.commands), 1)
+        self.sent()
+        self.worker.handle(('message', 1, 'not json'))
+        self.assertEqual([m['type'] for m in self.sent(1)], ['error'])
+
+    def test_step_broadcasts(self):
+        self.worker.handle(('join', 1, 'a', None))
+        self.sent()
+        self.assertAlmostEqual(self.worker.step(0.2), 0.2, delta=0.05)
+        self.assertEqual(self.worker.runners['a'].game.frame, 1)
+        self.assertIn('units', [m['type'] for m in self.sent(1)])
+
+    def test_game_ends_without_players(self):
+        self.worker.handle(('join', 1, 'a', None))
+        self.worker.handle(('leave', 1))
+        self.worker.runners['a'].game.reconnect_grace = 0
+        self.worker.step(0.2)
+        self.assertEqual(self.worker.runners, {})
+        self.assertIn(('ended', 'a', 1), self.sent())  # with the last client joined
+
+    def test_game_started_again_after_end(self):
+        self.worker.handle(('join', 1, 'a', None))
+        self.worker.handle(('leave', 1))
+        self.worker.runners['a'].game.reconnect_grace = 0
+        self.worker.step(0.2)
+        self.worker.handle(('join', 2, 'a', None))  # sent by the lobby before the end reached it
+        self.worker.handle(('leave', 2))
+        self.worker.runners['a'].game.reconnect_grace = 0
+        self.worker.step(0.2)
+        self.assertEqual([m for m in self.sent() if m[0] == 'ended'], [('ended', 'a', 1), ('ended', 'a', 2)])
+
+
+class LobbyTestCase(TestCase):
+    def test_assign_by_headroom(self):
+        lobby = Lobby('localhost', 0)
+        lobby.workers = [WorkerHandle(index, None, None) for index in range(3)]
+        lobby.workers[0].headroom = 0.2
+        self.assertEqual(lobby.assign('a', 1).index, 1)
+        self.assertEqual(lobby.assign('b', 2).index, 2)  # fewer games
+        self.assertEqual(lobby.assign('a', 3).index, 1)  # games stay where they are
+        lobby.handle_batch(lobby.workers[1], [('ended', 'a', 3)])
+        self.assertNotIn('a', lobby.games)
+        self.assertEqual(lobby.workers[1].games, {})
+
+    def test_join_during_end(self):
+        lobby = Lobby('localhost', 0)
+        lobby.workers = [WorkerHandle(index, None, None) for index in range(2)]
+        worker = lobby.assign('a', 1)
+        # the worker ends the game, while the lobby sends another join for it there
+        self.assertIs(lobby.assign('a', 2), worker)
+        lobby.handle_batch(worker, [('ended', 'a', 1)])
+        self.assertIs(lobby.games['a'], worker)  # the worker starts it again on the join
+        self.assertIs(lobby.assign('a', 3), worker)
+        lobby.handle_batch(worker, [('ended', 'a', 3)])
+        self.assertNotIn('a', lobby.games)
+
+    def test_messages_to_worker_queued(self):
+        worker = WorkerHandle(0, None, FakePipe())
+        worker.post(('join', 1, 'a', None))
+        worker.post(('message', 1, 'data'))
+        self.assertEqual(worker.pipe.sent, [])  # the pipe may block, it's written by another thread
+        worker.flush()
+        self.assertEqual(worker.pipe.sent, [('join', 1, 'a', None), ('message', 1, 'data')])
+
+    def test_load_metrics(self):
+        lobby = Lobby('localhost', 0)
+        worker = WorkerHandle(0, None, None)
+        lobby.handle_batch(worker, [('load', None, {'games': 2, 'players': 5, 'headroom': 0.75})])
+        self.assertEqual(worker.headroom, 0.75)
+        self.assertIn('rts_worker_headroom{worker="0"} 0.75', lobby.metrics.render())
+
+
+class LobbyProcessesTestCase(IsolatedAsyncioTestCase):
+    async def receive(self, websocket, type):
+        while True:
+            message = json.loads(await asyncio.wait_for(websocket.recv(), 10))
+            if message['type'] == type:
+                return message['data']
+
+    async def test_games_on_workers(self):
+        lobby = Lobby('localhost', 0, workers=2, settings={'size': 3})
+        started = asyncio.get_running_loop().create_future()
+        serving = asyncio.ensure_future(lobby.serve_forever(started))
+        server = await started
+        port = server.sockets[0].getsockname()[1]
+        try:
+            async with websockets.connect('ws://localhost:{}/a'.format(port)) as alice, \
+                    websockets.connect('ws://localhost:{}/b'.format(port)) as bob:
+                alice_session = await self.receive(alice, 'session')
+                await self.receive(bob, 'session')
+                self.assertNotEqual(lobby.games['a'], lobby.games['b'])
+                await self.receive(alice, 'units')
+
+            # reconnect within the grace period
+            async with websockets.connect('ws://localhost:{}/a?token={}'.format(port, alice_session['token'])) as alice:
+                self.assertEqual((await self.receive(alice, 'session'))['player_id'], alice_session['player_id'])
+        finally:
+            serving.cancel()
+            for worker in lobby.workers:
+                worker.process.terminate()
+                worker.process.join()
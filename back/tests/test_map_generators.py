@@ -1,6 +1,26 @@
 from unittest import TestCase
+from unittest.mock import patch
+import gc
 
-from map_generators import SquareMapGenerator
+from map_generators import SquareMapGenerator, HexMapGenerator, RandomGeometricMapGenerator, ArchipelagoMapGenerator
+
+
+def assert_symmetric(test_case, nodes):
+    for node in nodes.values():
+        for target_node_id, connection in node.connections.items():
+            test_case.assertIn(node.id, nodes[target_node_id].connections)
+            test_case.assertEqual(connection.travel_time, nodes[target_node_id].connections[node.id].travel_time)
+
+
+def reachable(nodes, start_node_id):
+    seen = {start_node_id}
+    stack = [start_node_id]
+    while stack:
+        for target_node_id in nodes[stack.pop()].connections:
+            if target_node_id not in seen:
+                seen.add(target_node_id)
+                stack.append(target_node_id)
+    return seen
 
 
 class SquareMapGeneratorTestCase(TestCase):
@@ -9,3 +29,69 @@ class SquareMapGeneratorTestCase(TestCase):
             x=5, y=5, distance=25,
             production=20, throughput=1,
         ).generate()
+
+    def test_gc_left_alone(self):
+        generator = SquareMapGenerator(x=3, y=3, distance=25, production=20, throughput=1)
+        with patch('gc.disable') as disable:
+            generator.generate()  # may run beside other threads, e.g. in lobby workers
+        disable.assert_not_called()
+        self.assertEqual(generator.generate(pause_gc=True).keys(), generator.generate().keys())
+        self.assertTrue(gc.isenabled())
+
+    def test_connections(self):
+        nodes = SquareMapGenerator(x=3, y=2, distance=25, production=20, throughput=1).generate()
+        self.assertEqual(len(nodes), 6)
+        self.assertEqual(set(nodes['(0, 0)'].connections), {'(1, 0)', '(0, 1)'})
+        self.assertEqual(set(nodes['(1, 1)'].connections), {'(0, 1)', '(2, 1)', '(1, 0)'})
+        self.assertEqual(nodes['(0, 0)'].connections['(1, 0)'].travel_time, 25)
+        assert_symmetric(self, nodes)
+
+    def test_ids_not_copied(self):
+        nodes = SquareMapGenerator(x=3, y=2, distance=25, production=20, throughput=1).generate()
+        self.assertIs(nodes['(0, 0)'].connections['(1, 0)'].target_node_id, nodes['(1, 0)'].id)
+
+    def test_iter_nodes_is_lazy(self):
+        nodes = SquareMapGenerator(x=10 ** 6, y=10 ** 6, distance=25, production=20, throughput=1).iter_nodes()
+        self.assertEqual(next(nodes).id, '(0, 0)')
+
+
+class HexMapGeneratorTestCase(TestCase):
+    def test_connections(self):
+        nodes = HexMapGenerator(x=5, y=5, distance=25, production=20, throughput=1).generate()
+        self.assertEqual(len(nodes['(2, 2)'].connections), 6)
+        self.assertEqual(len(nodes['(2, 1)'].connections), 6)
+        for node in nodes.values():
+            for connection in node.connections.values():
+                self.assertAlmostEqual(connection.travel_time, 25)
+        assert_symmetric(self, nodes)
+
+
+class RandomGeometricMapGeneratorTestCase(TestCase):
+    def test_connections(self):
+        generator = RandomGeometricMapGenerator(count=300, width=200, height=200, radius=30, seed=1, production=20, throughput=1)
+        nodes = generator.generate()
+        self.assertEqual(len(nodes), 300)
+        assert_symmetric(self, nodes)
+        for node in nodes.values():
+            for other in nodes.values():
+                close = node is not other and ((node.x - other.x) ** 2 + (node.y - other.y) ** 2) ** 0.5 <= 30
+                self.assertEqual(other.id in node.connections, close)
+
+    def test_seed(self):
+        def generate():
+            return RandomGeometricMapGenerator(count=50, width=100, height=100, radius=20, seed=3, production=20, throughput=1).generate()
+        self.assertEqual(
+            [(n.x, n.y, sorted(n.connections)) for n in generate().values()],
+            [(n.x, n.y, sorted(n.connections)) for n in generate().values()],
+        )
+
+
+class ArchipelagoMapGeneratorTestCase(TestCase):
+    def test_connected(self):
+        nodes = ArchipelagoMapGenerator(
+            islands=8, island_nodes=40, island_radius=20, width=1000, height=1000, radius=15,
+            seed=1, production=20, throughput=1,
+        ).generate()
+        self.assertEqual(len(nodes), 320)
+        assert_symmetric(self, nodes)
+        self.assertEqual(len(reachable(nodes, 'n0')), 320)
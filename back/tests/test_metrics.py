@@ -0,0 +1,122 @@
+from unittest import TestCase
+import threading
+import time
+import urllib.request
+
+from game import Game, Node, Connection
+from metrics import Registry, Histogram, GameMetrics, MetricsServer, SamplingProfiler
+from snapshots import OfflineConnection
+
+
+class HistogramTestCase(TestCase):
+    def test_rolling_window(self):
+        histogram = Histogram(window=10)
+        for value in range(100):
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0), 90)
+        self.assertEqual(histogram.quantile(0.5), 95)
+        self.assertEqual(histogram.last, 99)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.sum, sum(range(100)))
+
+    def test_timer(self):
+        histogram = Histogram()
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.count, 1)
+        self.assertGreaterEqual(histogram.last, 0)
+
+
+class RegistryTestCase(TestCase):
+    def test_render(self):
+        registry = Registry(prefix='test_')
+        registry.counter('messages_total', 'Messages.', type='units').inc(3)
+        registry.counter('messages_total', 'Messages.', type='map').inc()
+        registry.gauge('players', 'Players.').set(2)
+        registry.histogram('frame_seconds', 'Frames.').observe(0.5)
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP test_frame_seconds Frames.',
+            '# TYPE test_frame_seconds summary',
+            'test_frame_seconds{quantile="0.5"} 0.5',
+            'test_frame_seconds{quantile="0.95"} 0.5',
+            'test_frame_seconds{quantile="0.99"} 0.5',
+            'test_frame_seconds_sum 0.5',
+            'test_frame_seconds_count 1',
+            '# HELP test_messages_total Messages.',
+            '# TYPE test_messages_total counter',
+            'test_messages_total{type="units"} 3',
+            'test_messages_total{type="map"} 1',
+            '# HELP test_players Players.',
+            '# TYPE test_players gauge',
+            'test_players 2',
+        ])
+
+    def test_same_metric(self):
+        registry = Registry()
+        self.assertIs(registry.counter('a_total', 'A.', x='1'), registry.counter('a_total', 'A.', x='1'))
+        self.assertIsNot(registry.counter('a_total', 'A.', x='1'), registry.counter('a_total', 'A.', x='2'))
+
+
+class GameMetricsTestCase(TestCase):
+    def test_game_instrumented(self):
+        game = Game(
+            nodes={
+                'node0': Node('node0', x=0, y=0, production=3, connections={
+                    'node1': Connection('node0', 'node1', throughput=1, travel_time=1),
+                }),
+                'node1': Node('node1', x=1, y=0, production=3, connections={}),
+            },
+            decay_rate=0.1,
+            starting_units=10,
+            offensive_force=1,
+        )
+        game.create_player(OfflineConnection(), 'node0')
+        for _ in range(3):
+            with game.lock:
+                game.do_frame(0.2)
+        metrics = game.metrics
+        for phase in GameMetrics.phases:
+            self.assertEqual(metrics.phase[phase].count, 3)
+        self.assertEqual(metrics.active_objects.recent[0], 1)
+        self.assertEqual(metrics.lock_wait.count, 3)
+        self.assertEqual(metrics.lock_hold.count, 3)
+        messages, size = metrics.messages['units']
+        self.assertEqual(messages.value, 3)
+        self.assertGreater(size.value, 0)
+        self.assertIn('rts_frame_phase_seconds_count{phase="nodes"} 3', metrics.render())
+
+
+class MetricsServerTestCase(TestCase):
+    def test_endpoints(self):
+        metrics = GameMetrics()
+        metrics.steps.inc(5)
+        profiler = SamplingProfiler(threading.current_thread())
+        profiler.sample()
+        server = MetricsServer(metrics, port=0, profiler=profiler)
+        server.start()
+        try:
+            url = 'http://localhost:{}'.format(server.server_address[1])
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertIn('rts_steps_total 5', response.read().decode())
+            with urllib.request.urlopen(url + '/profile') as response:
+                self.assertIn('test_metrics.py:test_endpoints', response.read().decode())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class SamplingProfilerTestCase(TestCase):
+    def test_samples_thread(self):
+        def busy():
+            deadline = time.perf_counter() + 0.2
+            while time.perf_counter() < deadline:
+                pass
+        thread = threading.Thread(target=busy)
+        thread.start()
+        profiler = SamplingProfiler(thread, interval=0.005)
+        profiler.start()
+        thread.join()
+        profiler.stop()
+        profiler.join()
+        self.assertGreater(profiler.samples, 0)
+        self.assertIn('test_metrics.py:busy', profiler.collapsed())
@@ -0,0 +1,101 @@
+from unittest import TestCase
+import functools
+
+from game import Connection, Game, Node, Tolerance
+from headless import make_map
+from integrators import Exponential
+from partition import BoundaryExchange, PartitionedGame, cut_weight, partition
+from snapshots import OfflineConnection
+
+
+def disposition_command(node_id, target, ratios):
+    return {'type': 'disposition', 'data': {'node_id': node_id, 'disposition': {'target': target, 'ratios': ratios}}}
+
+
+class PartitionTestCase(TestCase):
+    def test_balanced_and_refined(self):
+        nodes = make_map('random', 20, 1)
+        assignment = partition(nodes, 4)
+        sizes = [list(assignment.values()).count(region) for region in range(4)]
+        self.assertEqual(assignment.keys(), nodes.keys())
+        self.assertLessEqual(max(sizes), 105)
+        self.assertGreaterEqual(min(sizes), 95)
+        self.assertLess(cut_weight(nodes, assignment), cut_weight(nodes, partition(nodes, 4, passes=0)))
+
+    def test_cuts_thin_connections(self):
+        # a row of nodes, the connection in the middle-right is the thinnest
+        nodes = {str(i): Node(str(i), x=i * 10, y=0, production=1, connections={}) for i in range(6)}
+        throughputs = [5, 5, 5, 1, 5]
+        for i, throughput in enumerate(throughputs):
+            for a, b in ((i, i + 1), (i + 1, i)):
+                nodes[str(a)].connections[str(b)] = Connection(str(a), str(b), throughput, 1)
+        assignment = partition(nodes, 2, imbalance=0.4)
+        self.assertEqual(cut_weight(nodes, assignment), 2)
+        self.assertEqual(assignment['3'], assignment['0'])
+
+
+class BoundaryExchangeTestCase(TestCase):
+    def test_write_and_read(self):
+        exchange = BoundaryExchange([('a', 'b'), ('b', 'a')], max_players=3)
+        try:
+            player_ids = ['p0', 'p1', 'p2']
+            exchange.write(5, ('b', 'a'), {'p2': 1.5, 'p0': 0.25}, {'p0': 0, 'p1': 1, 'p2': 2})
+            self.assertIsNone(exchange.read(5, ('a', 'b'), player_ids))
+            self.assertIsNone(exchange.read(6, ('b', 'a'), player_ids))  # the other buffer
+            movements = exchange.read(5, ('b', 'a'), player_ids)
+            self.assertEqual(list(movements.items()), [('p2', 1.5), ('p0', 0.25)])
+            self.assertIsNone(exchange.read(5, ('b', 'a'), player_ids))
+        finally:
+            exchange.close()
+            exchange.memory.unlink()
+
+
+class PartitionedGameTestCase(TestCase):
+    def play(self, game):
+        alice = game.create_player(OfflineConnection(), '(0, 0)', 'alice')
+        bob = game.create_player(OfflineConnection(), '(3, 3)', 'bob')
+        for frame in range(250):
+            if frame == 0:
+                game.submit_commands(alice, disposition_command('(0, 0)', 5, {'(1, 0)': 1, '(0, 1)': 2}))
+                game.submit_commands(bob, {'type': 'route', 'data': {'source': '(3, 3)', 'destination': '(0, 3)', 'target': 3}})
+            if frame == 80:
+                game.submit_commands(alice, disposition_command('(1, 0)', 2, {'(1, 1)': 1, '(2, 0)': 3}))
+            if frame == 200:
+                game.remove_player(bob)
+            game.simulate_frame(0.2 if frame < 100 else 0.25)
+
+    def state(self, game):
+        for node in game.nodes.values():
+            game.wake(node)
+        return {
+            'units': {node_id: node.units for node_id, node in game.nodes.items() if node.units},
+            'incoming': {node_id: {c.id: m for c, m in node.incoming.items()} for node_id, node in game.nodes.items() if node.incoming},
+            'flows': {
+                connection.id: connection.flow_state
+                for node in game.nodes.values()
+                for connection in node.connections.values()
+            },
+        }
+
+    def assert_same_as_single_process(self, regions, **kwargs):
+        make_nodes = functools.partial(make_map, 'square', 4, 0)
+        settings = {'decay_rate': 0.1, 'starting_units': 10, 'offensive_force': 1, **kwargs}
+        game = Game(nodes=make_nodes(), **settings)
+        self.play(game)
+        partitioned = PartitionedGame(make_nodes, regions, **settings)
+        try:
+            self.play(partitioned)
+            partitioned.sync()
+        finally:
+            partitioned.close()
+        self.assertEqual(partitioned.frame, 250)
+        self.assertEqual(self.state(partitioned), self.state(game))  # exactly the same
+
+    def test_same_as_single_process(self):
+        self.assert_same_as_single_process(3)
+
+    def test_integrator(self):
+        self.assert_same_as_single_process(2, integrator=Exponential())
+
+    def test_sleeping_nodes(self):
+        self.assert_same_as_single_process(2, sleep_nodes=True, tolerance=Tolerance(absolute=1))
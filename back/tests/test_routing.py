@@ -0,0 +1,102 @@
+from unittest import TestCase
+import json
+
+from game import Game, Node, Connection
+from map_generators import RandomGeometricMapGenerator
+from routing import Router
+
+
+def route_time(nodes, route):
+    return sum(nodes[a].connections[b].travel_time for a, b in zip(route, route[1:]))
+
+
+class RouterTestCase(TestCase):
+    def setUp(self):
+        self.nodes = RandomGeometricMapGenerator(count=200, width=200, height=200, radius=25, seed=1, production=20, throughput=1).generate()
+        self.node_ids = list(self.nodes)
+
+    def pairs(self):
+        return [(self.node_ids[i], self.node_ids[(i * 7 + 3) % len(self.node_ids)]) for i in range(0, len(self.node_ids), 10)]
+
+    def test_tables_and_search_agree(self):
+        tables = Router(self.nodes)
+        search = Router(self.nodes, table_nodes=0)
+        for source_id, destination_id in self.pairs():
+            route = tables.route(source_id, destination_id)
+            if route is None:
+                self.assertIsNone(search.route(source_id, destination_id))
+                continue
+            self.assertEqual((route[0], route[-1]), (source_id, destination_id))
+            for a, b in zip(route, route[1:]):
+                self.assertIn(b, self.nodes[a].connections)
+            self.assertAlmostEqual(route_time(self.nodes, search.route(source_id, destination_id)), route_time(self.nodes, route))
+
+    def test_shortest(self):
+        router = Router(self.nodes)
+        for source_id, destination_id in self.pairs():
+            distances = router.dijkstra(source_id, router.forward_connections)
+            route = router.route(source_id, destination_id)
+            if route is not None:
+                self.assertAlmostEqual(route_time(self.nodes, route), distances[destination_id])
+
+    def test_same_node(self):
+        self.assertEqual(Router(self.nodes).route(self.node_ids[0], self.node_ids[0]), [self.node_ids[0]])
+
+    def test_unreachable(self):
+        nodes = {
+            'a': Node('a', x=0, y=0, production=1, connections={'b': Connection('a', 'b', throughput=1, travel_time=1)}),
+            'b': Node('b', x=1, y=0, production=1, connections={}),
+        }
+        for router in (Router(nodes), Router(nodes, table_nodes=0)):
+            self.assertEqual(router.route('a', 'b'), ['a', 'b'])
+            self.assertIsNone(router.route('b', 'a'))
+
+    def test_cache(self):
+        router = Router(self.nodes, cache_size=2)
+        for destination_id in self.node_ids[:3]:
+            router.route(self.node_ids[5], destination_id)
+        router.route(self.node_ids[5], self.node_ids[1])
+        self.assertEqual(list(router.tables), [self.node_ids[2], self.node_ids[1]])
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.messages = []
+
+    def send_encoded(self, type, message):
+        self.messages.append(message)
+
+
+class RouteCommandTestCase(TestCase):
+    def setUp(self):
+        def connect(a, b, travel_time=1):
+            return Connection(a, b, throughput=1, travel_time=travel_time)
+        self.game = Game(
+            nodes={
+                'a': Node('a', x=0, y=0, production=1, connections={'b': connect('a', 'b'), 'c': connect('a', 'c', 5)}),
+                'b': Node('b', x=1, y=0, production=1, connections={'c': connect('b', 'c')}),
+                'c': Node('c', x=2, y=0, production=1, connections={}),
+            },
+            decay_rate=0.1,
+            starting_units=10,
+            offensive_force=1,
+        )
+        self.connection = RecordingConnection()
+        self.player_id = self.game.create_player(self.connection, 'a')
+
+    def test_dispositions_along_route(self):
+        self.game.submit_commands(self.player_id, {'type': 'route', 'data': {'source': 'a', 'destination': 'c', 'target': 3}})
+        self.game.apply_commands()
+        nodes = self.game.nodes
+        self.assertEqual(nodes['a'].dispositions[self.player_id].target, 3)
+        self.assertEqual(nodes['a'].dispositions[self.player_id].ratios, {'b': 1})
+        self.assertEqual(nodes['b'].dispositions[self.player_id].target, 0)
+        self.assertEqual(nodes['b'].dispositions[self.player_id].ratios, {'c': 1})
+        self.assertEqual(nodes['c'].dispositions, {})
+        self.assertTrue({nodes['a'], nodes['b']} <= self.game.needs_do_frame)
+
+    def test_errors(self):
+        for data in ({'source': 'c', 'destination': 'a'}, {'source': 'a', 'destination': 'x'}):
+            self.game.submit_commands(self.player_id, {'type': 'route', 'data': data})
+        self.game.apply_commands()
+        self.assertEqual([json.loads(m)['type'] for m in self.connection.messages], ['error', 'error'])
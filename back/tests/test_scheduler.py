@@ -0,0 +1,117 @@
+from unittest import TestCase
+import math
+
+from game import Game, Node, Connection, ObjectEngine, Tolerance
+from commands import Disposition
+from scheduler import Sleep
+
+
+class SleepTestCase(TestCase):
+    def test_units_after(self):
+        sleep = Sleep(node=None, player_id='player1', units=6, gain=3 * 0.2, ratio=1 - 0.1 * 0.2, dt=0.2, time=0)
+        units = 6
+        for _ in range(10):
+            units += 3 * 0.2 - units * 0.2 * 0.1
+        self.assertAlmostEqual(sleep.units_after(10), units)
+
+    def test_frames_until(self):
+        sleep = Sleep(node=None, player_id='player1', units=6, gain=3 * 0.2, ratio=1 - 0.1 * 0.2, dt=0.2, time=0)
+        self.assertAlmostEqual(sleep.units_after(sleep.frames_until(20)), 20)
+        self.assertEqual(sleep.frames_until(40), math.inf)  # beyond equilibrium
+        self.assertEqual(sleep.frames_until(5), math.inf)  # units grow
+
+    def test_frames_until_without_decay(self):
+        sleep = Sleep(node=None, player_id='player1', units=6, gain=1, ratio=1, dt=0.2, time=0)
+        self.assertEqual(sleep.frames_until(10), 4)
+
+
+class CountingEngine(ObjectEngine):
+    def __init__(self):
+        self.stepped = 0
+
+    def nodes_frame(self, game, nodes, dt):
+        self.stepped += len(nodes)
+        return super().nodes_frame(game, nodes, dt)
+
+
+class SleepSchedulerTestCase(TestCase):
+    def make_game(self, **kwargs):
+        game = Game(
+            nodes={
+                'node0': Node('node0', x=0, y=0, production=3, connections={
+                    'node1': Connection('node0', 'node1', throughput=1, travel_time=1),
+                }),
+                'node1': Node('node1', x=1, y=0, production=3, connections={}),
+            },
+            decay_rate=0.1,
+            starting_units=1,
+            offensive_force=1,
+            engine=CountingEngine(),
+            **kwargs
+        )
+        game.nodes['node0'].units = {'player1': 6}
+        game.nodes['node0'].dispositions = {'player1': Disposition(20, {'node1': 1})}
+        game.needs_do_frame.add(game.nodes['node0'])
+        return game
+
+    def test_same_results_as_stepping(self):
+        game = self.make_game()
+        sleeping_game = self.make_game(tolerance=Tolerance(absolute=2), sleep_nodes=True)
+        for _ in range(100):
+            game.do_frame(0.2)
+            sleeping_game.do_frame(0.2)
+            for node in sleeping_game.nodes.values():
+                if node not in sleeping_game.scheduler.sleeping:
+                    self.assertAlmostEqual(node.units.get('player1', 0), game.nodes[node.id].units.get('player1', 0))
+        self.assertEqual(
+            sleeping_game.nodes['node0'].connections['node1'].movements.keys(),
+            game.nodes['node0'].connections['node1'].movements.keys(),
+        )
+        self.assertLess(sleeping_game.engine.stepped, game.engine.stepped / 2)
+
+    def test_varying_dt(self):
+        game = self.make_game()
+        sleeping_game = self.make_game(tolerance=Tolerance(absolute=2), sleep_nodes=True)
+        for g in (game, sleeping_game):
+            g.nodes['node0'].dispositions = {'player1': Disposition(100, {'node1': 1})}  # growing, never sending
+        for frame in range(100):
+            dt = 0.6 if frame % 2 else 0.05
+            game.do_frame(dt)
+            sleeping_game.do_frame(dt)
+        node = sleeping_game.nodes['node0']
+        sleeping_game.wake(node)
+        self.assertAlmostEqual(node.units['player1'], game.nodes['node0'].units['player1'], delta=2)
+        self.assertLess(sleeping_game.engine.stepped, game.engine.stepped / 2)
+
+    def test_exact_tolerance_steps_every_frame(self):
+        game = self.make_game(sleep_nodes=True)
+        units = 6
+        for _ in range(5):
+            game.do_frame(0.2)
+            units += 3 * 0.2 - units * 0.2 * 0.1
+            self.assertAlmostEqual(game.nodes['node0'].units['player1'], units)
+        self.assertEqual(game.engine.stepped, 5)
+
+    def test_wake_on_disposition(self):
+        game = self.make_game(tolerance=Tolerance(absolute=2), sleep_nodes=True)
+        node = game.nodes['node0']
+        game.do_frame(0.2)
+        self.assertIn(node, game.scheduler.sleeping)
+        game.do_frame(0.2)
+        game.submit_commands('player1', {'type': 'disposition', 'data': {
+            'node_id': 'node0',
+            'disposition': {'target': 5, 'ratios': {'node1': 1}},
+        }})
+        game.do_frame(0.2)
+        self.assertNotIn(node, game.scheduler.sleeping)
+        self.assertEqual(node.units, {'player1': 5})
+
+    def test_rate_updates_sleeping_sent_as_constant(self):
+        game = self.make_game(tolerance=Tolerance(absolute=2), sleep_nodes=True, rate_updates=True)
+        node = game.nodes['node0']
+        node.broadcast_units = {'player1': 6}
+        node.broadcast_rates = {'player1': 2.4}
+        game.do_frame(0.2)
+        self.assertIn(node, game.scheduler.sleeping)
+        self.assertEqual(node.rates, {})
+        self.assertTrue(node.units_drifted(game.tolerance, game.time))
@@ -0,0 +1,162 @@
+from unittest import TestCase
+import io
+import os
+import tempfile
+
+from game import Game, Tolerance
+from map_generators import SquareMapGenerator
+from snapshots import CommandLog, OfflineConnection, SnapshotWriter, capture, encode, decode, restore, replay, read_log, load_latest
+
+
+def disposition_command(node_id, target, ratios):
+    return {'type': 'disposition', 'data': {'node_id': node_id, 'disposition': {'target': target, 'ratios': ratios}}}
+
+
+def make_game(**kwargs):
+    return Game(
+        nodes=SquareMapGenerator(x=4, y=4, distance=25, production=20, throughput=1).generate(),
+        decay_rate=0.1,
+        starting_units=10,
+        offensive_force=1,
+        **kwargs
+    )
+
+
+class SnapshotTestCase(TestCase):
+
+    def play(self, game, snapshot_frame=None, remove_bob=False):
+        """Play a scripted match of 60 frames, return snapshot taken after `snapshot_frame` frames."""
+        snapshot = None
+        alice = bob = None
+        for frame in range(60):
+            if frame == 0:
+                alice = game.create_player(OfflineConnection(), '(0, 0)')
+                game.submit_commands(alice, disposition_command('(0, 0)', 5, {'(1, 0)': 1, '(0, 1)': 2}))
+            if frame == 3:
+                bob = game.create_player(OfflineConnection(), '(3, 3)')
+                game.submit_commands(bob, [
+                    disposition_command('(3, 3)', 5, {'(2, 3)': 1}),
+                    disposition_command('(2, 3)', 1, {'(1, 3)': 1, '(2, 2)': 1}),
+                ])
+            if frame == 25:
+                game.submit_commands(alice, disposition_command('(1, 0)', 2, {'(1, 1)': 1, '(2, 0)': 3}))
+            if frame == 40:
+                game.submit_commands(bob, disposition_command('(2, 2)', 0, {'(1, 2)': 1}))
+            if frame == 50 and remove_bob:
+                game.disconnect(bob)
+                game.remove_player(bob)
+            game.simulate_frame(0.2 if frame < 30 else 0.25)
+            if frame + 1 == snapshot_frame:
+                snapshot = decode(encode(capture(game)))
+        return snapshot
+
+    def state(self, game):
+        return {
+            'players': set(game.players),
+            'units': {node_id: node.units for node_id, node in game.nodes.items() if node.units},
+            'flows': {
+                connection.id: connection.flow_state
+                for node in game.nodes.values()
+                for connection in node.connections.values()
+            },
+            'time': game.time,
+        }
+
+    def assert_replays(self, snapshot_frame, remove_bob=False, **kwargs):
+        log = io.StringIO()
+        game = make_game(command_log=CommandLog(log), **kwargs)
+        snapshot = self.play(game, snapshot_frame, remove_bob)
+
+        restored = make_game(**kwargs)
+        if snapshot is not None:
+            restore(restored, snapshot)
+            self.assertEqual(restored.frame, snapshot_frame)
+        log.seek(0)
+        replay(restored, read_log(log))
+        while restored.frame < game.frame:
+            restored.simulate_frame(0.25)
+        self.assertEqual(self.state(restored), self.state(game))  # exactly the same
+
+    def test_replay_from_start(self):
+        self.assert_replays(None)
+
+    def test_restore_and_replay(self):
+        self.assert_replays(20)
+
+    def test_restore_sleeping(self):
+        self.assert_replays(35, sleep_nodes=True, tolerance=Tolerance(absolute=1))
+
+    def test_replay_removed_player(self):
+        self.assert_replays(20, remove_bob=True)
+
+    def test_restored_players_reconnect(self):
+        game = make_game()
+        self.play(game)
+        restored = make_game()
+        restore(restored, decode(encode(capture(game))))
+        for player_id, player in game.players.items():
+            self.assertFalse(restored.players[player_id].connected)
+            self.assertEqual(restored.join(OfflineConnection(), player.token), player_id)
+            self.assertTrue(restored.players[player_id].connected)
+
+    def test_log(self):
+        log = io.StringIO()
+        game = make_game(command_log=CommandLog(log))
+        self.play(game)
+        entries = list(read_log(io.StringIO(log.getvalue())))
+        alice = entries[0]['join']
+        self.assertEqual(entries[0], {'frame': 0, 'join': alice, 'node': '(0, 0)', 'token': game.players[alice].token})
+        self.assertEqual(entries[1], {'frame': 0, 'dt': 0.2})
+        self.assertEqual([e['frame'] for e in entries if 'dt' in e], [0, 30])
+        self.assertEqual([e['frame'] for e in entries if 'command' in e], [0, 3, 3, 25, 40])
+
+    def test_read_log_cut_off(self):
+        log = io.StringIO('{"frame": 0, "dt": 0.2}\n{"frame": 1, "pla')
+        self.assertEqual(list(read_log(log)), [{'frame': 0, 'dt': 0.2}])
+
+    def test_restore_other_map(self):
+        game = make_game()
+        snapshot = capture(game)
+        snapshot['terrain'] = 'other'
+        with self.assertRaises(ValueError):
+            restore(make_game(), snapshot)
+
+    def test_snapshot_of_idle_state_only(self):
+        game = make_game()
+        game.create_player(OfflineConnection(), '(0, 0)')
+        snapshot = capture(game)
+        self.assertEqual([node_id for node_id, *_ in snapshot['nodes']], ['(0, 0)'])
+        self.assertEqual(snapshot['connections'], [])
+
+
+class SnapshotWriterTestCase(TestCase):
+    def test_writes_and_keeps_newest(self):
+        game = make_game()
+        player_id = game.create_player(OfflineConnection(), '(0, 0)')
+        with tempfile.TemporaryDirectory() as directory:
+            writer = SnapshotWriter(directory, interval=2, keep=2)
+            for _ in range(8):
+                game.simulate_frame(0.2)
+                writer.maybe_take(game)
+                if not writer.queue.empty():
+                    writer.write(writer.queue.get_nowait())  # as the writer thread would
+            self.assertEqual(sorted(os.listdir(directory)), ['snapshot-0000000006.bin', 'snapshot-0000000008.bin'])
+            snapshot = load_latest(directory)
+        self.assertEqual(snapshot['frame'], 8)
+        self.assertEqual(snapshot['players'], {player_id: ('red', game.players[player_id].token)})
+
+    def test_skips_when_busy(self):
+        game = make_game()
+        with tempfile.TemporaryDirectory() as directory:
+            writer = SnapshotWriter(directory, interval=1)
+            game.simulate_frame(0.2)
+            writer.maybe_take(game)
+            game.simulate_frame(0.2)
+            with self.assertLogs('snapshots', 'WARNING'):
+                writer.maybe_take(game)
+            self.assertEqual(writer.queue.get_nowait()['frame'], 1)
+
+    def test_load_latest_missing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(load_latest(directory))
+            self.assertIsNone(load_latest(os.path.join(directory, 'nothing')))
@@ -0,0 +1,31 @@
+from unittest import TestCase
+import json
+
+from map_generators import SquareMapGenerator
+from terrain import Terrain
+
+
+class TerrainTestCase(TestCase):
+    def setUp(self):
+        self.nodes = SquareMapGenerator(x=4, y=3, distance=25, production=20, throughput=1).generate()
+
+    def test_encoded_once(self):
+        terrain = Terrain(self.nodes, tile_size=50)
+        self.assertIs(terrain.encoded_map, terrain.encoded_map)
+        message = json.loads(terrain.encoded_map)
+        self.assertEqual(message['type'], 'map')
+        self.assertEqual(message['data'].keys(), self.nodes.keys())
+
+    def test_version(self):
+        version = Terrain(self.nodes, tile_size=50).version
+        self.assertEqual(Terrain(self.nodes, tile_size=100).version, version)
+        other_nodes = SquareMapGenerator(x=4, y=3, distance=25, production=10, throughput=1).generate()
+        self.assertNotEqual(Terrain(other_nodes, tile_size=50).version, version)
+
+    def test_tiles(self):
+        terrain = Terrain(self.nodes, tile_size=50)
+        info = json.loads(terrain.encoded_info)['data']
+        self.assertEqual(info['tiles'], {'0,0': 4, '1,0': 4, '0,1': 2, '1,1': 2})
+        tile = json.loads(terrain.encoded_tile('1,1'))['data']
+        self.assertEqual(tile['version'], terrain.version)
+        self.assertEqual(set(tile['nodes']), {'(2, 2)', '(3, 2)'})
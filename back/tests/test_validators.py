@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from validators import (
+    ValidationError,
+    string_validator, float_validator, non_negative_float_validator,
+    union_validator, dict_validator, record_validator, array_validator,
+)
+
+
+class Point:
+    def __init__(self, x, y, label=None):
+        self.x = x
+        self.y = y
+        self.label = label
+
+
+class ValidatorsTestCase(TestCase):
+    def setUp(self):
+        self.validator = union_validator({
+            'points': array_validator(record_validator(Point, {
+                'x': float_validator,
+                'y': float_validator,
+            }, {
+                'label': string_validator,
+            }), max_length=3),
+            'weights': dict_validator(float_validator, max_length=2),
+        })
+
+    def assertInvalid(self, data, path):
+        with self.assertRaises(ValidationError) as cm:
+            self.validator(data)
+        self.assertEqual(cm.exception.path, path)
+        return cm.exception
+
+    def test_valid(self):
+        points = self.validator({'type': 'points', 'data': [{'x': 1, 'y': 2}, {'x': 3, 'y': 4, 'label': 'a'}]})
+        self.assertEqual([(p.x, p.y, p.label) for p in points], [(1, 2, None), (3, 4, 'a')])
+        self.assertEqual(self.validator({'type': 'weights', 'data': {'a': '1.5'}}), {'a': 1.5})
+
+    def test_error_path(self):
+        self.assertInvalid({'type': 'points', 'data': [{'x': 1, 'y': 2}, {'x': 1, 'y': {}}]}, ('data', 1, 'y'))
+        self.assertInvalid({'type': 'points', 'data': [{'x': 1, 'y': 2, 'z': 3}]}, ('data', 0))
+        self.assertInvalid({'type': 'weights', 'data': {'a': 'heavy'}}, ('data', 'a'))
+        self.assertInvalid({'type': ['points'], 'data': []}, ())
+
+    def test_limits(self):
+        error = self.assertInvalid({'type': 'points', 'data': [{'x': 1, 'y': 2}] * 4}, ('data',))
+        self.assertEqual(error.msg, 'expected at most 3 items')
+        self.assertInvalid({'type': 'weights', 'data': {'a': 1, 'b': 2, 'c': 3}}, ('data',))
+
+    def test_string_is_not_converted(self):
+        with self.assertRaises(ValidationError):
+            string_validator([1, 2])
+
+    def test_float_finite(self):
+        for value in ('nan', 'inf', float('-inf'), float('nan'), 1e400):
+            with self.subTest(value=value), self.assertRaises(ValidationError):
+                float_validator(value)
+        self.assertEqual(non_negative_float_validator(0), 0)
+        with self.assertRaises(ValidationError):
+            non_negative_float_validator(-1)
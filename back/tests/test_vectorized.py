@@ -0,0 +1,67 @@
+from unittest import TestCase
+import random
+
+from game import Game, ObjectEngine
+from commands import Disposition
+from integrators import EULER, INTEGRATORS
+from map_generators import SquareMapGenerator
+from vectorized import VectorizedEngine
+from tests import test_game
+
+
+class VectorizedNodeTestCase(test_game.NodeTestCase):
+    engine_class = VectorizedEngine
+
+
+class VectorizedConnectionTestCase(test_game.ConnectionTestCase):
+    engine_class = VectorizedEngine
+
+
+class EnginesEquivalenceTestCase(TestCase):
+    def make_game(self, engine, integrator=EULER):
+        game = Game(
+            SquareMapGenerator(
+                x=4, y=4, distance=5,
+                production=3, throughput=1,
+            ).generate(),
+            decay_rate=0.1,
+            starting_units=10,
+            offensive_force=1,
+            engine=engine,
+            integrator=integrator,
+        )
+        rnd = random.Random(1)
+        for node in game.nodes.values():
+            for player_id in rnd.sample(['p1', 'p2', 'p3', 'p4'], rnd.randint(0, 4)):
+                node.units[player_id] = rnd.uniform(1, 20)
+                if rnd.random() < 0.5:
+                    node.set_disposition(player_id, Disposition(
+                        rnd.uniform(0, 15),
+                        {target_node_id: rnd.random() for target_node_id in node.connections},
+                    ))
+        game.needs_do_frame.update(game.nodes.values())
+        return game
+
+    def assertUnitsAlmostEqual(self, units, expected_units):
+        self.assertEqual(units.keys(), expected_units.keys())
+        for player_id, u in units.items():
+            self.assertAlmostEqual(u, expected_units[player_id])
+
+    def test_same_results(self):
+        for integrator in INTEGRATORS.values():
+            with self.subTest(integrator=integrator.name):
+                self.assert_same_results(integrator)
+
+    def assert_same_results(self, integrator):
+        game = self.make_game(ObjectEngine(), integrator)
+        vectorized_game = self.make_game(VectorizedEngine(), integrator)
+        for _ in range(50):
+            game.do_frame(0.2)
+            vectorized_game.do_frame(0.2)
+        for node_id, node in game.nodes.items():
+            self.assertUnitsAlmostEqual(vectorized_game.nodes[node_id].units, node.units)
+            for target_node_id, connection in node.connections.items():
+                self.assertUnitsAlmostEqual(
+                    vectorized_game.nodes[node_id].connections[target_node_id].movements,
+                    connection.movements,
+                )
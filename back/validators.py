@@ -1,72 +1,135 @@
+"""Validators turning user data (parsed JSON) into objects.
+
+Validator is a function of data, built once and reused for every message.
+Path of the invalid value is collected only when validation fails, while the
+error propagates through the enclosing validators. Nesting depth is bounded
+by the validators themselves - they don't descend deeper than the schema.
+"""
+import math
+
 
 class ValidationError(Exception):
-    def __init__(self, msg, path):
+    def __init__(self, msg, path=()):
         self.msg = msg
         self.path = path
 
     def __str__(self):
         return 'at path {}: {}'.format(self.path, self.msg)
 
+    def at(self, key):
+        """Prepend key to the path, when passing the error to the enclosing validator."""
+        self.path = (key,) + self.path
+        return self
+
 
-def float_validator(data, path):
+def float_validator(data):
     try:
-        return float(data)
-    except (OverflowError, ValueError):
-        raise ValidationError('expected float', path)
+        value = float(data)
+    except (OverflowError, ValueError, TypeError):
+        raise ValidationError('expected float')
+    if not math.isfinite(value):  # JSON parser lets NaN and Infinity through
+        raise ValidationError('expected finite float')
+    return value
 
 
-def string_validator(data, path):
-    try:
-        return str(data)
-    except ValueError:
-        raise ValidationError('expected string', path)
+def non_negative_float_validator(data):
+    value = float_validator(data)
+    if value < 0:
+        raise ValidationError('expected non-negative float')
+    return value
+
+
+def string_validator(data):
+    if not isinstance(data, str):
+        raise ValidationError('expected string')
+    return data
 
 
-def blank_value_validator(data, path):
+def choice_validator(choices):
+    def validate(data):
+        if data not in choices:
+            raise ValidationError('expected one of {}'.format(choices))
+        return data
+    return validate
+
+
+def blank_value_validator(data):
     if data is not None:
-        raise ValidationError('expected blank value', path)
+        raise ValidationError('expected blank value')
     return None
 
 
-def dict_validator(value_validator):
-    def validate(data, path):
+def check_length(data, max_length):
+    if max_length is not None and len(data) > max_length:
+        raise ValidationError('expected at most {} items'.format(max_length))
+
+
+def dict_validator(value_validator, max_length=None):
+    def validate(data):
         if not isinstance(data, dict):
-            raise ValidationError('expected dict', path)
-        return {k: value_validator(v, path + (k,)) for k, v in data.items()}
+            raise ValidationError('expected dict')
+        check_length(data, max_length)
+        validated = {}
+        for k, v in data.items():
+            try:
+                validated[k] = value_validator(v)
+            except ValidationError as e:
+                raise e.at(k)
+        return validated
     return validate
 
 
-def array_validator(value_validator):
-    def validate(data, path):
+def array_validator(value_validator, max_length=None):
+    def validate(data):
         if not isinstance(data, list):
-            raise ValidationError('expected list', path)
-        return [
-            value_validator(e, path + (i,))
-            for i, e in enumerate(data)
-        ]
+            raise ValidationError('expected list')
+        check_length(data, max_length)
+        validated = []
+        for i, e in enumerate(data):
+            try:
+                validated.append(value_validator(e))
+            except ValidationError as error:
+                raise error.at(i)
+        return validated
     return validate
 
 
-def record_validator(constructor, validators_dict):
-    def validate(data, path):
+def record_validator(constructor, validators_dict, optional_validators_dict=None):
+    optional_validators_dict = optional_validators_dict or {}
+    all_validators_dict = {**validators_dict, **optional_validators_dict}
+    required_keys = validators_dict.keys()
+    all_keys = all_validators_dict.keys()
+
+    def validate(data):
         if not isinstance(data, dict):
-            raise ValidationError('expected dict', path)
-        if validators_dict.keys() != data.keys():
-            raise ValidationError('expected keys {}'.format(validators_dict.keys()), path)
-        return constructor(**{
-            k: validate(data[k], path + (k,))
-            for k, validate in validators_dict.items()
-        })
+            raise ValidationError('expected dict')
+        if not required_keys <= data.keys() <= all_keys:
+            if optional_validators_dict:
+                raise ValidationError('expected keys {} and optionally {}'.format(
+                    required_keys, optional_validators_dict.keys(),
+                ))
+            raise ValidationError('expected keys {}'.format(required_keys))
+        kwargs = {}
+        for k, v in data.items():
+            try:
+                kwargs[k] = all_validators_dict[k](v)
+            except ValidationError as e:
+                raise e.at(k)
+        return constructor(**kwargs)
     return validate
 
 
 def union_validator(union_options):
-    def validate(data, path):
+    def validate(data):
         if not isinstance(data, dict):
-            raise ValidationError('expected dict', path)
-        if {'type', 'data'} != data.keys():
-            raise ValidationError('expected keys \{\'type\', \'data\'\}', path)
-        if data['type'] not in union_options.keys():
-            raise ValidationError('\'type\' must be one of {}'.format(union_options.keys()), path)
-        return union_options[data['type']](data['data'], path + ('data',))
+            raise ValidationError('expected dict')
+        if data.keys() != {'type', 'data'}:
+            raise ValidationError("expected keys {'type', 'data'}")
+        option = union_options.get(data['type']) if isinstance(data['type'], str) else None
+        if option is None:
+            raise ValidationError('\'type\' must be one of {}'.format(union_options.keys()))
+        try:
+            return option(data['data'])
+        except ValidationError as e:
+            raise e.at('data')
     return validate
@@ -0,0 +1,145 @@
+import itertools
+
+import numpy as np
+
+from game import ObjectEngine
+from integrators import Euler
+
+
+class VectorizedEngine(ObjectEngine):
+    """Simulation engine doing the node pass as batched array operations.
+
+    State of the stepped nodes is packed into dense `nodes x players` arrays,
+    production, decay, incoming, battle and outgoing are computed for all of
+    them at once and the results are written back to node objects whose units
+    changed, so the rest of the game keeps working with plain dicts. Movements
+    are set only on connections sending now or before. Connections are stepped
+    one by one - their pipelines are short lists of variable length.
+    """
+
+    def nodes_frame(self, game, nodes, dt):
+        if len(nodes) == 0:
+            return set()
+
+        # every node's dicts are flattened by C iteration (chain, fromiter, map) rather than element by element
+        chain = itertools.chain.from_iterable
+        player_ids = list(dict.fromkeys(chain(itertools.chain(
+            (node.units for node in nodes),
+            chain(node.incoming.values() for node in nodes),
+        ))))
+        player_index = {player_id: j for j, player_id in enumerate(player_ids)}
+        column = player_index.__getitem__
+        row_numbers = np.arange(len(nodes))
+
+        shape = (len(nodes), len(player_ids))
+        production = np.fromiter((node.production for node in nodes), float, len(nodes))[:, None]
+
+        units_counts = np.fromiter(map(len, (node.units for node in nodes)), int, len(nodes))
+        units_rows = np.repeat(row_numbers, units_counts)
+        units_cols = np.fromiter(map(column, chain(node.units for node in nodes)), int, len(units_rows))
+        units_values = np.fromiter(chain(node.units.values() for node in nodes), float, len(units_rows))
+
+        # units arriving during this frame
+        incoming_counts = np.fromiter((sum(map(len, node.incoming.values())) for node in nodes), int, len(nodes))
+        incoming_rows = np.repeat(row_numbers, incoming_counts)
+        incoming_cols = np.fromiter(map(column, chain(chain(node.incoming.values()) for node in nodes)), int, len(incoming_rows))
+        incoming_values = np.fromiter(
+            chain(chain(movement.values() for movement in node.incoming.values()) for node in nodes), float, len(incoming_rows),
+        ) * dt
+
+        # disposition targets, of players present
+        target_rows, target_cols, target_values = [], [], []
+        for i, node in enumerate(nodes):
+            if node.dispositions:
+                for player_id, disposition in node.dispositions.items():
+                    j = player_index.get(player_id)
+                    if j is not None:
+                        target_rows.append(i)
+                        target_cols.append(j)
+                        target_values.append(disposition.target)
+
+        units = np.zeros(shape)
+        units[units_rows, units_cols] = units_values
+        present = np.zeros(shape, dtype=bool)  # player has an entry in node.units
+        present[units_rows, units_cols] = True
+        incoming = np.zeros(shape)
+        np.add.at(incoming, (incoming_rows, incoming_cols), incoming_values)
+        receiving = np.zeros(shape, dtype=bool)
+        receiving[incoming_rows, incoming_cols] = True
+        target = np.full(shape, np.inf)
+        target[target_rows, target_cols] = target_values
+
+        # production (split proportionally to units present) and decay
+        total = units.sum(axis=1, keepdims=True)
+        share = np.divide(units, total, out=np.zeros(shape), where=total > 0)
+
+        # battle - each player's units attack all the other players proportionally
+        # to their units, so damage taken by a defender is
+        # defender_units * sum(attacker_units / other_units) over attackers
+        others = total - units
+        attack = np.divide(units, others, out=np.zeros(shape), where=others > 0)
+        attack_sum = attack.sum(axis=1, keepdims=True)
+
+        if isinstance(game.integrator, Euler):
+            new_units = units + production * dt * share - units * dt * game.decay_rate + incoming
+            new_units -= units * (attack_sum - attack) * dt * game.offensive_force
+        else:
+            gain = production * share + incoming / dt
+            loss = game.decay_rate + (attack_sum - attack) * game.offensive_force
+            held = (units >= target) & (gain >= loss * units)  # at the target, sending the rest - linear, exactly
+            new_units = np.where(held, units + (gain - loss * units) * dt, game.integrator.step_array(units, gain, loss, dt))
+
+        # clean irrelevant units
+        new_present = (present & (new_units > 0)) | (receiving & ~present)
+
+        # outgoing
+        over = new_present & (new_units > target)
+        surplus = np.where(over, new_units - target, 0)
+        new_units = np.where(over, target, new_units)
+
+        changed_objects = set()
+        tolerance = game.tolerance
+        presence_changed = (present != new_present).any(axis=1)
+        both_present = present & new_present
+        # stepped as long as units change at all, tolerance only decides sending them
+        units_changed = presence_changed | (both_present & (new_units != units)).any(axis=1)
+        sending_players = [[] for node in nodes]  # node -> [(player_id, over_target)]
+        rows, cols = np.nonzero(over)
+        for i, j, over_target in zip(rows.tolist(), cols.tolist(), surplus[over].tolist()):
+            sending_players[i].append((player_ids[j], over_target))
+        for node, players in zip(nodes, sending_players):
+            sending = {}
+            for player_id, over_target in players:
+                for target_node_id, ratio in node.dispositions[player_id].ratios.items():
+                    sending.setdefault(target_node_id, {})[player_id] = over_target * ratio / dt
+            for target_node_id, connection in node.connections.items():
+                movements = sending.get(target_node_id)
+                if movements is None:
+                    if not connection.movements:
+                        continue  # nothing sent before nor now, setting it would be no change
+                    movements = {}
+                ch = connection.set_movements(movements, tolerance)
+                if ch:
+                    changed_objects.update(ch)
+                    changed_objects.add(node)
+
+        new_units_data = {i: {} for i in np.flatnonzero(units_changed).tolist()}
+        write_back = new_present & units_changed[:, None]
+        rows, cols = np.nonzero(write_back)
+        for i, j, u in zip(rows.tolist(), cols.tolist(), new_units[write_back].tolist()):
+            new_units_data[i][player_ids[j]] = u
+        for i, units_data in new_units_data.items():
+            nodes[i].units = units_data
+        for i in np.flatnonzero(units_changed).tolist():
+            changed_objects.add(nodes[i])
+
+        if game.rate_updates:
+            rates = (new_units - units) / dt
+            new_rates = [{} for node in nodes]
+            rows, cols = np.nonzero(new_present)
+            for i, j, r in zip(rows.tolist(), cols.tolist(), rates[new_present].tolist()):
+                new_rates[i][player_ids[j]] = r
+            for node, rates_data in zip(nodes, new_rates):
+                node.rates = rates_data
+
+        return changed_objects
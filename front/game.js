@@ -311,8 +311,9 @@ class Game {
 			game.animations = game.animations.filter(a => a(time));
 		}, this.unitsLayer)).start();
 
-		// connect to ws
-		this.sock = new WebSocket(wsAddr);
+		// connect to ws, as the same player after a reload or a dropped connection
+		let token = sessionStorage.getItem('token');
+		this.sock = new WebSocket(token ? wsAddr + '?token=' + encodeURIComponent(token) : wsAddr);
 		this.sock.onopen = (event) => {
 			console.log('connected to the server');
 			this.sock.send(JSON.stringify({type: 'map', data: {}})); // ask for a map
@@ -322,14 +323,24 @@ class Game {
 			console.log('got message', parsed.type);
 			({
 				map: map => game._loadMap(map),
+				map_info: info => {},
+				session: data => {
+					game.playerId = data.player_id;
+					sessionStorage.setItem('token', data.token);
+				},
 				player: data => {
 					for (let playerId in data) {
 						game.players.set(playerId, data[playerId]);
 					}
 				},
-				units: data => ({
-					node: (id, units) => game.updateUnits(id, obj2map(units)),
-				})[data.type](data.id, data.units),
+				units: batch => {
+					for (let data of batch) {
+						({
+							node: (id, units) => game.updateUnits(id, obj2map(units)),
+							connection: (id, units) => {},
+						})[data.type](data.id, data.units);
+					}
+				},
 			})[parsed.type](parsed.data);
 		};
 	}